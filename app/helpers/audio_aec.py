@@ -0,0 +1,676 @@
+from collections.abc import Sequence
+from functools import cache
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+_AMP_FLOOR = 1e-5  # -100 dB, replaces the relative "top_db" clipping of the reference implementation
+_FREQ_MASK_SMOOTH_HZ = 500  # Frequency smoothing of the mask
+_N_FFT = 128  # Quality, 8 ms at 16 kHz
+_N_STD_THRESH = 1.5  # Number of standard deviations above the noise mean to consider a bin as signal
+_PROP_DECREASE = 0.75  # Reduce noise by 75%
+_TIME_MASK_SMOOTH_MS = 50  # Time smoothing of the mask
+
+
+class EchoCanceller:
+    """
+    Echo cancellation engine for a single audio stream.
+
+    Implements a stationary spectral gate, using the bot voice as noise reference. Reference spectra are computed once per packet and stored in a circular buffer, noise statistics are updated incrementally, so the reference is never transformed twice.
+
+    Packets of many engines can be processed in a single vectorized pass, with `process_batch`. Intermediate arrays are preallocated and shared by the engines of a same configuration, processing does not allocate memory, except for the returned PCM bytes.
+
+    Algorithm and defaults are derived from `noisereduce.reduce_noise(stationary=True, n_fft=128, prop_decrease=0.75)`. Output is not identical: there is no 30k samples padding per call, the amplitude floor is absolute, and the mask smoothing is normalized at the edges.
+
+    Persistent state (noise reference and statistics) can be stored in an external buffer, like a shared memory block, so the engine can be used from multiple processes. Only one process must use it at a time.
+
+    Input and output formats are in PCM 16-bit, 1 channel.
+    """
+
+    __slots__ = (
+        "_noise_sq_sum",
+        "_noise_sum",
+        "_noise_thresh",
+        "_reference_tail",
+        "_ring",
+        "_ring_cursor",
+        "_workspace",
+    )
+
+    def __init__(
+        self,
+        sample_rate: int,
+        max_delay_ms: int = 200,
+        packet_duration_ms: int = 20,
+        state: memoryview | None = None,
+        initialize: bool = True,
+    ):
+        """
+        Initialize the engine.
+
+        Parameters:
+        - `initialize`: Reset the state, set to False when attaching to a state already initialized by another engine.
+        - `max_delay_ms`: Maximum delay to consider between the raw and reference audio, it is the length of the noise reference.
+        - `packet_duration_ms`: Duration of each audio packet in milliseconds.
+        - `sample_rate`: Audio sample rate in Hz.
+        - `state`: External buffer for the persistent state, of `state_size` bytes. If not provided, it is allocated.
+        """
+        self._workspace = _workspace(
+            packet_duration_ms=packet_duration_ms,
+            sample_rate=sample_rate,
+        )
+
+        # Persistent state, mapped on the buffer in the layout order
+        layout = _state_layout(
+            max_delay_ms=max_delay_ms,
+            packet_duration_ms=packet_duration_ms,
+            sample_rate=sample_rate,
+        )
+        if state is None:
+            state = memoryview(bytearray(_layout_size(layout)))
+        offset = 0
+        for name, shape, dtype in layout:
+            array = np.ndarray(shape, buffer=state, dtype=dtype, offset=offset)
+            setattr(self, name, array)
+            offset += array.nbytes
+
+        if initialize:
+            self._reference_tail.fill(0)
+            self._ring.fill(self._workspace.silent_db)  # Initialized with silence
+            self._ring_cursor.fill(0)
+            self._resync_noise()
+
+    @staticmethod
+    def state_size(
+        sample_rate: int,
+        max_delay_ms: int = 200,
+        packet_duration_ms: int = 20,
+    ) -> int:
+        """
+        Get the size of the persistent state.
+
+        Returns the size in bytes, to allocate the external buffer.
+        """
+        return _layout_size(
+            _state_layout(
+                max_delay_ms=max_delay_ms,
+                packet_duration_ms=packet_duration_ms,
+                sample_rate=sample_rate,
+            )
+        )
+
+    def process(
+        self, input_pcm: bytes, reference_pcm: bytes | None
+    ) -> tuple[bytes, float]:
+        """
+        Process one audio packet.
+
+        If the reference is empty or silent, it is added to the noise reference and the input is returned as is.
+
+        Returns a tuple with the echo-cancelled PCM audio and its RMS (acoustic pressure), between 0 and 1.
+        """
+        output_pcm = self._workspace.output_pcm
+        rms = self.process_into(
+            input_pcm=np.frombuffer(input_pcm, dtype=np.int16),
+            output_pcm=output_pcm,
+            reference_pcm=(
+                np.frombuffer(reference_pcm, dtype=np.int16) if reference_pcm else None
+            ),
+        )
+        return output_pcm.tobytes(), rms
+
+    def process_into(
+        self,
+        input_pcm: np.ndarray,
+        output_pcm: np.ndarray,
+        reference_pcm: np.ndarray | None,
+    ) -> float:
+        """
+        Process one audio packet, from and to preallocated PCM 16-bit arrays.
+
+        Input and output can be the same array, input is fully read before the output is written.
+
+        Returns the RMS (acoustic pressure) of the output, between 0 and 1.
+        """
+        return float(
+            self.process_batch(
+                engines=[self],
+                inputs=[input_pcm],
+                outputs=[output_pcm],
+                references=[reference_pcm],
+            )[0]
+        )
+
+    @staticmethod
+    def process_batch(
+        engines: Sequence["EchoCanceller"],
+        inputs: Sequence[np.ndarray],
+        outputs: Sequence[np.ndarray],
+        references: Sequence[np.ndarray | None],
+    ) -> np.ndarray:
+        """
+        Process one audio packet for each engine, in a single vectorized pass.
+
+        Engines are grouped by configuration, each group is transformed and gated at once. Packets are PCM 16-bit arrays, input and output of an engine can be the same array. If the reference of an engine is empty or silent, it is added to its noise reference and its input is returned as is.
+
+        Returns the RMS (acoustic pressure) of each output, between 0 and 1.
+        """
+        rms = np.zeros(len(engines), dtype=np.float32)
+
+        # Group by configuration, engines of a group share the same workspace
+        groups: dict[_Workspace, list[int]] = {}
+        for i, engine in enumerate(engines):
+            groups.setdefault(engine._workspace, []).append(i)
+
+        for workspace, indexes in groups.items():
+            EchoCanceller._process_group(
+                engines=engines,
+                indexes=indexes,
+                inputs=inputs,
+                outputs=outputs,
+                references=references,
+                rms=rms,
+                workspace=workspace,
+            )
+        return rms
+
+    @staticmethod
+    def _process_group(  # noqa: PLR0913
+        engines: Sequence["EchoCanceller"],
+        indexes: list[int],
+        inputs: Sequence[np.ndarray],
+        outputs: Sequence[np.ndarray],
+        references: Sequence[np.ndarray | None],
+        rms: np.ndarray,
+        workspace: "_Workspace",
+    ) -> None:
+        """
+        Process the packets of engines sharing the same workspace.
+
+        Rows of the workspace are ordered with the gated engines first, so they are contiguous.
+        """
+        gated: list[int] = []
+        gated_references: list[np.ndarray] = []
+        silent: list[int] = []
+        for i in indexes:
+            reference = references[i]
+            if reference is None or not reference.any():
+                silent.append(i)
+            else:
+                gated.append(i)
+                gated_references.append(reference)
+        rows = gated + silent
+        workspace.reserve(len(rows))
+
+        # Convert inputs to float, in the padded buffer
+        signal = workspace.signal[: len(rows)]
+        for row, i in enumerate(rows):
+            np.multiply(
+                inputs[i],
+                1 / 32768,
+                out=signal[row],
+                casting="unsafe",
+            )
+
+        # Bot is silent, skip the noise reduction
+        for i in silent:
+            engines[i]._push_silence()
+            np.copyto(outputs[i], inputs[i])
+
+        # Update the noise references then apply the gate, output replaces the input signal
+        if gated:
+            EchoCanceller._push_references(
+                engines=[engines[i] for i in gated],
+                references=gated_references,
+                workspace=workspace,
+            )
+            workspace.gate(len(gated))
+
+        # Calculate the RMS of the outputs
+        rows_rms = workspace.rms[: len(rows)]
+        np.einsum("ij,ij->i", signal, signal, out=rows_rms)
+        np.divide(rows_rms, signal.shape[1], out=rows_rms)
+        np.sqrt(rows_rms, out=rows_rms)
+        rms[rows] = rows_rms
+
+        # Convert gated outputs to PCM
+        gated_signal = signal[: len(gated)]
+        np.multiply(gated_signal, 32767, out=gated_signal)
+        np.clip(gated_signal, -32768, 32767, out=gated_signal)
+        for row, i in enumerate(gated):
+            np.copyto(outputs[i], gated_signal[row], casting="unsafe")
+
+    @staticmethod
+    def _push_references(
+        engines: Sequence["EchoCanceller"],
+        references: Sequence[np.ndarray],
+        workspace: "_Workspace",
+    ) -> None:
+        """
+        Add a reference packet to the noise reference of each engine.
+
+        Only the frames of the new packets are transformed, the previous ones are cached in the circular buffers.
+        """
+        tail = workspace.reference_tail_size
+        signal = workspace.reference_signal[: len(engines)]
+
+        # Append each packet after the tail of the previous one
+        for row, (engine, reference) in enumerate(
+            zip(engines, references, strict=True)
+        ):
+            signal[row, :tail] = engine._reference_tail
+            np.multiply(
+                reference,
+                1 / 32768,
+                out=signal[row, tail:],
+                casting="unsafe",
+            )
+
+        # Transform
+        spectrum_db = workspace.transform_references(len(engines))
+
+        # Keep the tails for the next packets, store the spectra and gather the thresholds
+        for row, engine in enumerate(engines):
+            engine._reference_tail[:] = signal[row, -tail:]
+            engine._ring_write(spectrum_db[row])
+            workspace.noise_thresh[row, 0] = engine._noise_thresh
+
+    def _push_silence(self) -> None:
+        """
+        Add a silent packet to the noise reference.
+
+        Spectrum of silence is known, transform is skipped.
+        """
+        self._reference_tail.fill(0)
+        self._ring_write(self._workspace.silent_spectra)
+
+    def _ring_write(self, spectra: np.ndarray) -> None:
+        """
+        Write spectra to the circular buffer and update the noise statistics.
+
+        Buffer is written in contiguous slices, wrapping around at most once.
+        """
+        ring_size = self._ring.shape[0]
+        index = int(self._ring_cursor[0])
+        written = 0
+        while written < spectra.shape[0]:
+            count = min(spectra.shape[0] - written, ring_size - index)
+            ring_slice = self._ring[index : index + count]
+            new = spectra[written : written + count]
+
+            # Replace the overwritten spectra in the statistics
+            self._noise_sum -= ring_slice.sum(axis=0, dtype=np.float64)
+            self._noise_sq_sum -= np.square(ring_slice, dtype=np.float64).sum(axis=0)
+            self._noise_sum += new.sum(axis=0, dtype=np.float64)
+            self._noise_sq_sum += np.square(new, dtype=np.float64).sum(axis=0)
+            ring_slice[:] = new
+
+            # Move the write index
+            index = (index + count) % ring_size
+            written += count
+        self._ring_cursor[0] = index
+
+        # Avoid floating point drift, once per buffer rotation
+        if index < spectra.shape[0]:
+            self._resync_noise()
+            return
+
+        self._update_noise_thresh()
+
+    def _resync_noise(self) -> None:
+        """
+        Recompute the noise statistics from the circular buffer.
+        """
+        np.sum(self._ring, axis=0, dtype=np.float64, out=self._noise_sum)
+        np.sum(
+            np.square(self._ring, dtype=np.float64),
+            axis=0,
+            out=self._noise_sq_sum,
+        )
+        self._update_noise_thresh()
+
+    def _update_noise_thresh(self) -> None:
+        """
+        Update the cached noise threshold from the running statistics.
+        """
+        ring_size = self._ring.shape[0]
+        mean = self._noise_sum / ring_size
+        variance = np.maximum(self._noise_sq_sum / ring_size - mean**2, 0)
+        np.add(
+            mean,
+            np.sqrt(variance) * _N_STD_THRESH,
+            out=self._noise_thresh,
+            casting="unsafe",
+        )
+
+
+class _Workspace:
+    """
+    Constants and intermediate arrays, shared by the engines of a same configuration.
+
+    Arrays have a leading batch axis, they are grown when a larger batch is processed.
+    """
+
+    __slots__ = (
+        "capacity",
+        "chunk_size",
+        "freq_smoothing",
+        "hop",
+        "input_frames",
+        "input_signal",
+        "input_windows",
+        "mask",
+        "mask_bool",
+        "mask_tmp",
+        "noise_thresh",
+        "ola",
+        "ola_norm",
+        "output_pcm",
+        "pad",
+        "reference_frames",
+        "reference_signal",
+        "reference_spectrum",
+        "reference_spectrum_db",
+        "reference_tail_size",
+        "reference_windows",
+        "rms",
+        "signal",
+        "silent_db",
+        "silent_spectra",
+        "spectrum",
+        "spectrum_db",
+        "time_smoothing",
+        "window_analysis",
+        "window_synthesis",
+    )
+
+    def __init__(
+        self,
+        sample_rate: int,
+        packet_duration_ms: int,
+    ):
+        self.chunk_size = int(sample_rate * packet_duration_ms / 1000)
+        self.hop = _N_FFT // 4
+        self.pad = _N_FFT // 2
+        self.reference_tail_size = _N_FFT - self.hop
+        n_freq = _N_FFT // 2 + 1
+
+        if self.chunk_size % self.hop:
+            raise ValueError(
+                f"Packet size {self.chunk_size} samples must be a multiple of {self.hop} samples."
+            )
+
+        # Hann window (periodic), analysis is scaled like "scipy.signal.stft"
+        window = (0.5 - 0.5 * np.cos(2 * np.pi * np.arange(_N_FFT) / _N_FFT)).astype(
+            np.float32
+        )
+        self.window_analysis = window / window.sum()
+        self.window_synthesis = window
+
+        # Spectrum of silence, in dB, for each frame of a reference packet
+        self.silent_db = 20 * np.log10(_AMP_FLOOR)
+        self.silent_spectra = np.full(
+            (self.chunk_size // self.hop, n_freq), self.silent_db, dtype=np.float32
+        )
+
+        # Mask, with separable smoothing filters applied as matrix products
+        input_frames_count = self.chunk_size // self.hop + 1
+        self.freq_smoothing = _smoothing_matrix(
+            size=n_freq,
+            n_grad=int(_FREQ_MASK_SMOOTH_HZ / (sample_rate / (_N_FFT / 2))),
+        ).T.copy()  # Right-side product
+        self.time_smoothing = _smoothing_matrix(
+            size=input_frames_count,
+            n_grad=int(_TIME_MASK_SMOOTH_MS / (self.hop / sample_rate * 1000)),
+        )
+
+        # Overlap-add, normalized by the window overlap
+        ola_length = self.chunk_size + 2 * self.pad
+        ola_norm = np.zeros(ola_length, dtype=np.float32)
+        for i in range(input_frames_count):
+            ola_norm[i * self.hop : i * self.hop + _N_FFT] += (
+                self.window_analysis * self.window_synthesis
+            )
+        self.ola_norm = np.divide(
+            1,
+            ola_norm,
+            out=np.zeros_like(ola_norm),
+            where=ola_norm > 0,
+        )
+
+        # Output of the single packet processing
+        self.output_pcm = np.zeros(self.chunk_size, dtype=np.int16)
+
+        # Batch arrays
+        self.capacity = 0
+        self.reserve(1)
+
+    def reserve(self, batch_size: int) -> None:
+        """
+        Ensure the batch arrays can hold a batch of the given size.
+
+        Capacity is doubled when grown, to amortize the allocations.
+        """
+        if batch_size <= self.capacity:
+            return
+        self.capacity = max(batch_size, 2 * self.capacity)
+        n_freq = _N_FFT // 2 + 1
+        input_frames_count = self.chunk_size // self.hop + 1
+        reference_frames_count = self.chunk_size // self.hop
+
+        # Input, padded with zeros on both sides, padding is never written
+        self.input_signal = np.zeros(
+            (self.capacity, self.chunk_size + 2 * self.pad), dtype=np.float32
+        )
+        self.signal = self.input_signal[:, self.pad : self.pad + self.chunk_size]
+        self.input_windows = _windows(self.input_signal, self.hop)
+        self.input_frames = np.zeros(
+            (self.capacity, input_frames_count, _N_FFT), dtype=np.float32
+        )
+        self.spectrum = np.zeros(
+            (self.capacity, input_frames_count, n_freq), dtype=np.complex64
+        )
+        self.spectrum_db = np.zeros(
+            (self.capacity, input_frames_count, n_freq), dtype=np.float32
+        )
+
+        # Reference, prefixed with the tail of the previous packet, to compute contiguous frames
+        self.reference_signal = np.zeros(
+            (self.capacity, self.reference_tail_size + self.chunk_size),
+            dtype=np.float32,
+        )
+        self.reference_windows = _windows(self.reference_signal, self.hop)
+        self.reference_frames = np.zeros(
+            (self.capacity, reference_frames_count, _N_FFT), dtype=np.float32
+        )
+        self.reference_spectrum = np.zeros(
+            (self.capacity, reference_frames_count, n_freq), dtype=np.complex64
+        )
+        self.reference_spectrum_db = np.zeros(
+            (self.capacity, reference_frames_count, n_freq), dtype=np.float32
+        )
+
+        # Mask, thresholds are broadcasted over the frames
+        self.noise_thresh = np.zeros((self.capacity, 1, n_freq), dtype=np.float32)
+        self.mask = np.zeros(
+            (self.capacity, input_frames_count, n_freq), dtype=np.float32
+        )
+        self.mask_bool = np.zeros(
+            (self.capacity, input_frames_count, n_freq), dtype=np.bool_
+        )
+        self.mask_tmp = np.zeros(
+            (self.capacity, input_frames_count, n_freq), dtype=np.float32
+        )
+
+        # Output
+        self.ola = np.zeros(
+            (self.capacity, self.chunk_size + 2 * self.pad), dtype=np.float32
+        )
+        self.rms = np.zeros(self.capacity, dtype=np.float32)
+
+    def transform_references(self, count: int) -> np.ndarray:
+        """
+        Compute the spectra of the first reference signals.
+
+        Returns the spectra in dB, a view valid until the next call.
+        """
+        spectrum_db = self.reference_spectrum_db[:count]
+        self._transform(
+            frames=self.reference_frames[:count],
+            windows=self.reference_windows[:count],
+            spectrum=self.reference_spectrum[:count],
+            spectrum_db=spectrum_db,
+        )
+        return spectrum_db
+
+    def gate(self, count: int) -> None:
+        """
+        Apply the spectral gate to the first input signals, in place.
+
+        Thresholds are read from `noise_thresh`.
+        """
+        frames = self.input_frames[:count]
+        mask = self.mask[:count]
+        mask_bool = self.mask_bool[:count]
+        mask_tmp = self.mask_tmp[:count]
+        ola = self.ola[:count]
+        spectrum = self.spectrum[:count]
+        spectrum_db = self.spectrum_db[:count]
+
+        # Transform
+        self._transform(
+            frames=frames,
+            windows=self.input_windows[:count],
+            spectrum=spectrum,
+            spectrum_db=spectrum_db,
+        )
+
+        # Mask if the signal is above the threshold
+        np.greater(spectrum_db, self.noise_thresh[:count], out=mask_bool)
+        np.multiply(mask_bool, _PROP_DECREASE, out=mask)
+        np.add(mask, 1.0 - _PROP_DECREASE, out=mask)
+
+        # Smooth the mask in time then in frequency
+        np.matmul(self.time_smoothing, mask, out=mask_tmp)
+        np.matmul(mask_tmp, self.freq_smoothing, out=mask)
+
+        # Apply the mask and invert
+        np.multiply(spectrum, mask, out=spectrum)
+        np.fft.irfft(spectrum, n=_N_FFT, axis=-1, out=frames)  # pyright: ignore
+        np.multiply(frames, self.window_synthesis, out=frames)
+
+        # Overlap-add
+        ola.fill(0)
+        for i in range(frames.shape[1]):
+            ola[:, i * self.hop : i * self.hop + _N_FFT] += frames[:, i]
+        np.multiply(ola, self.ola_norm, out=ola)
+
+        # Remove the padding
+        np.copyto(
+            self.signal[:count],
+            ola[:, self.pad : self.pad + self.chunk_size],
+        )
+
+    def _transform(
+        self,
+        frames: np.ndarray,
+        spectrum: np.ndarray,
+        spectrum_db: np.ndarray,
+        windows: np.ndarray,
+    ) -> None:
+        """
+        Compute the short-time Fourier transform of a batch of signals, in place.
+
+        Output spectrum is complex, and its magnitude in dB.
+        """
+        np.multiply(windows, self.window_analysis, out=frames)
+        np.fft.rfft(frames, axis=-1, out=spectrum)
+        np.abs(spectrum, out=spectrum_db)
+        np.maximum(spectrum_db, _AMP_FLOOR, out=spectrum_db)
+        np.log10(spectrum_db, out=spectrum_db)
+        np.multiply(spectrum_db, 20, out=spectrum_db)
+
+
+def _windows(signal: np.ndarray, hop: int) -> np.ndarray:
+    """
+    Get the overlapping frames of a batch of signals, without copy.
+
+    Returns a read-only view, of shape (batch, frames, FFT size).
+    """
+    return sliding_window_view(signal, _N_FFT, axis=-1)[:, ::hop]
+
+
+@cache
+def _workspace(sample_rate: int, packet_duration_ms: int) -> _Workspace:
+    """
+    Get the workspace of a configuration, shared by all its engines in the process.
+
+    Returns a `_Workspace` instance.
+    """
+    return _Workspace(
+        packet_duration_ms=packet_duration_ms,
+        sample_rate=sample_rate,
+    )
+
+
+def _state_layout(
+    sample_rate: int,
+    max_delay_ms: int,
+    packet_duration_ms: int,
+) -> list[tuple[str, tuple[int, ...], type[np.generic]]]:
+    """
+    Get the layout of the persistent state of an engine.
+
+    Arrays are ordered by decreasing item size, to keep them aligned in the buffer.
+
+    Returns a list of attribute name, shape and type.
+    """
+    chunk_size = int(sample_rate * packet_duration_ms / 1000)
+    hop = _N_FFT // 4
+    n_freq = _N_FFT // 2 + 1
+    ring_size = max(
+        int(max_delay_ms / 1000 * sample_rate) // hop,
+        chunk_size // hop,
+    )
+    return [
+        ("_noise_sq_sum", (n_freq,), np.float64),
+        ("_noise_sum", (n_freq,), np.float64),
+        ("_ring_cursor", (1,), np.int64),
+        ("_noise_thresh", (n_freq,), np.float32),
+        ("_reference_tail", (_N_FFT - hop,), np.float32),
+        ("_ring", (ring_size, n_freq), np.float32),
+    ]
+
+
+def _layout_size(layout: list[tuple[str, tuple[int, ...], type[np.generic]]]) -> int:
+    """
+    Get the size of a state layout.
+
+    Returns the size in bytes.
+    """
+    return sum(
+        int(np.prod(shape)) * np.dtype(dtype).itemsize for _, shape, dtype in layout
+    )
+
+
+def _smoothing_matrix(size: int, n_grad: int) -> np.ndarray:
+    """
+    Build a matrix applying a triangular smoothing filter.
+
+    Filter is derived from the one of `noisereduce`, it is separable in time and frequency. Rows are normalized, so the edges are smoothed only with the available values, instead of the zero padding.
+    """
+    n_grad = max(n_grad, 1)
+    kernel = np.concatenate(
+        [
+            np.linspace(0, 1, n_grad + 1, endpoint=False),
+            np.linspace(1, 0, n_grad + 2),
+        ]
+    )[1:-1]
+    kernel /= kernel.sum()
+    half = kernel.shape[0] // 2
+    matrix = np.zeros((size, size), dtype=np.float32)
+    for i in range(size):
+        for j in range(max(0, i - half), min(size, i + half + 1)):
+            matrix[i, j] = kernel[j - i + half]
+        matrix[i] /= matrix[i].sum()
+    return matrix
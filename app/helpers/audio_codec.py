@@ -0,0 +1,91 @@
+import binascii
+from collections.abc import Iterator
+from typing import Any
+
+import orjson
+
+# Outbound envelopes, pre-encoded as the media messages are built for each frame
+_AUDIO_DATA_PREFIX = b'{"kind":"AudioData","audioData":{"data":"'
+_AUDIO_DATA_SUFFIX = b'"}}'
+STOP_AUDIO_MESSAGE = '{"kind":"StopAudio","stopAudio":{}}'
+
+
+def decode_audio(message: str | bytes) -> bytes | None:
+    """
+    Decode an inbound media message from Communication Services.
+
+    Returns the PCM audio, or None if the message is not audio or is silent.
+    """
+    event: dict[str, Any] = orjson.loads(message)
+
+    # Skip non-audio events
+    if event.get("kind") != "AudioData":
+        return None
+
+    # Filter out silent audio
+    audio_data: dict[str, Any] = event.get("audioData", {})
+    audio_base64: str | None = audio_data.get("data", None)
+    audio_silent: bool | None = audio_data.get("silent", True)
+    if audio_silent or not audio_base64:
+        return None
+
+    return binascii.a2b_base64(audio_base64)
+
+
+class AudioEncoder:
+    """
+    Encoder of outbound media messages to Communication Services.
+
+    Messages are built in a buffer allocated once, from the pre-encoded envelope, so only the audio is encoded per frame. Audio larger than the frame size is split in several messages.
+
+    Input format is in PCM 16-bit, 1 channel.
+    """
+
+    __slots__ = ("_buffer", "_frame_size")
+
+    def __init__(self, frame_max_ms: int, sample_rate: int):
+        """
+        Initialize the encoder.
+
+        Parameters:
+        - `frame_max_ms`: Maximum duration of the audio in a message.
+        - `sample_rate`: Audio sample rate in Hz.
+        """
+        # Align on samples (2 bytes) and base64 blocks (3 bytes), so split frames are encoded independently
+        self._frame_size = max(6, int(sample_rate * frame_max_ms / 1000) * 2 // 6 * 6)
+        self._buffer = bytearray(
+            len(_AUDIO_DATA_PREFIX)
+            + self._frame_size // 3 * 4
+            + len(_AUDIO_DATA_SUFFIX)
+        )
+        self._buffer[: len(_AUDIO_DATA_PREFIX)] = _AUDIO_DATA_PREFIX
+
+    @property
+    def frame_size(self) -> int:
+        """
+        Maximum size of the audio in a message, in bytes.
+        """
+        return self._frame_size
+
+    def encode(self, pcm: bytes) -> Iterator[str]:
+        """
+        Encode audio in media messages.
+
+        Yields the messages, as JSON text.
+        """
+        view = memoryview(pcm)
+        start = len(_AUDIO_DATA_PREFIX)
+        for offset in range(0, len(view), self._frame_size):
+            # Write the audio and close the envelope
+            data = binascii.b2a_base64(
+                view[offset : offset + self._frame_size],
+                newline=False,
+            )
+            end = start + len(data)
+            self._buffer[start:end] = data
+            self._buffer[end : end + len(_AUDIO_DATA_SUFFIX)] = _AUDIO_DATA_SUFFIX
+
+            # Decode without an intermediate copy, envelope and base64 are ASCII
+            yield str(
+                memoryview(self._buffer)[: end + len(_AUDIO_DATA_SUFFIX)], "ascii"
+            )
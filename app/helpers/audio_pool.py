@@ -0,0 +1,516 @@
+import asyncio
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_context
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+from app.helpers.audio_aec import EchoCanceller
+
+_ATTACHED_MAX = 256  # Engines kept attached by each worker process
+
+# Worker process, engines attached to the shared memory blocks, by block name
+_attached: OrderedDict[
+    str, tuple[SharedMemory, EchoCanceller, np.ndarray, np.ndarray]
+] = OrderedDict()
+
+# Server process, batcher and pool shared by all the streams
+_batcher: "_Batcher | None" = None
+_executor: ProcessPoolExecutor | None = None
+_semaphore: asyncio.Semaphore | None = None
+
+
+class PooledEchoCanceller:
+    """
+    Echo cancellation engine, processed in batches in a pool of processes.
+
+    Packets of all the streams are collected during a short window, then processed in a single vectorized pass (see `EchoCanceller.process_batch`).
+
+    Engine state and audio frames are exchanged with the workers through a shared memory block, only the block name is sent to the pool. A stream has at most one packet in the pool, and the pool has at most `max_pending` packets, so a slow pool never queues audio.
+
+    Block layout is: engine state, frame (input then output), reference.
+
+    If the pool is disabled, the batches are processed in the event loop.
+    """
+
+    __slots__ = (
+        "_block",
+        "_busy",
+        "_closed",
+        "_frame",
+        "_frames",
+        "_local",
+        "_max_delay_ms",
+        "_packet_duration_ms",
+        "_packet_size",
+        "_reference",
+        "_sample_rate",
+    )
+
+    def __init__(
+        self,
+        sample_rate: int,
+        max_delay_ms: int = 200,
+        packet_duration_ms: int = 20,
+    ):
+        """
+        Initialize the engine.
+
+        Parameters:
+        - `max_delay_ms`: Maximum delay to consider between the raw and reference audio, it is the length of the noise reference.
+        - `packet_duration_ms`: Duration of each audio packet in milliseconds.
+        - `sample_rate`: Audio sample rate in Hz.
+        """
+        from app.helpers.config import CONFIG
+
+        self._busy = False
+        self._closed = False
+        self._max_delay_ms = max_delay_ms
+        self._packet_duration_ms = packet_duration_ms
+        self._packet_size = (
+            int(sample_rate * packet_duration_ms / 1000) * 2
+        )  # Each sample is 2 bytes (PCM 16-bit)
+        self._sample_rate = sample_rate
+
+        # Pool is disabled, process in the event loop
+        if not CONFIG.audio.aec.pool_size:
+            self._block = None
+            self._frames = memoryview(bytearray(2 * self._packet_size))
+            self._frame, self._reference = _frame_arrays(
+                buffer=self._frames,
+                offset=0,
+                packet_size=self._packet_size,
+            )
+            self._local = EchoCanceller(
+                max_delay_ms=max_delay_ms,
+                packet_duration_ms=packet_duration_ms,
+                sample_rate=sample_rate,
+            )
+            return
+
+        # Allocate the shared block
+        state_size = EchoCanceller.state_size(
+            max_delay_ms=max_delay_ms,
+            packet_duration_ms=packet_duration_ms,
+            sample_rate=sample_rate,
+        )
+        self._block = SharedMemory(
+            create=True,
+            size=state_size + 2 * self._packet_size,
+        )
+        self._frames = self._block.buf[state_size:]
+        self._frame = None
+        self._local = None
+        self._reference = None
+
+        # Initialize the state, engine is dropped to release the buffer
+        EchoCanceller(
+            max_delay_ms=max_delay_ms,
+            packet_duration_ms=packet_duration_ms,
+            sample_rate=sample_rate,
+            state=self._block.buf[:state_size],
+        )
+
+    async def process(
+        self, input_pcm: bytes, reference_pcm: bytes | memoryview | None
+    ) -> tuple[bytes, float] | None:
+        """
+        Process one audio packet.
+
+        If the reference is empty or silent, it is added to the noise reference and the input is returned as is.
+
+        Returns a tuple with the echo-cancelled PCM audio and its RMS (acoustic pressure), between 0 and 1. Returns None if the previous packet of the stream is still processed, or if the pool is full.
+        """
+        # Previous packet is still processed, the frames are not available
+        if self._busy:
+            return None
+
+        # Take a slot in the pool, if full skip the packet instead of queueing it
+        semaphore = None
+        if self._block:
+            semaphore = _pool_semaphore()
+            if semaphore.locked():
+                return None
+            await semaphore.acquire()  # Does not wait, a slot is available
+        self._busy = True
+
+        # Copy the packets to the frames
+        self._frames[: self._packet_size] = input_pcm
+        if reference_pcm:
+            self._frames[self._packet_size :] = reference_pcm
+
+        res: list[tuple[bytes, float]] = []
+
+        def _release(done: asyncio.Future[float | None]) -> None:
+            # Copy the output first, the next packet of the stream overwrites the frames as soon as they are released
+            if not done.cancelled() and not done.exception():
+                rms = done.result()
+                if rms is not None and not self._closed:
+                    res.append((bytes(self._frames[: self._packet_size]), rms))
+            if semaphore:
+                semaphore.release()
+            self._busy = False
+            if self._closed:
+                self._unlink()
+
+        # Queue in the next batch, the frames are released when the batch is done, even if the caller stopped waiting
+        future = _get_batcher().submit(
+            canceller=self,
+            with_reference=bool(reference_pcm),
+        )
+        future.add_done_callback(_release)
+        await asyncio.shield(future)
+
+        # Pool failed or stream closed while processing
+        return res[0] if res else None
+
+    @property
+    def ready(self) -> bool:
+        """
+        Whether a packet can be processed now.
+
+        False if the previous packet of the stream is still processed, or if the pool is full.
+        """
+        if self._busy:
+            return False
+        return not (self._block and _pool_semaphore().locked())
+
+    def close(self) -> None:
+        """
+        Release the shared block.
+
+        If a packet is still processed, the block is released when it is done.
+        """
+        self._closed = True
+        if not self._busy:
+            self._unlink()
+
+    def _unlink(self) -> None:
+        """
+        Close and delete the shared block.
+        """
+        if not self._block:
+            return
+        self._frames.release()  # Views must be released before closing the block
+        self._block.close()
+        self._block.unlink()
+        self._block = None
+
+
+class _Batcher:
+    """
+    Collect the packets of all the streams of the event loop, and process them in batches.
+
+    A batch is processed when the window is elapsed or when it is full.
+    """
+
+    __slots__ = (
+        "_flush_handle",
+        "_max_size",
+        "_pending",
+        "_tasks",
+        "_window_ms",
+    )
+
+    def __init__(
+        self,
+        max_size: int,
+        window_ms: int,
+    ):
+        """
+        Initialize the batcher.
+
+        Parameters:
+        - `max_size`: Maximum number of packets in a batch.
+        - `window_ms`: Duration to wait for other packets, in milliseconds.
+        """
+        self._flush_handle: asyncio.TimerHandle | None = None
+        self._max_size = max_size
+        self._pending: list[
+            tuple[PooledEchoCanceller, bool, asyncio.Future[float | None]]
+        ] = []
+        self._tasks: set[asyncio.Task] = set()
+        self._window_ms = window_ms
+
+    def submit(
+        self,
+        canceller: PooledEchoCanceller,
+        with_reference: bool,
+    ) -> asyncio.Future[float | None]:
+        """
+        Add a packet to the next batch, its frames must be already written.
+
+        Returns a future resolved with the RMS of the output, or None if the pool failed.
+        """
+        loop = asyncio.get_running_loop()
+        future: asyncio.Future[float | None] = loop.create_future()
+        self._pending.append((canceller, with_reference, future))
+
+        # Batch is full
+        if len(self._pending) >= self._max_size:
+            self._flush()
+
+        # First packet of the batch, start the window
+        elif not self._flush_handle:
+            self._flush_handle = loop.call_later(self._window_ms / 1000, self._flush)
+
+        return future
+
+    def _flush(self) -> None:
+        """
+        Process the pending packets.
+
+        Local engines are processed in the event loop, pooled engines are sent to the pool.
+        """
+        if self._flush_handle:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._pending = self._pending, []
+
+        # Process local engines in the event loop
+        local = [item for item in batch if item[0]._local]
+        if local:
+            engines: list[EchoCanceller] = []
+            frames: list[np.ndarray] = []
+            references: list[np.ndarray | None] = []
+            for canceller, with_reference, _ in local:
+                assert canceller._local and canceller._frame is not None
+                engines.append(canceller._local)
+                frames.append(canceller._frame)
+                references.append(canceller._reference if with_reference else None)
+            rms = EchoCanceller.process_batch(
+                engines=engines,
+                inputs=frames,
+                outputs=frames,
+                references=references,
+            )
+            for (_, _, future), value in zip(local, rms.tolist(), strict=True):
+                future.set_result(value)
+
+        # Send pooled engines to the pool
+        pooled = [item for item in batch if not item[0]._local]
+        if pooled:
+            task = asyncio.create_task(self._run_pool(pooled))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run_pool(
+        self,
+        batch: list[tuple[PooledEchoCanceller, bool, asyncio.Future[float | None]]],
+    ) -> None:
+        """
+        Process a batch in the pool and resolve its futures.
+        """
+        jobs: list[tuple[str, int, int, int, bool]] = []
+        for canceller, with_reference, _ in batch:
+            assert canceller._block
+            jobs.append(
+                (
+                    canceller._block.name,
+                    canceller._sample_rate,
+                    canceller._max_delay_ms,
+                    canceller._packet_duration_ms,
+                    with_reference,
+                )
+            )
+
+        try:
+            rms = await asyncio.get_running_loop().run_in_executor(
+                _pool_executor(),
+                _process_batch,
+                jobs,
+            )
+
+        # Worker crashed, the pool is recreated by the next batch
+        except BrokenProcessPool:
+            shutdown_pool()
+            for _, _, future in batch:
+                future.set_result(None)
+            return
+
+        # Unexpected error, forward it to the streams
+        except Exception as e:
+            for _, _, future in batch:
+                future.set_exception(e)
+            return
+
+        for (_, _, future), value in zip(batch, rms, strict=True):
+            future.set_result(value)
+
+
+def shutdown_pool() -> None:
+    """
+    Stop the pool, without waiting for the pending packets.
+    """
+    global _executor  # noqa: PLW0603
+    if _executor:
+        _executor.shutdown(
+            cancel_futures=True,
+            wait=False,
+        )
+    _executor = None
+
+
+def _get_batcher() -> _Batcher:
+    """
+    Get the batcher, create it if needed.
+
+    Returns a `_Batcher` instance.
+    """
+    from app.helpers.config import CONFIG
+
+    global _batcher  # noqa: PLW0603
+    if not _batcher:
+        _batcher = _Batcher(
+            max_size=CONFIG.audio.aec.batch_max_size,
+            window_ms=CONFIG.audio.aec.batch_window_ms,
+        )
+    return _batcher
+
+
+def _pool_executor() -> ProcessPoolExecutor:
+    """
+    Get the process pool, create it if needed.
+
+    Processes are spawned, not forked, to not inherit the event loop, threads and connections of the server.
+
+    Returns a `ProcessPoolExecutor` instance.
+    """
+    from app.helpers.config import CONFIG
+
+    global _executor  # noqa: PLW0603
+    if not _executor:
+        _executor = ProcessPoolExecutor(
+            max_workers=CONFIG.audio.aec.pool_size,
+            mp_context=get_context("spawn"),
+        )
+    return _executor
+
+
+def _pool_semaphore() -> asyncio.Semaphore:
+    """
+    Get the semaphore limiting the packets in the pool, create it if needed.
+
+    Returns a `Semaphore` instance.
+    """
+    from app.helpers.config import CONFIG
+
+    global _semaphore  # noqa: PLW0603
+    if not _semaphore:
+        _semaphore = asyncio.Semaphore(CONFIG.audio.aec.max_pending)
+    return _semaphore
+
+
+def _frame_arrays(
+    buffer: memoryview,
+    offset: int,
+    packet_size: int,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Map the frame and the reference arrays on a buffer.
+
+    Returns a tuple with the frame and the reference arrays, in PCM 16-bit.
+    """
+    frame = np.ndarray(
+        buffer=buffer,
+        dtype=np.int16,
+        offset=offset,
+        shape=(packet_size // 2,),
+    )
+    reference = np.ndarray(
+        buffer=buffer,
+        dtype=np.int16,
+        offset=offset + packet_size,
+        shape=(packet_size // 2,),
+    )
+    return frame, reference
+
+
+def _process_batch(
+    jobs: list[tuple[str, int, int, int, bool]],
+) -> list[float]:
+    """
+    Process a batch of audio packets from shared blocks, in a worker process.
+
+    Each job is a tuple with the block name, the sample rate, the maximum delay, the packet duration and if a reference is available. Outputs are written in place of the input frames.
+
+    Returns the RMS (acoustic pressure) of each output, between 0 and 1.
+    """
+    engines: list[EchoCanceller] = []
+    frames: list[np.ndarray] = []
+    references: list[np.ndarray | None] = []
+
+    for name, sample_rate, max_delay_ms, packet_duration_ms, with_reference in jobs:
+        # Attach the block, or reuse the previous attachment
+        attached = _attached.get(name)
+        if attached:
+            _attached.move_to_end(name)
+        else:
+            attached = _attach(
+                max_delay_ms=max_delay_ms,
+                name=name,
+                packet_duration_ms=packet_duration_ms,
+                sample_rate=sample_rate,
+            )
+
+        _, engine, frame, reference = attached
+        engines.append(engine)
+        frames.append(frame)
+        references.append(reference if with_reference else None)
+
+    return EchoCanceller.process_batch(
+        engines=engines,
+        inputs=frames,
+        outputs=frames,
+        references=references,
+    ).tolist()
+
+
+def _attach(
+    name: str,
+    sample_rate: int,
+    max_delay_ms: int,
+    packet_duration_ms: int,
+) -> tuple[SharedMemory, EchoCanceller, np.ndarray, np.ndarray]:
+    """
+    Attach a shared block and map the engine on it, in a worker process.
+
+    Least recently used blocks are detached, as the server does not notify the workers when a stream ends.
+
+    Returns a tuple with the block, the engine, the frame and the reference arrays.
+    """
+    # Detach the oldest blocks, arrays mapped on a block must be released before closing it
+    while len(_attached) >= _ATTACHED_MAX:
+        _, evicted = _attached.popitem(last=False)
+        block = evicted[0]
+        del evicted
+        block.close()
+
+    # Attach, the block is owned and unlinked by the server process
+    block = SharedMemory(
+        name=name,
+        track=False,
+    )
+    state_size = EchoCanceller.state_size(
+        max_delay_ms=max_delay_ms,
+        packet_duration_ms=packet_duration_ms,
+        sample_rate=sample_rate,
+    )
+    engine = EchoCanceller(
+        initialize=False,
+        max_delay_ms=max_delay_ms,
+        packet_duration_ms=packet_duration_ms,
+        sample_rate=sample_rate,
+        state=block.buf[:state_size],
+    )
+    frame, reference = _frame_arrays(
+        buffer=block.buf,
+        offset=state_size,
+        packet_size=int(sample_rate * packet_duration_ms / 1000) * 2,
+    )
+
+    attached = (block, engine, frame, reference)
+    _attached[name] = attached
+    return attached
@@ -0,0 +1,80 @@
+import asyncio
+import time
+
+from app.helpers.monitoring import (
+    call_audio_queue_depth,
+    call_audio_queue_dropped,
+    counter_add,
+    gauge_set,
+)
+
+_REPORT_INTERVAL_SEC = 1  # Depth is reported at most once per second, per queue
+
+
+class AudioQueue[T](asyncio.Queue[T]):
+    """
+    Queue for real-time audio.
+
+    When the queue is full, the oldest item is dropped to make room for the new one, so producers never wait, and a slow consumer gets the latest audio instead of a growing backlog. A max size of 0 makes the queue unbounded.
+
+    Depth and dropped items are reported as metrics, with the queue name as attribute.
+    """
+
+    _attributes: dict[str, str]
+    _dropped: int
+    _reported_at: float
+
+    def __init__(self, name: str, maxsize: int = 0):
+        """
+        Initialize the queue.
+
+        Parameters:
+        - `maxsize`: Maximum number of items, 0 for unbounded.
+        - `name`: Name of the queue, reported in the metrics.
+        """
+        super().__init__(maxsize=maxsize)
+        self._attributes = {"queue": name}
+        self._dropped = 0
+        self._reported_at = 0
+
+    async def put(self, item: T) -> None:
+        """
+        Put an item, never waits.
+        """
+        self.put_nowait(item)
+
+    def put_nowait(self, item: T) -> None:
+        """
+        Put an item, dropping the oldest one if the queue is full.
+        """
+        # Make room for the item
+        if self.full():
+            self.get_nowait()
+            self.task_done()
+            self._dropped += 1
+            # Enrich span
+            counter_add(
+                attributes=self._attributes,
+                metric=call_audio_queue_dropped,
+                value=1,
+            )
+
+        super().put_nowait(item)
+
+        # Report the depth, throttled as it is called for each frame
+        now = time.monotonic()
+        if now - self._reported_at >= _REPORT_INTERVAL_SEC:
+            self._reported_at = now
+            # Enrich span
+            gauge_set(
+                attributes=self._attributes,
+                metric=call_audio_queue_depth,
+                value=self.qsize(),
+            )
+
+    @property
+    def dropped(self) -> int:
+        """
+        Number of items dropped, because the queue was full.
+        """
+        return self._dropped
@@ -0,0 +1,184 @@
+from abc import ABC, abstractmethod
+from math import ceil
+
+import numpy as np
+
+_FRAME_DURATION_MS = 10  # Detection resolution, supported by all the engines
+
+
+class IVadEngine(ABC):
+    """
+    Voice activity detection engine, classifies audio frames as speech or not.
+    """
+
+    __slots__ = ()
+
+    @abstractmethod
+    def detect(self, frames: np.ndarray, threshold: float) -> np.ndarray:
+        """
+        Classify a batch of frames.
+
+        Parameters:
+        - `frames`: PCM 16-bit samples, with a shape of (frames, samples).
+        - `threshold`: Minimum RMS (acoustic pressure) of a speech frame, between 0 and 1.
+
+        Returns a boolean array, True for the speech frames.
+        """
+
+
+class EnergyVadEngine(IVadEngine):
+    """
+    Voice activity detection based on the energy and the zero-crossing rate.
+
+    Speech is loud and mostly voiced, with a low zero-crossing rate. Loud frames with a high rate, like hiss or line noise, are rejected, unless they are twice louder than the threshold, like fricatives.
+    """
+
+    __slots__ = ("_zcr_max",)
+
+    def __init__(self, zcr_max: float):
+        """
+        Initialize the engine.
+
+        Parameters:
+        - `zcr_max`: Maximum zero-crossing rate of a speech frame, between 0 and 1, as a ratio of the samples.
+        """
+        self._zcr_max = zcr_max
+
+    def detect(self, frames: np.ndarray, threshold: float) -> np.ndarray:
+        samples = frames.astype(np.float32) / 32768
+
+        # Energy
+        rms = np.sqrt(np.einsum("ij,ij->i", samples, samples) / samples.shape[1])
+
+        # Zero-crossing rate
+        signs = np.signbit(frames)
+        zcr = np.count_nonzero(signs[:, 1:] != signs[:, :-1], axis=1) / (
+            frames.shape[1] - 1
+        )
+
+        return (rms >= threshold) & ((zcr <= self._zcr_max) | (rms >= threshold * 2))
+
+
+class WebRtcVadEngine(IVadEngine):
+    """
+    Voice activity detection based on the WebRTC model.
+
+    The model is stateful, an engine must be used by a single stream. Frames quieter than the threshold are considered as silence.
+
+    Requires the `webrtc` extra.
+    """
+
+    __slots__ = ("_sample_rate", "_vad")
+
+    def __init__(self, aggressiveness: int, sample_rate: int):
+        """
+        Initialize the engine.
+
+        Parameters:
+        - `aggressiveness`: Filtering of non-speech, between 0 (least) and 3 (most).
+        - `sample_rate`: Audio sample rate in Hz, 8, 16, 32 or 48 kHz.
+        """
+        try:
+            import webrtcvad
+        except ImportError as e:
+            raise ImportError(
+                "WebRTC VAD is not installed, install the `webrtc` extra"
+            ) from e
+
+        self._sample_rate = sample_rate
+        self._vad = webrtcvad.Vad(aggressiveness)
+
+    def detect(self, frames: np.ndarray, threshold: float) -> np.ndarray:
+        samples = frames.astype(np.float32) / 32768
+        rms = np.sqrt(np.einsum("ij,ij->i", samples, samples) / samples.shape[1])
+        return np.fromiter(
+            (
+                loud and self._vad.is_speech(frame.tobytes(), self._sample_rate)
+                for frame, loud in zip(frames, rms >= threshold, strict=True)
+            ),
+            count=len(frames),
+            dtype=np.bool_,
+        )
+
+
+class VoiceActivityDetector:
+    """
+    Voice activity detection for a single audio stream.
+
+    Packets are split in frames of 10 ms, classified in a single batch by the engine. Decisions are smoothed, speech starts after `attack_ms` of consecutive speech frames, and lasts `hangover_ms` after the last one, so short noises are ignored and short pauses between words do not end the speech.
+
+    Threshold is a plain attribute, to be refreshed by the owner of the detector, so no lookup is made per packet.
+
+    Input format is in PCM 16-bit, 1 channel.
+    """
+
+    __slots__ = (
+        "_attack_frames",
+        "_engine",
+        "_frame_size",
+        "_hangover_frames",
+        "_hangover_left",
+        "_speaking",
+        "_speech_frames",
+        "threshold",
+    )
+
+    def __init__(
+        self,
+        engine: IVadEngine,
+        sample_rate: int,
+        threshold: float,
+        attack_ms: int = 20,
+        hangover_ms: int = 100,
+    ):
+        """
+        Initialize the detector.
+
+        Parameters:
+        - `attack_ms`: Duration of consecutive speech before detecting speech.
+        - `engine`: Engine classifying the frames.
+        - `hangover_ms`: Duration of non-speech before detecting the end of speech.
+        - `sample_rate`: Audio sample rate in Hz.
+        - `threshold`: Minimum RMS (acoustic pressure) of speech, between 0 and 1.
+        """
+        self._attack_frames = max(1, ceil(attack_ms / _FRAME_DURATION_MS))
+        self._engine = engine
+        self._frame_size = int(sample_rate * _FRAME_DURATION_MS / 1000)
+        self._hangover_frames = ceil(hangover_ms / _FRAME_DURATION_MS)
+        self._hangover_left = 0
+        self._speaking = False
+        self._speech_frames = 0
+        self.threshold = threshold
+
+    def process(self, pcm: bytes) -> bool:
+        """
+        Detect speech in a packet.
+
+        Packet duration must be a multiple of 10 ms.
+
+        Returns True if speech is detected in the packet, False otherwise.
+        """
+        frames = np.frombuffer(pcm, dtype=np.int16).reshape(-1, self._frame_size)
+        detected = False
+        for is_speech in self._engine.detect(frames, self.threshold).tolist():
+            # Speech continues, reset the hangover
+            if self._speaking and is_speech:
+                self._hangover_left = self._hangover_frames
+
+            # Pause, speech ends when the hangover is over
+            elif self._speaking:
+                if self._hangover_left > 0:
+                    self._hangover_left -= 1
+                else:
+                    self._speaking = False
+                    self._speech_frames = 0
+
+            # Silence, speech starts after the attack
+            else:
+                self._speech_frames = self._speech_frames + 1 if is_speech else 0
+                if self._speech_frames >= self._attack_frames:
+                    self._hangover_left = self._hangover_frames
+                    self._speaking = True
+
+            detected |= self._speaking
+        return detected
@@ -24,11 +24,12 @@ def lru_acache(maxsize: int = 128):
     """
     Caches an async function's return value each time it is called.
 
-    If the maxsize is reached, the least recently used value is removed.
+    Concurrent first calls with the same arguments run the function once, see `single_flight`. If the maxsize is reached, the least recently used value is removed.
     """
 
     def decorator(func):
         cache: OrderedDict[tuple, Awaitable] = OrderedDict()
+        flight_func = single_flight()(func)
 
         @wraps(func)
         async def wrapper(*args, **kwargs) -> Awaitable:
@@ -44,8 +45,8 @@ def lru_acache(maxsize: int = 128):
                 cache.move_to_end(key)
                 return cache[key]
 
-            # Compute the value since it's not cached
-            value = await func(*args, **kwargs)
+            # Compute the value since it's not cached, or wait for the call in flight
+            value = await flight_func(*args, **kwargs)
             cache[key] = value
             cache.move_to_end(key)
 
@@ -60,6 +61,46 @@ def lru_acache(maxsize: int = 128):
     return decorator
 
 
+def single_flight():
+    """
+    Coalesces the concurrent calls of an async function with the same arguments.
+
+    The first call runs the function, the others wait for its result or its error. Results are not kept, a call after the first one completed runs the function again. Cancelling a caller does not cancel the function, as others may wait for it.
+    """
+
+    def decorator(func):
+        flights: dict[tuple, asyncio.Future] = {}
+
+        @wraps(func)
+        async def wrapper(*args, **kwargs) -> Awaitable:
+            # Create a flight key from event loop, args and kwargs, using frozenset for kwargs to ensure hashability
+            key = (
+                id(asyncio.get_event_loop()),
+                args,
+                frozenset(kwargs.items()),
+            )
+
+            # Join the call in flight, or start it
+            flight = flights.get(key)
+            if not flight:
+                flight = asyncio.ensure_future(func(*args, **kwargs))
+                flights[key] = flight
+
+                def _land(task: asyncio.Future) -> None:
+                    flights.pop(key, None)
+                    # Mark the error as retrieved, the callers raise it
+                    if not task.cancelled():
+                        task.exception()
+
+                flight.add_done_callback(_land)
+
+            return await asyncio.shield(flight)
+
+        return wrapper
+
+    return decorator
+
+
 def lru_cache(maxsize: int = 128):
     """
     Caches a sync function's return value each time it is called.
@@ -234,7 +234,7 @@ async def on_automation_recognize_error(
     logger.info(
         "Timeout, retrying language selection (%s/%s)",
         call.recognition_retry,
-        await recognition_retry_max(),
+        recognition_retry_max(),
     )
     await _handle_ivr_language(
         call=call,
@@ -320,7 +320,7 @@ async def _pre_recognize_error(
     Returns True if the call should continue, False if it should end.
     """
     # Voice retries are exhausted, end call
-    if call.recognition_retry >= await recognition_retry_max():
+    if call.recognition_retry >= recognition_retry_max():
         logger.info("Timeout, ending call")
         return False
 
@@ -560,7 +560,7 @@ async def hangup_now(
     Hangup the call and store the final message.
     """
 
-    async def _store(call: CallStateModel) -> None:
+    async def _store_and_post(call: CallStateModel) -> None:
         async with _db.call_transac(
             call=call,
             scheduler=scheduler,
@@ -574,10 +574,13 @@ async def hangup_now(
                 )
             )
 
+        # Write the pending changes, before the post-call intelligence reads the call
+        await _db.call_flush(call)
+        await post_callback(call)
+
     await asyncio.gather(
         handle_hangup(client=client, call=call),
-        _store(call),
-        post_callback(call),
+        _store_and_post(call),
     )
 
 
@@ -801,7 +804,7 @@ async def _handle_recording(
 
     Feature activation is checked before starting the recording.
     """
-    if not await recording_enabled():
+    if not recording_enabled():
         return
 
     assert CONFIG.communication_services.recording_container_url
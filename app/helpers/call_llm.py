@@ -10,6 +10,7 @@ from azure.cognitiveservices.speech import (
 )
 from azure.communication.callautomation.aio import CallAutomationClient
 
+from app.helpers.audio_queue import AudioQueue
 from app.helpers.call_utils import (
     AECStream,
     SttClient,
@@ -65,7 +66,9 @@ async def load_llm_chat(  # noqa: PLR0913
     training_callback: Callable[[CallStateModel], Awaitable[None]],
 ) -> None:
     # Init language recognition
-    audio_tts: asyncio.Queue[bytes] = asyncio.Queue()
+    audio_tts: AudioQueue[bytes] = AudioQueue(
+        name="tts",  # Unbounded, the bot voice is forwarded at the playback pace
+    )
 
     async with (
         SttClient(
@@ -305,12 +308,8 @@ async def _continue_chat(  # noqa: PLR0915, PLR0913
 
     # Timeouts
     soft_timeout_triggered = False
-    soft_timeout_task = asyncio.create_task(
-        asyncio.sleep(await answer_soft_timeout_sec())
-    )
-    hard_timeout_task = asyncio.create_task(
-        asyncio.sleep(await answer_hard_timeout_sec())
-    )
+    soft_timeout_task = asyncio.create_task(asyncio.sleep(answer_soft_timeout_sec()))
+    hard_timeout_task = asyncio.create_task(asyncio.sleep(answer_hard_timeout_sec()))
 
     def _clear_tasks() -> None:
         chat_task.cancel()
@@ -339,7 +338,7 @@ async def _continue_chat(  # noqa: PLR0915, PLR0913
             if hard_timeout_task.done():
                 logger.warning(
                     "Hard timeout of %ss reached",
-                    await answer_hard_timeout_sec(),
+                    answer_hard_timeout_sec(),
                 )
                 # Clean up
                 _clear_tasks()
@@ -351,7 +350,7 @@ async def _continue_chat(  # noqa: PLR0915, PLR0913
                 if soft_timeout_task.done() and not soft_timeout_triggered:
                     logger.warning(
                         "Soft timeout of %ss reached",
-                        await answer_soft_timeout_sec(),
+                        answer_soft_timeout_sec(),
                     )
                     soft_timeout_triggered = True
                     # Never store the error message in the call history, it has caused hallucinations in the LLM
@@ -494,8 +493,9 @@ async def _generate_chat_completion(  # noqa: PLR0913, PLR0912, PLR0915
 
     # Translate messages to avoid LLM hallucinations
     # See: https://github.com/microsoft/call-center-ai/issues/260
-    translated_messages = await asyncio.gather(
-        *[message.translate(call.lang.short_code) for message in call.messages]
+    translated_messages = await MessageModel.translate_all(
+        messages=call.messages,
+        target_short_code=call.lang.short_code,
     )
     # logger.debug("Translated messages: %s", translated_messages)
 
@@ -657,7 +657,7 @@ async def _process_audio_for_vad(  # noqa: PLR0913
         """
         # Wait before flushing
         nonlocal stop_task
-        timeout_ms = await vad_silence_timeout_ms()
+        timeout_ms = vad_silence_timeout_ms()
         await asyncio.sleep(timeout_ms / 1000)
 
         # Cancel the clear TTS task
@@ -670,7 +670,7 @@ async def _process_audio_for_vad(  # noqa: PLR0913
         await response_callback()
 
         # Wait for silence and trigger timeout
-        timeout_sec = await phone_silence_timeout_sec()
+        timeout_sec = phone_silence_timeout_sec()
         while True:
             # Stop this time if the call played a message
             timeout_start = datetime.now(UTC)
@@ -699,7 +699,7 @@ async def _process_audio_for_vad(  # noqa: PLR0913
         """
         Stop the TTS if user speaks for too long.
         """
-        timeout_ms = await vad_cutoff_timeout_ms()
+        timeout_ms = vad_cutoff_timeout_ms()
 
         # Wait before clearing the TTS queue
         await asyncio.sleep(timeout_ms / 1000)
@@ -7,7 +7,6 @@ from contextlib import asynccontextmanager, contextmanager
 from enum import Enum
 from typing import Any
 
-import numpy as np
 from aiojobs import Job, Scheduler
 from azure.cognitiveservices.speech import (
     AudioConfig,
@@ -38,8 +37,10 @@ from azure.communication.callautomation.aio import (
     CallConnectionClient,
 )
 from azure.core.exceptions import HttpResponseError, ResourceNotFoundError
-from noisereduce import reduce_noise
 
+from app.helpers.audio_pool import PooledEchoCanceller
+from app.helpers.audio_queue import AudioQueue
+from app.helpers.audio_vad import VoiceActivityDetector
 from app.helpers.cache import lru_acache
 from app.helpers.config import CONFIG
 from app.helpers.features import (
@@ -86,16 +87,23 @@ class CallHangupException(Exception):
 class TtsCallback(PushAudioOutputStreamCallback):
     """
     Callback for Azure Speech Synthesizer to push audio data to a queue.
+
+    Audio is copied once, as the SDK reuses its buffer. The same copy is then shared by the output to the phone and by the echo cancellation reference, without further copy.
+
+    Must be created in the event loop consuming the queue.
     """
 
     def __init__(self, queue: asyncio.Queue[bytes]):
+        self.loop = asyncio.get_running_loop()
         self.queue = queue
 
     def write(self, audio_buffer: memoryview) -> int:
         """
         Write audio data to the queue.
+
+        Called from the SDK thread, the queue is filled from the event loop, as it is not thread-safe.
         """
-        self.queue.put_nowait(audio_buffer.tobytes())
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, audio_buffer.tobytes())
         return audio_buffer.nbytes
 
 
@@ -584,12 +592,23 @@ class SttClient:
     Input format is in PCM 16-bit, 16 kHz, 1 channel.
     """
 
+    __slots__ = (
+        "_call",
+        "_client",
+        "_loop",
+        "_scheduler",
+        "_stream",
+        "_stt_buffer",
+        "_stt_complete_gate",
+    )
+
     _call: CallStateModel
-    _client: SpeechRecognizer | None = None
+    _client: SpeechRecognizer | None
+    _loop: asyncio.AbstractEventLoop
     _scheduler: Scheduler
     _stream: PushAudioInputStream
-    _stt_buffer: list[str] = []
-    _stt_complete_gate: asyncio.Event = asyncio.Event()
+    _stt_buffer: list[str]
+    _stt_complete_gate: asyncio.Event
 
     def __init__(
         self,
@@ -598,7 +617,11 @@ class SttClient:
         scheduler: Scheduler,
     ):
         self._call = call
+        self._client = None
+        self._loop = asyncio.get_running_loop()
         self._scheduler = scheduler
+        self._stt_buffer = []
+        self._stt_complete_gate = asyncio.Event()
 
         self._stream = PushAudioInputStream(
             stream_format=AudioStreamFormat(
@@ -682,8 +705,8 @@ class SttClient:
         # Prepare for the next recognition
         self._stt_buffer.append("")
 
-        # Signal the completion
-        self._stt_complete_gate.set()
+        # Signal the completion, callback is called from the SDK thread
+        self._loop.call_soon_threadsafe(self._stt_complete_gate.set)
 
     async def _clear_buffer_when_completed(self) -> None:
         """
@@ -729,7 +752,7 @@ class SttClient:
         try:
             await asyncio.wait_for(
                 self._stt_complete_gate.wait(),
-                timeout=await recognition_stt_complete_timeout_ms() / 1000,
+                timeout=recognition_stt_complete_timeout_ms() / 1000,
             )
         except TimeoutError:
             logger.debug("Complete recognition timeout, using partial recognition")
@@ -751,20 +774,47 @@ class AECStream:
     Input and output formats are in PCM 16-bit, 16 kHz, 1 channel.
     """
 
-    _aec_in_queue: asyncio.Queue[bytes] = asyncio.Queue()
-    _aec_out_queue: asyncio.Queue[tuple[bytes, bool]] = asyncio.Queue()
-    _aec_reference_queue: asyncio.Queue[bytes] = asyncio.Queue()
-    _answer_start: float | None = None
+    __slots__ = (
+        "_aec_in_queue",
+        "_aec_out_queue",
+        "_aec_reference_queue",
+        "_answer_start",
+        "_canceller",
+        "_chunk_size",
+        "_dropped",
+        "_empty_packet",
+        "_in_raw_queue",
+        "_in_reference_queue",
+        "_missed",
+        "_out_queue",
+        "_packet_duration_ms",
+        "_packet_size",
+        "_padding",
+        "_run_task",
+        "_sample_rate",
+        "_scheduler",
+        "_vad",
+    )
+
+    _aec_in_queue: AudioQueue[bytes]
+    _aec_out_queue: AudioQueue[tuple[bytes, bool]]
+    _aec_reference_queue: asyncio.Queue[bytes | memoryview]
+    _answer_start: float | None
+    _canceller: PooledEchoCanceller
     _chunk_size: int
+    _dropped: int
     _empty_packet: bytes
     _in_raw_queue: asyncio.Queue[bytes]
-    _in_reference_queue: asyncio.Queue[bytes] = asyncio.Queue()
+    _in_reference_queue: asyncio.Queue[bytes]
+    _missed: int
     _out_queue: asyncio.Queue[bytes]
     _packet_duration_ms: int
     _packet_size: int
+    _padding: memoryview
     _run_task: asyncio.Future
     _sample_rate: int
     _scheduler: Scheduler
+    _vad: VoiceActivityDetector
 
     def __init__(  # noqa: PLR0913
         self,
@@ -788,168 +838,161 @@ class AECStream:
         - `sample_rate`: Audio sample rate in Hz.
         - `scheduler`: Scheduler for the async tasks.
         """
+        self._answer_start = None
+        self._dropped = 0
         self._in_raw_queue = in_raw_queue
         self._in_reference_queue = in_reference_queue
+        self._missed = 0
         self._out_queue = out_queue
         self._packet_duration_ms = packet_duration_ms
         self._sample_rate = sample_rate
         self._scheduler = scheduler
 
-        max_delay_samples = int(max_delay_ms / 1000 * self._sample_rate)
-        self._bot_voice_buffer = np.zeros(max_delay_samples, dtype=np.float32)
+        self._canceller = PooledEchoCanceller(
+            max_delay_ms=max_delay_ms,
+            packet_duration_ms=packet_duration_ms,
+            sample_rate=sample_rate,
+        )
 
         self._chunk_size = int(self._sample_rate * self._packet_duration_ms / 1000)
         self._packet_size = self._chunk_size * 2  # Each sample is 2 bytes (PCM 16-bit)
-        self._empty_packet: bytes = b"\x00" * self._packet_size
+        self._empty_packet = b"\x00" * self._packet_size
+        self._padding = memoryview(self._empty_packet)
+
+        # Queues between the steps, the oldest packets are dropped if the processing is late
+        self._aec_in_queue = AudioQueue(
+            maxsize=CONFIG.audio.queue.aec_in_max_size,
+            name="aec_in",
+        )
+        self._aec_out_queue = AudioQueue(
+            maxsize=CONFIG.audio.queue.aec_out_max_size,
+            name="aec_out",
+        )
+
+        # Bound the reference to the bot voice ahead of the playback
+        self._aec_reference_queue = asyncio.Queue(
+            maxsize=CONFIG.audio.aec.reference_max_sec * 1000 // packet_duration_ms
+        )
+
+        self._vad = VoiceActivityDetector(
+            attack_ms=CONFIG.audio.vad.attack_ms,
+            engine=CONFIG.audio.vad.engine(sample_rate),
+            hangover_ms=CONFIG.audio.vad.hangover_ms,
+            sample_rate=sample_rate,
+            threshold=0,  # Set when the stream starts
+        )
 
     async def __aenter__(self):
+        self._refresh_vad_threshold()
         self._run_task = asyncio.gather(
             self._forward_in(),
             self._forward_out(),
+            self._refresh_vad(),
             self._run(),
         )
         return self
 
     async def __aexit__(self, *args, **kwargs):
         self._run_task.cancel()
+        self._canceller.close()
 
-    def _pcm_to_float(self, pcm: bytes) -> np.ndarray:
+    def _refresh_vad_threshold(self) -> None:
         """
-        Convert PCM 16-bit to float (-1.0 to 1.0).
+        Update the VAD threshold from the feature.
         """
-        return (
-            np.frombuffer(
-                buffer=pcm,
-                dtype=np.int16,
-            ).astype(np.float32)
-            / 32768.0
-        )
+        # Divide by 10 to more usability from user side, as RMS is in range 0-1 and a detection of 0.1 is a good maximum threshold
+        self._vad.threshold = vad_threshold() / 10
 
-    def _float_to_pcm(self, floats: np.ndarray) -> bytes:
+    async def _refresh_vad(self) -> None:
         """
-        Convert float (-1.0 to 1.0) to PCM 16-bit.
+        Refresh the VAD threshold in the background, at the pace of the features cache.
         """
-        pcm = (floats * 32767).clip(-32768, 32767).astype(np.int16)
-        return pcm.tobytes()
-
-    def _update_input_buffer(self, voice: np.ndarray) -> None:
-        """
-        Update the rolling buffer for the input voice.
-        """
-        buffer_length = len(self._bot_voice_buffer)
-        reference_length = len(voice)
+        while True:
+            await asyncio.sleep(CONFIG.app_configuration.ttl_sec)
+            try:
+                self._refresh_vad_threshold()
 
-        if reference_length >= buffer_length:
-            # If the reference is longer than the buffer, keep the most recent samples
-            self._bot_voice_buffer = voice[-buffer_length:]
-        else:
-            # Append new samples and keep the buffer size fixed
-            self._bot_voice_buffer = np.roll(self._bot_voice_buffer, -reference_length)
-            self._bot_voice_buffer[-reference_length:] = voice
+            # Keep the previous threshold
+            except Exception:
+                logger.exception("Error refreshing VAD threshold")
 
-    async def _rms_speech_detection(self, voice: np.ndarray) -> bool:
+    async def _process_one(self, input_pcm: bytes) -> bool:
         """
-        Simple speech detection based on RMS (acoustic pressure).
+        Process one audio chunk.
 
-        Returns True if speech is detected, False otherwise.
+        Returns True if the chunk was processed, False if the engine was busy.
         """
-        # Calculate Root Mean Square (RMS)
-        rms = np.sqrt(np.mean(voice**2))
-        # Get VAD threshold, divide by 10 to more usability from user side, as RMS is in range 0-1 and a detection of 0.1 is a good maximum threshold
-        threshold = await vad_threshold() / 10
-        return rms >= threshold
+        # Engine is busy, keep the reference for the next chunk, to stay aligned with the bot voice
+        if not self._canceller.ready:
+            return False
 
-    async def _process_one(self, input_pcm: bytes) -> None:
-        """
-        Process one audio chunk.
-        """
         # Push raw input if reference is empty
         if self._aec_reference_queue.empty():
-            reference_pcm = self._empty_packet
+            reference_pcm = None
 
         # Reference signal is available
         else:
             reference_pcm = await self._aec_reference_queue.get()
             self._aec_reference_queue.task_done()
 
-        # Convert PCM to float for processing
-        input_signal = self._pcm_to_float(input_pcm)
-        reference_signal = self._pcm_to_float(reference_pcm)
-
-        # Update the input buffer with the reference signal
-        self._update_input_buffer(reference_signal)
-
-        # Reference signal is empty, skip noise reduction
-        if np.all(reference_signal == 0):
-            # Perform VAD test
-            input_speaking = await self._rms_speech_detection(input_signal)
-
-            # Add processed PCM and metadata to the output queue
-            await self._aec_out_queue.put((input_pcm, input_speaking))
-            return
-
-        # Apply noise reduction
-        reduced_signal = reduce_noise(
-            # Input signal
-            sr=self._sample_rate,
-            y=input_signal,
-            # Quality
-            n_fft=128,
-            # Since the reference signal is already noise-reduced, we can assume it's stationary
-            clip_noise_stationary=False,  # Noise is longer than the signal
-            stationary=True,
-            y_noise=self._bot_voice_buffer,
-            # Output quality
-            prop_decrease=0.75,  # Reduce noise by 75%
+        # Apply echo cancellation, skipped by the engine if the reference is silent
+        res = await self._canceller.process(
+            input_pcm=input_pcm,
+            reference_pcm=reference_pcm,
         )
+        if not res:
+            return False
+        processed_pcm, _ = res
 
         # Perform VAD test
-        input_speaking = await self._rms_speech_detection(reduced_signal)
-
-        # Convert processed float signal back to PCM
-        processed_pcm = self._float_to_pcm(reduced_signal)
+        input_speaking = self._vad.process(processed_pcm)
 
         # Add processed PCM and metadata to the output queue
         await self._aec_out_queue.put((processed_pcm, input_speaking))
+        return True
 
     async def _ensure_run_slo(self, input_pcm: bytes) -> None:
         """
         Ensure the audio stream is processed within the SLO.
 
-        If the processing is delayed, the original input will be returned.
+        If the processing is delayed, the original input will be returned, with its voice activity.
         """
         # Process the audio
         try:
-            await asyncio.wait_for(
+            processed = await asyncio.wait_for(
                 self._process_one(input_pcm),
                 timeout=self._packet_duration_ms
                 / 1000
                 * 4,  # Allow temporary medium latency
             )
 
-        # If the processing is delayed, return the original input
+        # Processing is too slow
         except TimeoutError:
+            processed = False
+
+        # If the processing is delayed or the engine is busy, return the original input
+        if not processed:
+            self._missed += 1
             # Enrich span
             counter_add(
                 metric=call_aec_missed,
                 value=1,
             )
-            await self._aec_out_queue.put((input_pcm, False))
+            await self._aec_out_queue.put((input_pcm, self._vad.process(input_pcm)))
 
     async def _run(self) -> None:
         """
         Process the audio stream in real-time.
+
+        Packets are processed one at a time, in order, as the engine accepts one packet per stream. If a packet misses the SLO, it is still processed in the background, and the next packets are returned raw until the engine is ready.
         """
-        async with Scheduler(
-            limit=5,  # Allow 5 concurrent tasks
-        ) as scheduler:
-            while True:
-                # Fetch input audio
-                input_pcm = await self._aec_in_queue.get()
-                self._aec_in_queue.task_done()
+        while True:
+            # Fetch input audio
+            input_pcm = await self._aec_in_queue.get()
+            self._aec_in_queue.task_done()
 
-                # Queue the processing
-                await scheduler.spawn(self._ensure_run_slo(input_pcm))
+            # Process the audio
+            await self._ensure_run_slo(input_pcm)
 
     async def pull_audio(self) -> tuple[bytes, bool]:
         """
@@ -968,6 +1011,7 @@ class AECStream:
 
         # If the processing is delayed, return an empty packet
         except TimeoutError:
+            self._dropped += 1
             # Enrich span
             counter_add(
                 metric=call_aec_droped,
@@ -997,6 +1041,8 @@ class AECStream:
     async def _forward_out(self) -> None:
         """
         Forward processed audio to the clean output queue.
+
+        Bot voice is forwarded to the output as soon as it is received, and split in packets as reference for the echo cancellation. When the reference is full, the next audio is forwarded at the playback pace.
         """
         while True:
             # Consume input
@@ -1012,20 +1058,44 @@ class AECStream:
                 )
             self._answer_start = None
 
-            # Send to clean output
+            # Send to clean output, the reference below is a view of the same buffer
             await self._out_queue.put(audio_data)
 
-            # Send a copy as reference, extract packets and pad them if necessary
-            buffer_pointer = 0
-            while buffer_pointer < len(audio_data):
-                chunk = audio_data[: self._packet_size].ljust(
-                    self._packet_size, b"\x00"
+            # Send as reference, split in packets without copying the audio, waits if the reference is full
+            view = memoryview(audio_data)
+            full_size = len(view) - len(view) % self._packet_size
+            for offset in range(0, full_size, self._packet_size):
+                await self._aec_reference_queue.put(
+                    view[offset : offset + self._packet_size]
+                )
+
+            # Pad the last packet with silence
+            if full_size < len(view):
+                await self._aec_reference_queue.put(
+                    b"".join(
+                        (
+                            view[full_size:],
+                            self._padding[: self._packet_size - len(view) + full_size],
+                        )
+                    )
                 )
-                await self._aec_reference_queue.put(chunk)
-                buffer_pointer += self._packet_size
 
     def answer_start(self):
         """
         Notify the the user ended speaking.
         """
         self._answer_start = time.monotonic()
+
+    @property
+    def dropped(self) -> int:
+        """
+        Number of packets dropped, because the processing was too slow.
+        """
+        return self._dropped + self._aec_in_queue.dropped + self._aec_out_queue.dropped
+
+    @property
+    def missed(self) -> int:
+        """
+        Number of input packets forwarded without echo cancellation, because the processing was too slow.
+        """
+        return self._missed
@@ -0,0 +1,96 @@
+from enum import Enum
+
+from pydantic import BaseModel, Field
+
+from app.helpers.audio_vad import IVadEngine
+
+
+class VadModeEnum(str, Enum):
+    ENERGY = "energy"
+    """Use energy and zero-crossing rate detection."""
+    WEBRTC = "webrtc"
+    """Use WebRTC detection, requires the `webrtc` extra."""
+
+
+class AecModel(BaseModel, frozen=True):
+    """
+    Echo cancellation processing.
+
+    Packets of all the calls of the server worker are processed in batches, in a shared pool of processes. A pool size of 0 processes the batches in the event loop.
+
+    Bot voice is kept as reference for the echo cancellation up to `reference_max_sec`, the bot voice is then forwarded to the phone at the playback pace.
+    """
+
+    batch_max_size: int = Field(default=64, ge=1)
+    batch_window_ms: int = Field(default=5, ge=0, le=20)
+    max_pending: int = Field(default=64, ge=1)
+    pool_size: int = Field(default=1, ge=0)
+    reference_max_sec: int = Field(default=10, ge=1)
+
+
+class AudioQueueModel(BaseModel, frozen=True):
+    """
+    Audio queues of a call, in number of frames.
+
+    Queues are bounded, the oldest frames are dropped when a queue is full, so a late call loses audio instead of growing the memory and the latency. The bot voice queue is the exception: it carries the stop signal and spoken sentences, so when full the producer waits instead.
+    """
+
+    aec_in_max_size: int = Field(default=25, ge=1)  # 500 ms of 20 ms packets
+    aec_out_max_size: int = Field(default=25, ge=1)  # 500 ms of 20 ms packets
+    in_max_size: int = Field(default=50, ge=1)  # 1 sec of 20 ms packets
+    out_max_size: int = Field(default=500, ge=1)  # Bot voice, TTS chunks
+
+
+class EnergyVadModel(BaseModel, frozen=True):
+    zcr_max: float = Field(default=0.25, ge=0, le=1)
+
+
+class WebRtcVadModel(BaseModel, frozen=True):
+    aggressiveness: int = Field(default=2, ge=0, le=3)
+
+
+class VadModel(BaseModel, frozen=True):
+    """
+    Voice activity detection.
+
+    Speech is detected after `attack_ms` of speech, and ends after `hangover_ms` of non-speech. Threshold is configured with the `vad_threshold` feature.
+    """
+
+    attack_ms: int = Field(default=20, ge=0)
+    energy: EnergyVadModel = EnergyVadModel()  # Object is fully defined by default
+    hangover_ms: int = Field(default=100, ge=0)
+    mode: VadModeEnum = VadModeEnum.ENERGY
+    webrtc: WebRtcVadModel = WebRtcVadModel()  # Object is fully defined by default
+
+    def engine(self, sample_rate: int) -> IVadEngine:
+        """
+        Create an engine, for a single stream.
+        """
+        if self.mode == VadModeEnum.WEBRTC:
+            from app.helpers.audio_vad import WebRtcVadEngine
+
+            return WebRtcVadEngine(
+                aggressiveness=self.webrtc.aggressiveness,
+                sample_rate=sample_rate,
+            )
+
+        from app.helpers.audio_vad import EnergyVadEngine
+
+        return EnergyVadEngine(zcr_max=self.energy.zcr_max)
+
+
+class MediaModel(BaseModel, frozen=True):
+    """
+    Media messages exchanged with Communication Services over the websocket.
+
+    Bot voice already queued is sent in a single message, up to `out_frame_max_ms`, so the number of messages does not grow with the number of TTS chunks.
+    """
+
+    out_frame_max_ms: int = Field(default=500, ge=20)
+
+
+class AudioModel(BaseModel):
+    aec: AecModel = AecModel()  # Object is fully defined by default
+    media: MediaModel = MediaModel()  # Object is fully defined by default
+    queue: AudioQueueModel = AudioQueueModel()  # Object is fully defined by default
+    vad: VadModel = VadModel()  # Object is fully defined by default
@@ -11,10 +11,12 @@ class ModeEnum(str, Enum):
     """Use memory cache."""
     REDIS = "redis"
     """Use Redis cache."""
+    TIERED = "tiered"
+    """Use memory cache in front of Redis cache."""
 
 
 class MemoryModel(BaseModel, frozen=True):
-    max_size: int = Field(default=128, ge=10)
+    max_bytes: int = Field(default=64 * 1024 * 1024, ge=1024)  # 64 MB
 
     @cached_property
     def instance(self) -> ICache:
@@ -41,10 +43,23 @@ class RedisModel(BaseModel, frozen=True):
         return RedisCache(self)
 
 
+class TieredModel(BaseModel, frozen=True):
+    """
+    Memory cache in front of Redis cache.
+
+    Values are kept in memory for `memory_ttl_sec` at most. Changes are published on the Redis `channel`, the other workers drop their copy. If a change is missed, the value is stale until it expires from memory.
+    """
+
+    channel: str = "cache-invalidation"
+    memory_max_bytes: int = Field(default=8 * 1024 * 1024, ge=1024)  # 8 MB
+    memory_ttl_sec: int = Field(default=10, ge=1)
+
+
 class CacheModel(BaseModel):
     memory: MemoryModel | None = MemoryModel()  # Object is fully defined by default
     mode: ModeEnum = ModeEnum.MEMORY
     redis: RedisModel | None = None
+    tiered: TieredModel | None = TieredModel()  # Object is fully defined by default
 
     @field_validator("redis")
     @classmethod
@@ -53,10 +68,24 @@ class CacheModel(BaseModel):
         redis: RedisModel | None,
         info: ValidationInfo,
     ) -> RedisModel | None:
-        if not redis and info.data.get("mode", None) == ModeEnum.REDIS:
+        if not redis and info.data.get("mode", None) in (
+            ModeEnum.REDIS,
+            ModeEnum.TIERED,
+        ):
             raise ValueError("Redis config required")
         return redis
 
+    @field_validator("tiered")
+    @classmethod
+    def _validate_tiered(
+        cls,
+        tiered: TieredModel | None,
+        info: ValidationInfo,
+    ) -> TieredModel | None:
+        if not tiered and info.data.get("mode", None) == ModeEnum.TIERED:
+            raise ValueError("Tiered config required")
+        return tiered
+
     @field_validator("memory")
     @classmethod
     def _validate_memory(
@@ -74,5 +103,16 @@ class CacheModel(BaseModel):
             assert self.memory
             return self.memory.instance
 
+        if self.mode == ModeEnum.TIERED:
+            from app.persistence.tiered import (
+                TieredCache,
+            )
+
+            assert self.redis and self.tiered
+            return TieredCache(
+                config=self.tiered,
+                redis=self.redis,
+            )
+
         assert self.redis
         return self.redis.instance
@@ -1,14 +1,32 @@
+from enum import Enum
 from functools import cached_property
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, ValidationInfo, field_validator
 
 from app.persistence.istore import IStore
 
 
+class ModeEnum(str, Enum):
+    COSMOS_DB = "cosmos_db"
+    """Use Cosmos DB."""
+    SQLITE = "sqlite"
+    """Use an embedded SQLite database, for a single node or tests."""
+
+
 class CosmosDbModel(BaseModel, frozen=True):
+    """
+    Cosmos DB store.
+
+    Changes of a call are written behind, the transactions within `write_behind_ms` are merged in a single request. Pending changes are written when the call is hung up.
+
+    If `messages_window` is set, the call document keeps only the last messages. When it holds twice the window, the older messages are moved to a compressed archive document, in the same partition. The conversation used by the assistant is limited to the window. Archived messages are loaded back for the report and the post-call intelligence.
+    """
+
     container: str
     database: str
     endpoint: str
+    messages_window: int | None = Field(default=None, ge=10)
+    write_behind_ms: int = Field(default=500, ge=0)
 
     @cached_property
     def instance(self) -> IStore:
@@ -23,9 +41,62 @@ class CosmosDbModel(BaseModel, frozen=True):
         )
 
 
+class SqliteModel(BaseModel, frozen=True):
+    """
+    SQLite store, in a local file.
+
+    Changes of a call are written immediately, as there is no network round-trip. The database is shared by the processes of the same node only.
+    """
+
+    path: str = ".sqlite/calls.db"
+
+    @cached_property
+    def instance(self) -> IStore:
+        from app.helpers.config import CONFIG
+        from app.persistence.sqlite import (
+            SqliteStore,
+        )
+
+        return SqliteStore(
+            cache=CONFIG.cache.instance,
+            config=self,
+        )
+
+
 class DatabaseModel(BaseModel):
-    cosmos_db: CosmosDbModel
+    mode: ModeEnum = (
+        ModeEnum.COSMOS_DB
+    )  # Place before the backends as they depend on it for validation
+    cosmos_db: CosmosDbModel | None = Field(default=None, validate_default=True)
+    sqlite: SqliteModel | None = SqliteModel()  # Object is fully defined by default
+
+    @field_validator("cosmos_db")
+    @classmethod
+    def _validate_cosmos_db(
+        cls,
+        cosmos_db: CosmosDbModel | None,
+        info: ValidationInfo,
+    ) -> CosmosDbModel | None:
+        if not cosmos_db and info.data.get("mode", None) == ModeEnum.COSMOS_DB:
+            raise ValueError("Cosmos DB config required")
+        return cosmos_db
+
+    @field_validator("sqlite")
+    @classmethod
+    def _validate_sqlite(
+        cls,
+        sqlite: SqliteModel | None,
+        info: ValidationInfo,
+    ) -> SqliteModel | None:
+        if not sqlite and info.data.get("mode", None) == ModeEnum.SQLITE:
+            raise ValueError("SQLite config required")
+        return sqlite
 
     @cached_property
     def instance(self) -> IStore:
+        if self.mode == ModeEnum.SQLITE:
+            assert self.sqlite
+            return self.sqlite.instance
+
+        assert self.cosmos_db
         return self.cosmos_db.instance
@@ -8,6 +8,7 @@ from pydantic_settings import (
 from app.helpers.config_models.ai_search import AiSearchModel
 from app.helpers.config_models.ai_translation import AiTranslationModel
 from app.helpers.config_models.app_configuration import AppConfigurationModel
+from app.helpers.config_models.audio import AudioModel
 from app.helpers.config_models.cache import CacheModel
 from app.helpers.config_models.cognitive_service import CognitiveServiceModel
 from app.helpers.config_models.communication_services import CommunicationServicesModel
@@ -35,6 +36,7 @@ class RootModel(BaseSettings):
     # Editable fields
     ai_search: AiSearchModel
     ai_translation: AiTranslationModel
+    audio: AudioModel = AudioModel()  # Object is fully defined by default
     cache: CacheModel = CacheModel()  # Object is fully defined by default
     cognitive_service: CognitiveServiceModel
     communication_services: CommunicationServicesModel = Field(
@@ -1,69 +1,80 @@
+"""
+Features, from App Configuration.
+
+All the settings are loaded in a single request, into an immutable snapshot. Reads are synchronous, from the snapshot. When the snapshot is older than the TTL, it is refreshed in the background, and reads are served from the stale one meanwhile. If App Configuration is not available, the last snapshot is kept.
+"""
+
+import asyncio
+import time
+from collections.abc import Mapping
+from types import MappingProxyType
 from typing import TypeVar, cast
 
 from azure.appconfiguration.aio import AzureAppConfigurationClient
-from azure.core.exceptions import ResourceNotFoundError
 
-from app.helpers.cache import lru_acache
+from app.helpers.cache import lru_acache, single_flight
 from app.helpers.config import CONFIG
-from app.helpers.config_models.cache import MemoryModel
 from app.helpers.http import azure_transport
 from app.helpers.identity import credential
 from app.helpers.logging import logger
-from app.persistence.memory import MemoryCache
 
-_cache = MemoryCache(MemoryModel())
+_REFRESH_RETRY_SEC = 10  # After a failure, retry sooner than the TTL
+_defaulted: set[str] = set()  # Settings not found in the snapshot, logged once
+_refresh_at: float = 0  # Monotonic time after which the snapshot is stale
+_refresh_task: asyncio.Task | None = None
+_snapshot: Mapping[str, str] = MappingProxyType({})
 T = TypeVar("T", bool, int, float, str)
 
 
-async def answer_hard_timeout_sec() -> int:
+def answer_hard_timeout_sec() -> int:
     """
     Time waiting the LLM before aborting the answer with an error message.
     """
-    return await _default(
+    return _default(
         default=15,
         key="answer_hard_timeout_sec",
         type_res=int,
     )
 
 
-async def answer_soft_timeout_sec() -> int:
+def answer_soft_timeout_sec() -> int:
     """
     Time waiting the LLM before sending a waiting message.
     """
-    return await _default(
+    return _default(
         default=3,
         key="answer_soft_timeout_sec",
         type_res=int,
     )
 
 
-async def callback_timeout_hour() -> int:
+def callback_timeout_hour() -> int:
     """
     The timeout for a callback in hours. Set 0 to disable.
     """
-    return await _default(
+    return _default(
         default=24,
         key="callback_timeout_hour",
         type_res=int,
     )
 
 
-async def phone_silence_timeout_sec() -> int:
+def phone_silence_timeout_sec() -> int:
     """
     Amount of silence in secs to trigger a warning message from the assistant.
     """
-    return await _default(
+    return _default(
         default=20,
         key="phone_silence_timeout_sec",
         type_res=int,
     )
 
 
-async def vad_threshold() -> float:
+def vad_threshold() -> float:
     """
     The threshold for voice activity detection. Between 0.1 and 1.
     """
-    return await _default(
+    return _default(
         default=0.5,
         key="vad_threshold",
         max_incl=1,
@@ -72,55 +83,55 @@ async def vad_threshold() -> float:
     )
 
 
-async def vad_silence_timeout_ms() -> int:
+def vad_silence_timeout_ms() -> int:
     """
     Silence to trigger voice activity detection in milliseconds.
     """
-    return await _default(
+    return _default(
         default=500,
         key="vad_silence_timeout_ms",
         type_res=int,
     )
 
 
-async def vad_cutoff_timeout_ms() -> int:
+def vad_cutoff_timeout_ms() -> int:
     """
     The cutoff timeout for voice activity detection in milliseconds.
     """
-    return await _default(
+    return _default(
         default=250,
         key="vad_cutoff_timeout_ms",
         type_res=int,
     )
 
 
-async def recording_enabled() -> bool:
+def recording_enabled() -> bool:
     """
     Whether call recording is enabled.
     """
-    return await _default(
+    return _default(
         default=False,
         key="recording_enabled",
         type_res=bool,
     )
 
 
-async def slow_llm_for_chat() -> bool:
+def slow_llm_for_chat() -> bool:
     """
     Whether to use the slow LLM for chat.
     """
-    return await _default(
+    return _default(
         default=True,
         key="slow_llm_for_chat",
         type_res=bool,
     )
 
 
-async def recognition_retry_max() -> int:
+def recognition_retry_max() -> int:
     """
     The maximum number of retries for voice recognition. Minimum of 1.
     """
-    return await _default(
+    return _default(
         default=3,
         key="recognition_retry_max",
         min_incl=1,
@@ -128,18 +139,45 @@ async def recognition_retry_max() -> int:
     )
 
 
-async def recognition_stt_complete_timeout_ms() -> int:
+def recognition_stt_complete_timeout_ms() -> int:
     """
     The timeout for STT completion in milliseconds.
     """
-    return await _default(
+    return _default(
         default=100,
         key="recognition_stt_complete_timeout_ms",
         type_res=int,
     )
 
 
-async def _default(
+@single_flight()
+async def refresh() -> None:
+    """
+    Load all the settings from App Configuration, in a single request, and replace the snapshot.
+
+    If App Configuration is not available, the last snapshot is kept, and the refresh is retried sooner than the TTL.
+    """
+    global _refresh_at  # noqa: PLW0603
+
+    try:
+        client = await _use_client()
+        settings = {
+            setting.key: setting.value
+            async for setting in client.list_configuration_settings()
+            if setting.value is not None
+        }
+        _load(settings)
+
+    # Any error, as the refresh runs in the background and must not fail the reads
+    except Exception:
+        logger.exception("Error loading features, keeping the last ones")
+        _refresh_at = time.monotonic() + _REFRESH_RETRY_SEC
+        return
+
+    logger.debug("Features refreshed: %s", settings)
+
+
+def _default(
     default: T,
     key: str,
     type_res: type[T],
@@ -147,14 +185,14 @@ async def _default(
     min_incl: T | None = None,
 ) -> T:
     """
-    Get a setting from the App Configuration service with a default value.
+    Get a setting from the snapshot with a default value.
     """
     # Get the setting
-    res = await _get(
+    res = _get(
         key=key,
         type_res=type_res,
     )
-    if res:
+    if res is not None:
         return _validate(
             key=key,
             max_incl=max_incl,
@@ -162,8 +200,10 @@ async def _default(
             res=res,
         )
 
-    # Return default
-    logger.info("Feature %s not found, using default: %s", key, default)
+    # Return default, log once per snapshot as it is read on the hot path
+    if key not in _defaulted:
+        _defaulted.add(key)
+        logger.info("Feature %s not found, using default: %s", key, default)
     return _validate(
         key=key,
         max_incl=max_incl,
@@ -193,50 +233,62 @@ def _validate(
     return res
 
 
-async def _get(key: str, type_res: type[T]) -> T | None:
+def _get(key: str, type_res: type[T]) -> T | None:
     """
-    Get a setting from the App Configuration service.
+    Get a setting from the snapshot.
+
+    If the snapshot is stale, it is refreshed in the background. If the value cannot be parsed, `None` is returned, so the default is used.
     """
-    # Try cache
-    cache_key = _cache_key(key)
-    cached = await _cache.get(cache_key)
-    if cached:
+    if time.monotonic() >= _refresh_at:
+        _revalidate()
+
+    value = _snapshot.get(key, None)
+    if value is None:
+        return None
+    try:
         return _parse(
             type_res=type_res,
-            value=cached.decode(),
+            value=value,
         )
+    except ValueError:
+        logger.debug("Feature %s is not a valid %s: %s", key, type_res, value)
+        return None
 
-    # Try live
-    try:
-        async with await _use_client() as client:
-            setting = await client.get_configuration_setting(key)
-        # Return default if not found
-        if not setting:
-            return
-        res = setting.value
-    except ResourceNotFoundError:
-        return
 
-    logger.debug("Setting %s refreshed: %s", key, res)
+def _load(settings: dict[str, str]) -> None:
+    """
+    Replace the snapshot with settings.
+    """
+    global _refresh_at, _snapshot  # noqa: PLW0603
 
-    # Update cache
-    await _cache.set(
-        key=cache_key,
-        ttl_sec=CONFIG.app_configuration.ttl_sec,
-        value=res,
-    )
+    _snapshot = MappingProxyType(dict(settings))
+    _defaulted.clear()
+    _refresh_at = time.monotonic() + CONFIG.app_configuration.ttl_sec
 
-    # Return value
-    return _parse(
-        type_res=type_res,
-        value=res,
-    )
+
+def _revalidate() -> None:
+    """
+    Refresh the snapshot in the background, if not already refreshing.
+
+    Skipped if there is no running event loop.
+    """
+    global _refresh_task  # noqa: PLW0603
+
+    if _refresh_task and not _refresh_task.done():
+        return
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return
+    _refresh_task = loop.create_task(refresh())
 
 
 @lru_acache()
 async def _use_client() -> AzureAppConfigurationClient:
     """
-    Generate the App Configuration client and close it after use.
+    Generate the App Configuration client.
+
+    The client is kept open, to be reused by the next refreshes.
     """
     logger.debug(
         "Using App Configuration client for %s", CONFIG.app_configuration.endpoint
@@ -252,13 +304,6 @@ async def _use_client() -> AzureAppConfigurationClient:
     )
 
 
-def _cache_key(key: str) -> str:
-    """
-    Generate a cache key for a setting.
-    """
-    return f"{__name__}-{key}"
-
-
 def _parse(value: str, type_res: type[T]) -> T | None:
     """
     Parse a setting value to a type.
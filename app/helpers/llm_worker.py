@@ -88,7 +88,7 @@ async def completion_stream(
         async for attempt in retryed:
             with attempt:
                 async for chunck in _completion_stream_worker(
-                    is_fast=not await slow_llm_for_chat(),  # Let configuration decide
+                    is_fast=not slow_llm_for_chat(),  # Let configuration decide
                     max_tokens=max_tokens,
                     messages=messages,
                     system=system,
@@ -108,7 +108,7 @@ async def completion_stream(
     async for attempt in retryed:
         with attempt:
             async for chunck in _completion_stream_worker(
-                is_fast=await slow_llm_for_chat(),  # Let configuration decide
+                is_fast=slow_llm_for_chat(),  # Let configuration decide
                 max_tokens=max_tokens,
                 messages=messages,
                 system=system,
@@ -58,12 +58,24 @@ class SpanAttributeEnum(str, Enum):
 
 
 class SpanMeterEnum(str, Enum):
+    CACHE_EVICTIONS = "cache.evictions"
+    """Cache items removed before being read, because expired or the cache was full."""
+    CACHE_HITS = "cache.hits"
+    """Cache reads that found a value."""
+    CACHE_MISSES = "cache.misses"
+    """Cache reads that found no value."""
+    CACHE_SIZE = "cache.size"
+    """Cache size in bytes."""
     CALL_ANSWER_LATENCY = "call.answer.latency"
     """Answer latency in seconds."""
     CALL_AEC_MISSED = "call.aec.missed"
     """Echo cancellation missed frames."""
     CALL_AEC_DROPED = "call.aec.droped"
     """Echo cancellation dropped frames."""
+    CALL_AUDIO_QUEUE_DEPTH = "call.audio.queue.depth"
+    """Audio queue depth in frames."""
+    CALL_AUDIO_QUEUE_DROPPED = "call.audio.queue.dropped"
+    """Audio queue dropped frames, when the queue is full."""
     CALL_CUTOFF_LATENCY = "call.cutoff.latency"
     """Cutoff latency in seconds."""
     CALL_FRAMES_IN_LATENCY = "call.frames.in.latency"
@@ -130,9 +142,15 @@ meter = metrics.get_meter(
 )
 
 # Init metrics
+cache_evictions = SpanMeterEnum.CACHE_EVICTIONS.counter("items")
+cache_hits = SpanMeterEnum.CACHE_HITS.counter("reads")
+cache_misses = SpanMeterEnum.CACHE_MISSES.counter("reads")
+cache_size = SpanMeterEnum.CACHE_SIZE.gauge("bytes")
 call_aec_droped = SpanMeterEnum.CALL_AEC_DROPED.counter("frames")
 call_aec_missed = SpanMeterEnum.CALL_AEC_MISSED.counter("frames")
 call_answer_latency = SpanMeterEnum.CALL_ANSWER_LATENCY.gauge("s")
+call_audio_queue_depth = SpanMeterEnum.CALL_AUDIO_QUEUE_DEPTH.gauge("frames")
+call_audio_queue_dropped = SpanMeterEnum.CALL_AUDIO_QUEUE_DROPPED.counter("frames")
 call_cutoff_latency = SpanMeterEnum.CALL_CUTOFF_LATENCY.gauge("s")
 call_frames_in_latency = SpanMeterEnum.CALL_FRAMES_IN_LATENCY.gauge("s")
 call_frames_out_latency = SpanMeterEnum.CALL_FRAMES_OUT_LATENCY.gauge("s")
@@ -142,6 +160,7 @@ call_stt_complete_latency = SpanMeterEnum.CALL_STT_COMPLETE_LATENCY.gauge("s")
 def gauge_set(
     metric: Gauge,
     value: float | int,
+    attributes: Attributes = None,
 ):
     """
     Set a gauge metric value with context attributes.
@@ -153,6 +172,8 @@ def gauge_set(
             **_default_attributes,
             # Then, set context attributes, they can override default attributes
             **get_contextvars(),
+            # Finally, set metric attributes
+            **(attributes or {}),
         },
     )
 
@@ -160,6 +181,7 @@ def gauge_set(
 def counter_add(
     metric: Counter,
     value: float | int,
+    attributes: Attributes = None,
 ):
     """
     Add a counter metric value with context attributes.
@@ -171,6 +193,8 @@ def counter_add(
             **_default_attributes,
             # Then, set context attributes, they can override default attributes
             **get_contextvars(),
+            # Finally, set metric attributes
+            **(attributes or {}),
         },
     )
 
@@ -9,16 +9,19 @@ from tenacity import (
     wait_random_exponential,
 )
 
-from app.helpers.cache import lru_acache
+from app.helpers.cache import lru_acache, single_flight
 from app.helpers.config import CONFIG
 from app.helpers.http import azure_transport
 from app.helpers.logging import logger
 
 logger.info("Using Translation %s", CONFIG.ai_translation.endpoint)
 
+_BATCH_MAX_CHARS = 50000  # See: https://learn.microsoft.com/en-us/azure/ai-services/translator/service-limits
+_BATCH_MAX_ITEMS = 1000
 _cache = CONFIG.cache.instance
 
 
+@single_flight()
 @retry(
     reraise=True,
     retry=retry_if_exception_type(HttpResponseError),
@@ -29,14 +32,14 @@ async def translate_text(text: str, source_lang: str, target_lang: str) -> str |
     """
     Translate text from source language to target language.
 
-    If the source and target languages are the same, the original text is returned. Catch errors for a maximum of 3 times.
+    If the source and target languages are the same, the original text is returned. Concurrent calls for the same text are coalesced. Catch errors for a maximum of 3 times.
     """
     # No need to translate
     if source_lang == target_lang:
         return text
 
     # Try cache
-    cache_key = f"{__name__}-translate_text-{text}-{source_lang}-{target_lang}"
+    cache_key = _cache_key(source_lang=source_lang, target_lang=target_lang, text=text)
     cached = await _cache.get(cache_key)
     if cached:
         return cached.decode()
@@ -61,6 +64,95 @@ async def translate_text(text: str, source_lang: str, target_lang: str) -> str |
     return translation
 
 
+@retry(
+    reraise=True,
+    retry=retry_if_exception_type(HttpResponseError),
+    stop=stop_after_attempt(3),
+    wait=wait_random_exponential(multiplier=0.8, max=8),
+)
+async def translate_texts(
+    texts: list[tuple[str, str]],
+    target_lang: str,
+) -> list[str | None]:
+    """
+    Translate texts from their source language to the target language.
+
+    Texts are tuples of the text and its source language. The cache is read and updated with a single request each, the texts not cached are translated with a request per source language. Catch errors for a maximum of 3 times.
+
+    Returns the translations in the order of the texts.
+    """
+    res: list[str | None] = [
+        text if source_lang == target_lang else None for text, source_lang in texts
+    ]
+
+    # Try cache
+    indexes = [i for i, translation in enumerate(res) if translation is None]
+    if not indexes:
+        return res
+    cache_keys = [
+        _cache_key(source_lang=texts[i][1], target_lang=target_lang, text=texts[i][0])
+        for i in indexes
+    ]
+    missing: dict[str, list[int]] = {}  # Indexes by source language
+    for i, cached in zip(indexes, await _cache.get_many(cache_keys), strict=True):
+        if cached:
+            res[i] = cached.decode()
+        else:
+            missing.setdefault(texts[i][1], []).append(i)
+    if not missing:
+        return res
+
+    # Try live, by batches within the service limits
+    updates: dict[str, str | bytes | None] = {}
+    async with await _use_client() as client:
+        for source_lang, source_indexes in missing.items():
+            for batch in _batches(source_indexes, texts):
+                items: list[TranslatedTextItem] = await client.translate(
+                    body=[texts[i][0] for i in batch],
+                    from_language=source_lang,
+                    to_language=[target_lang],
+                )
+                for i, item in zip(batch, items, strict=True):
+                    res[i] = item.translations[0].text if item.translations else None
+                    updates[
+                        _cache_key(
+                            source_lang=source_lang,
+                            target_lang=target_lang,
+                            text=texts[i][0],
+                        )
+                    ] = res[i]
+
+    # Update cache
+    await _cache.set_many(
+        items=updates,
+        ttl_sec=60 * 60 * 24,  # 1 day
+    )
+
+    return res
+
+
+def _batches(indexes: list[int], texts: list[tuple[str, str]]) -> list[list[int]]:
+    """
+    Split the texts in batches, within the limits of a translation request.
+    """
+    batches: list[list[int]] = [[]]
+    chars = 0
+    for i in indexes:
+        size = len(texts[i][0])
+        if batches[-1] and (
+            len(batches[-1]) >= _BATCH_MAX_ITEMS or chars + size > _BATCH_MAX_CHARS
+        ):
+            batches.append([])
+            chars = 0
+        batches[-1].append(i)
+        chars += size
+    return batches
+
+
+def _cache_key(source_lang: str, target_lang: str, text: str) -> str:
+    return f"{__name__}-translate_text-{text}-{source_lang}-{target_lang}"
+
+
 @lru_acache()
 async def _use_client() -> TextTranslationClient:
     """
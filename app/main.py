@@ -1,12 +1,13 @@
 import asyncio
 import json
 import time
-from base64 import b64decode, b64encode
+import zlib
+from collections.abc import AsyncGenerator
 from contextlib import asynccontextmanager
-from datetime import timedelta
+from datetime import UTC, datetime, timedelta
 from http import HTTPStatus
 from os import getenv
-from typing import Annotated, Any
+from typing import Annotated
 from urllib.parse import quote_plus, urljoin
 from uuid import UUID
 
@@ -33,7 +34,7 @@ from fastapi import (
     WebSocketDisconnect,
 )
 from fastapi.exceptions import RequestValidationError, ValidationException
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse
 from htmlmin.minify import html_minify
 from jinja2 import Environment, FileSystemLoader
 from pydantic import Field, TypeAdapter, ValidationError
@@ -41,6 +42,9 @@ from starlette.datastructures import Headers
 from starlette.exceptions import HTTPException as StarletteHTTPException
 from twilio.twiml.messaging_response import MessagingResponse
 
+from app.helpers.audio_codec import STOP_AUDIO_MESSAGE, AudioEncoder, decode_audio
+from app.helpers.audio_pool import shutdown_pool
+from app.helpers.audio_queue import AudioQueue
 from app.helpers.cache import get_scheduler, lru_acache
 from app.helpers.call_events import (
     on_audio_connected,
@@ -58,6 +62,7 @@ from app.helpers.call_events import (
 )
 from app.helpers.call_utils import ContextEnum as CallContextEnum
 from app.helpers.config import CONFIG
+from app.helpers.features import refresh as features_refresh
 from app.helpers.http import aiohttp_session, azure_transport
 from app.helpers.logging import logger
 from app.helpers.monitoring import (
@@ -70,7 +75,12 @@ from app.helpers.monitoring import (
 )
 from app.helpers.pydantic_types.phone_numbers import PhoneNumber
 from app.helpers.resources import resources_dir
-from app.models.call import CallGetModel, CallInitiateModel, CallStateModel
+from app.models.call import (
+    CallGetModel,
+    CallInitiateModel,
+    CallStateModel,
+    CallSummaryModel,
+)
 from app.models.error import ErrorInnerModel, ErrorModel
 from app.models.next import ActionEnum as NextActionEnum
 from app.models.readiness import ReadinessCheckModel, ReadinessEnum, ReadinessModel
@@ -134,6 +144,9 @@ logger.info("Using callback URL %s", _COMMUNICATIONSERVICES_CALLABACK_TPL)
 async def lifespan(app: FastAPI):  # noqa: ARG001
     queue_tasks = None
 
+    # Load features before serving, reads are then served from memory
+    await features_refresh()
+
     try:
         queue_tasks = asyncio.gather(
             _call_queue.trigger(
@@ -163,6 +176,9 @@ async def lifespan(app: FastAPI):  # noqa: ARG001
     # Close HTTP session
     await (await aiohttp_session()).close()
 
+    # Stop audio processing workers
+    shutdown_pool()
+
 
 # FastAPI
 api = FastAPI(
@@ -246,19 +262,25 @@ async def health_readiness_get() -> JSONResponse:
     response_class=HTMLResponse,
 )
 @start_as_current_span("report_get")
-async def report_get(phone_number: str | None = None) -> HTMLResponse:
+async def report_get(
+    continuation: str | None = None,
+    phone_number: str | None = None,
+) -> HTMLResponse:
     """
     List all calls with a web interface.
 
     Optional URL parameters:
+    - continuation: Continuation token of the page, from the previous page
     - phone_number: Filter by phone number
 
     Returns a list of calls with a web interface.
     """
     phone_number = PhoneNumber(phone_number) if phone_number else None
     count = 100
-    calls, total = (
-        await _db.call_search_all(count=count, phone_number=phone_number) or []
+    calls, total, next_continuation = await _db.call_search_summaries(
+        continuation=continuation,
+        count=count,
+        phone_number=phone_number,
     )
 
     template = _jinja.get_template("list.html.jinja")
@@ -268,7 +290,7 @@ async def report_get(phone_number: str | None = None) -> HTMLResponse:
         ),
         bot_phone_number=CONFIG.communication_services.phone_number,
         calls=calls or [],
-        count=count,
+        continuation=next_continuation,
         phone_number=phone_number,
         total=total,
         version=CONFIG.version,
@@ -300,6 +322,9 @@ async def report_single_get(call_id: UUID) -> HTMLResponse:
             status_code=HTTPStatus.NOT_FOUND,
         )
 
+    # Load the whole conversation
+    await _db.call_load_messages(call)
+
     template = _jinja.get_template("single.html.jinja")
     render = await template.render_async(
         applicationinsights_connection_string=getenv(
@@ -319,27 +344,74 @@ async def report_single_get(call_id: UUID) -> HTMLResponse:
 @api.get("/call")
 @start_as_current_span("call_list_get")
 async def call_list_get(
+    response: Response,
+    continuation: str | None = None,
     phone_number: str | None = None,
-) -> list[CallGetModel]:
+) -> list[CallSummaryModel]:
     """
-    REST API to list all calls.
+    REST API to list all calls, by pages.
 
     Parameters:
+    - continuation: Continuation token of the page, from the previous page
     - phone_number: Filter by phone number
 
-    Returns a list of calls objects `CallGetModel`, for a phone number, in JSON format.
+    Returns a list of call summaries `CallSummaryModel`, latest first, in JSON format. The continuation token of the next page, if any, is in the `X-Continuation-Token` header.
     """
     phone_number = PhoneNumber(phone_number) if phone_number else None
     count = 100
-    calls, _ = await _db.call_search_all(phone_number=phone_number, count=count)
+    calls, _, next_continuation = await _db.call_search_summaries(
+        continuation=continuation,
+        count=count,
+        phone_number=phone_number,
+    )
     if not calls:
         raise HTTPException(
             detail=f"Call {phone_number} not found",
             status_code=HTTPStatus.NOT_FOUND,
         )
 
-    output = [CallGetModel.model_validate(call) for call in calls or []]
-    return TypeAdapter(list[CallGetModel]).dump_python(output)
+    if next_continuation:
+        response.headers["X-Continuation-Token"] = next_continuation
+    return TypeAdapter(list[CallSummaryModel]).dump_python(calls)
+
+
+@api.get("/call/export")
+@start_as_current_span("call_export_get")
+async def call_export_get(
+    request: Request,
+    created_after: datetime | None = None,
+    created_before: datetime | None = None,
+    phone_number: str | None = None,
+) -> StreamingResponse:
+    """
+    REST API to export calls, for analytics.
+
+    Parameters:
+    - created_after: Filter calls created at or after this date, UTC if no timezone
+    - created_before: Filter calls created before this date, UTC if no timezone
+    - phone_number: Filter by phone number
+
+    Returns the calls `CallGetModel`, with their whole conversation, in no particular order, in newline-delimited JSON format (NDJSON). Response is streamed, compressed with gzip if accepted by the client.
+    """
+    phone_number = PhoneNumber(phone_number) if phone_number else None
+    if created_after and not created_after.tzinfo:
+        created_after = created_after.replace(tzinfo=UTC)
+    if created_before and not created_before.tzinfo:
+        created_before = created_before.replace(tzinfo=UTC)
+    compressed = _accepts_gzip(request.headers.get("accept-encoding", ""))
+
+    return StreamingResponse(
+        content=_call_export_ndjson(
+            compressed=compressed,
+            pages=_db.call_export(
+                created_after=created_after,
+                created_before=created_before,
+                phone_number=phone_number,
+            ),
+        ),
+        headers={"Content-Encoding": "gzip"} if compressed else None,
+        media_type="application/x-ndjson",
+    )
 
 
 @api.get("/call/{call_id_or_phone_number}")
@@ -351,13 +423,15 @@ async def call_get(call_id_or_phone_number: str) -> CallGetModel:
     Parameters:
     - call_id_or_phone_number: Call ID or phone number to search for
 
-    Returns a single call object `CallGetModel`, in JSON format.
+    Returns a single call object `CallGetModel`, in JSON format, with the whole conversation, archived messages included.
     """
     # First, try to get by call ID
     with suppress(ValueError):
         call_id = UUID(call_id_or_phone_number)
         call = await _db.call_get(call_id)
         if call:
+            # Load the whole conversation
+            await _db.call_load_messages(call)
             return TypeAdapter(CallGetModel).dump_python(call)
 
     # Second, try to get by phone number
@@ -372,6 +446,9 @@ async def call_get(call_id_or_phone_number: str) -> CallGetModel:
             status_code=HTTPStatus.NOT_FOUND,
         )
 
+    # Load the whole conversation
+    await _db.call_load_messages(call)
+
     return TypeAdapter(CallGetModel).dump_python(call)
 
 
@@ -596,9 +673,17 @@ async def communicationservices_wss_post(
     # Client SDK
     automation_client = await _use_automation_client()
 
+    # TODO: Dynamically set the audio format
+    audio_sample_rate = 16000
+
     # Queues
-    audio_in: asyncio.Queue[bytes] = asyncio.Queue()
-    audio_out: asyncio.Queue[bytes | bool] = asyncio.Queue()
+    audio_in: AudioQueue[bytes] = AudioQueue(
+        maxsize=CONFIG.audio.queue.in_max_size,
+        name="in",
+    )
+    audio_out: asyncio.Queue[bytes | bool] = asyncio.Queue(
+        maxsize=CONFIG.audio.queue.out_max_size,  # Bot voice and stop signal are never dropped, the producer waits
+    )
 
     async def _consume_audio() -> None:
         """
@@ -609,21 +694,15 @@ async def communicationservices_wss_post(
         # Loop until the WebSocket is disconnected
         with suppress(WebSocketDisconnect):
             start: float | None = None
-            async for event in websocket.iter_json():
+            async for message in websocket.iter_text():
                 # TODO: Handle configuration event (audio format, sample rate, etc.)
-                # Skip non-audio events
-                if "kind" not in event or event["kind"] != "AudioData":
-                    continue
-
-                # Filter out silent audio
-                audio_data: dict[str, Any] = event.get("audioData", {})
-                audio_base64: str | None = audio_data.get("data", None)
-                audio_silent: bool | None = audio_data.get("silent", True)
-                if audio_silent or not audio_base64:
+                # Skip non-audio events and silent audio
+                audio_data = decode_audio(message)
+                if not audio_data:
                     continue
 
                 # Queue audio
-                await audio_in.put(b64decode(audio_base64))
+                await audio_in.put(audio_data)
 
                 # Report the frames in latency and reset the timer
                 if start:
@@ -641,6 +720,11 @@ async def communicationservices_wss_post(
         """
         logger.debug("Audio data sender started")
 
+        encoder = AudioEncoder(
+            frame_max_ms=CONFIG.audio.media.out_frame_max_ms,
+            sample_rate=audio_sample_rate,
+        )
+
         # Loop until the WebSocket is disconnected
         with suppress(WebSocketDisconnect):
             start: float | None = None
@@ -651,24 +735,24 @@ async def communicationservices_wss_post(
 
                 # Send audio
                 if isinstance(audio_data, bytes):
-                    await websocket.send_json(
-                        {
-                            "kind": "AudioData",
-                            "audioData": {
-                                "data": b64encode(audio_data).decode("utf-8"),
-                            },
-                        }
-                    )
-
-                # Stop audio
-                elif audio_data is False:
+                    # Coalesce the audio already queued, up to the frame size
+                    chunks = [audio_data]
+                    size = len(audio_data)
+                    while size < encoder.frame_size and not audio_out.empty():
+                        audio_data = audio_out.get_nowait()
+                        audio_out.task_done()
+                        if not isinstance(audio_data, bytes):
+                            break
+                        chunks.append(audio_data)
+                        size += len(audio_data)
+
+                    for message in encoder.encode(b"".join(chunks)):
+                        await websocket.send_text(message)
+
+                # Stop audio, can be queued after the coalesced audio
+                if audio_data is False:
                     logger.debug("Stop audio event received, stopping audio")
-                    await websocket.send_json(
-                        {
-                            "kind": "StopAudio",
-                            "stopAudio": {},
-                        }
-                    )
+                    await websocket.send_text(STOP_AUDIO_MESSAGE)
 
                 # Report the frames out latency and reset the timer
                 if start:
@@ -687,11 +771,10 @@ async def communicationservices_wss_post(
             # Send audio to the WebSocket
             _send_audio(),
             # Process audio
-            # TODO: Dynamically set the audio format
             on_audio_connected(
                 audio_in=audio_in,
                 audio_out=audio_out,
-                audio_sample_rate=16000,
+                audio_sample_rate=audio_sample_rate,
                 call=call,
                 client=automation_client,
                 post_callback=_trigger_post_event,
@@ -918,6 +1001,8 @@ async def post_event(
         if not call:
             logger.warning("Call %s not found", post.content)
             return
+        # Load the whole conversation, for the summaries
+        await _db.call_load_messages(call)
 
         # Enrich span
         SpanAttributeEnum.CALL_ID.attribute(str(call.call_id))
@@ -931,6 +1016,55 @@ async def post_event(
         )
 
 
+def _accepts_gzip(accept_encoding: str) -> bool:
+    """
+    Check if gzip is accepted, from the value of an `Accept-Encoding` header.
+
+    Codings with a quality of 0 are refused. The wildcard accepts gzip, if gzip is not listed.
+
+    See: https://www.rfc-editor.org/rfc/rfc9110#field.accept-encoding
+    """
+    qualities: dict[str, float] = {}
+    for item in accept_encoding.split(","):
+        coding, *params = (part.strip() for part in item.split(";"))
+        if not coding:
+            continue
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0
+        qualities[coding.lower()] = quality
+
+    for coding in ("gzip", "x-gzip", "*"):
+        if coding in qualities:
+            return qualities[coding] > 0
+    return False
+
+
+async def _call_export_ndjson(
+    pages: AsyncGenerator[list[CallGetModel]],
+    compressed: bool,
+) -> AsyncGenerator[bytes]:
+    """
+    Serialize pages of calls in newline-delimited JSON, optionally compressed with gzip.
+
+    Each page is written as a single chunk, compressed data is written as soon as the compressor outputs it.
+    """
+    compressor = zlib.compressobj(wbits=31) if compressed else None  # 31 for gzip
+    async for calls in pages:
+        chunk = b"".join(call.model_dump_json().encode() + b"\n" for call in calls)
+        if compressor:
+            chunk = compressor.compress(chunk)
+        if chunk:
+            yield chunk
+    if compressor:
+        yield compressor.flush()
+
+
 async def _trigger_training_event(call: CallStateModel) -> None:
     """
     Shortcut to add training to the queue.
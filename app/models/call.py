@@ -1,4 +1,3 @@
-import asyncio
 import random
 import string
 from datetime import UTC, datetime, tzinfo
@@ -40,6 +39,7 @@ class CallGetModel(BaseModel):
         str, Any
     ] = {}  # Place after "initiate" as it depends on it for validation
     messages: list[MessageModel] = []
+    messages_archived: int = 0  # Number of older messages, moved out of the call
     next: NextModel | None = None
     reminders: list[ReminderModel] = []
     synthesis: SynthesisModel | None = None
@@ -93,6 +93,56 @@ class CallGetModel(BaseModel):
         return merged
 
 
+class CallSummaryModel(BaseModel):
+    """
+    Summary of a call, to list calls without loading their conversation.
+    """
+
+    call_id: UUID
+    created_at: datetime
+    in_progress: bool = False
+    phone_number: PhoneNumber
+    synthesis_short: str | None = None
+
+    def tz(self) -> tzinfo:
+        """
+        Get the timezone of the phone number.
+        """
+        return PhoneNumber.tz(self.phone_number)
+
+
+class CallSnapshot:
+    """
+    State of a call at a point in time, to compute its changes since.
+
+    Messages are kept by reference, as they are append-only, so the conversation is not serialized. Other fields are small, they are serialized.
+    """
+
+    __slots__ = ("data", "messages")
+
+    data: dict[str, Any]
+    messages: tuple[MessageModel, ...]
+
+    def __init__(self, call: "CallStateModel"):
+        self.data = call.model_dump(
+            exclude={"messages"},
+            exclude_none=True,
+            mode="json",
+        )
+        self.messages = tuple(call.messages)
+
+    def base(self, field: str) -> Any:
+        """
+        Get the value of a field at the snapshot, serialized as JSON.
+        """
+        if field == "messages":
+            return [
+                message.model_dump(exclude_none=True, mode="json")
+                for message in self.messages
+            ]
+        return self.data.get(field)
+
+
 class CallStateModel(CallGetModel, extra="ignore"):
     # Immutable fields
     callback_secret: str = Field(
@@ -131,13 +181,11 @@ class CallStateModel(CallGetModel, extra="ignore"):
 
         with tracer.start_as_current_span("call_trainings"):
             search = CONFIG.ai_search.instance
-            tasks = await asyncio.gather(
-                *[
-                    search.training_search_all(
-                        cache_only=cache_only,
-                        lang=self.lang.short_code,
-                        text=message.content,
-                    )
+            results = await search.training_search_many(
+                cache_only=cache_only,
+                lang=self.lang.short_code,
+                texts=[
+                    message.content
                     for message in self.messages[
                         -CONFIG.ai_search.expansion_n_messages :
                     ]
@@ -146,13 +194,72 @@ class CallStateModel(CallGetModel, extra="ignore"):
             trainings = sorted(
                 set(
                     training
-                    for trainings in tasks
+                    for trainings in results
                     for training in trainings or []
                     if training.score >= CONFIG.ai_search.strictness
                 )
             )  # Flatten, remove duplicates, sort by score, filter by strictness
             return trainings
 
+    def snapshot(self) -> CallSnapshot:
+        """
+        Get the current state, to compute the changes later with `changes`.
+        """
+        return CallSnapshot(self)
+
+    def changes(
+        self, snapshot: CallSnapshot
+    ) -> tuple[dict[str, Any], dict[str, list[Any]]]:
+        """
+        Get the changes since a snapshot, serialized as JSON.
+
+        Lists with only new items at the end are reported as appended, other changes as updated fields. Messages are append-only, a message edited in place is not detected, it must be replaced.
+
+        Returns a tuple with the updated fields and their values, and the items appended to the lists, by field.
+        """
+        appended: dict[str, list[Any]] = {}
+        updated: dict[str, Any] = {}
+
+        # Compare small fields by value
+        for field, value in self.model_dump(
+            exclude={"messages"},
+            exclude_none=True,
+            mode="json",
+        ).items():
+            init_value = snapshot.data.get(field)
+            if init_value == value:
+                continue
+            # Items added at the end of the list
+            if (
+                isinstance(init_value, list)
+                and isinstance(value, list)
+                and value[: len(init_value)] == init_value
+            ):
+                appended[field] = value[len(init_value) :]
+            # Any other change
+            else:
+                updated[field] = value
+
+        # Compare messages by reference, only the new ones are serialized
+        init_messages = snapshot.messages
+        if len(self.messages) >= len(init_messages) and all(
+            message is init_message
+            for message, init_message in zip(self.messages, init_messages)
+        ):
+            if len(self.messages) > len(init_messages):
+                appended["messages"] = [
+                    message.model_dump(exclude_none=True, mode="json")
+                    for message in self.messages[len(init_messages) :]
+                ]
+        # Messages were removed or replaced
+        else:
+            updated["messages"] = [
+                message.model_dump(exclude_none=True, mode="json")
+                for message in self.messages
+            ]
+
+        return updated, appended
+
     def tz(self) -> tzinfo:
         """
         Get the timezone of the phone number.
@@ -183,3 +290,53 @@ class CallStateModel(CallGetModel, extra="ignore"):
             and self.messages[-2].persona == MessagePersonaEnum.ASSISTANT
             and self.messages[-1].action == MessageActionEnum.HANGUP
         )
+
+
+def rebase_changes(
+    remote: dict[str, Any],
+    updated: dict[str, Any],
+    bases: dict[str, Any],
+) -> dict[str, Any]:
+    """
+    Rebase updated fields on the remote document, keeping the changes of the other writers.
+
+    Items added to a remote list since the base are added after ours, and the items removed are removed from ours. Keys of a remote dict not changed by us are kept. Other fields take our value.
+
+    Returns the rebased fields.
+    """
+    rebased: dict[str, Any] = {}
+    for field, value in updated.items():
+        base = bases.get(field)
+        remote_value = remote.get(field)
+
+        # Keep the items added by the others, drop the ones they removed
+        if isinstance(base, list) and isinstance(remote_value, list):
+            rebased[field] = [
+                *[item for item in value if item in remote_value or item not in base],
+                *[
+                    item
+                    for item in remote_value
+                    if item not in base and item not in value
+                ],
+            ]
+
+        # Keep the keys changed by the others, remove ours
+        elif isinstance(base, dict) and isinstance(remote_value, dict):
+            rebased[field] = {
+                **{
+                    key: remote_item
+                    for key, remote_item in remote_value.items()
+                    if key in value or key not in base
+                },
+                **{
+                    key: item
+                    for key, item in value.items()
+                    if key not in base or base[key] != item
+                },
+            }
+
+        # Our value
+        else:
+            rebased[field] = value
+
+    return rebased
@@ -147,6 +147,40 @@ class MessageModel(BaseModel):
 
         return copy
 
+    @staticmethod
+    async def translate_all(
+        messages: list["MessageModel"],
+        target_short_code: str,
+    ) -> list["MessageModel"]:
+        """
+        Translate messages to a target language, with a single cache request.
+
+        Copies of the models are returned with the translated content.
+        """
+        from app.helpers.translation import translate_texts
+
+        # Work on copies to avoid modifying the original models in the database
+        copies = [message.model_copy() for message in messages]
+
+        # Skip if no language is set
+        translatables = [
+            (copy, copy.lang_short_code) for copy in copies if copy.lang_short_code
+        ]
+        if not translatables:
+            return copies
+
+        # Apply translations
+        translations = await translate_texts(
+            target_lang=target_short_code,
+            texts=[(copy.content, lang) for copy, lang in translatables],
+        )
+        for (copy, _), translation in zip(translatables, translations, strict=True):
+            if translation:
+                copy.content = translation
+                copy.lang_short_code = target_short_code
+
+        return copies
+
     @field_validator("created_at")
     @classmethod
     def _validate_created_at(cls, created_at: datetime) -> datetime:
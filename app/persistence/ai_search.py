@@ -1,3 +1,5 @@
+import asyncio
+
 from azure.core.exceptions import (
     HttpResponseError,
     ResourceExistsError,
@@ -43,7 +45,7 @@ from tenacity import (
     wait_random_exponential,
 )
 
-from app.helpers.cache import lru_acache
+from app.helpers.cache import lru_acache, single_flight
 from app.helpers.config_models.ai_search import AiSearchModel
 from app.helpers.http import azure_transport
 from app.helpers.identity import credential
@@ -83,15 +85,7 @@ class AiSearchSearch(ISearch):
             logger.exception("Unknown error while checking AI Search readiness")
         return ReadinessEnum.FAIL
 
-    @retry(
-        reraise=True,
-        retry=retry_any(
-            retry_if_exception_type(ServiceResponseError),
-            retry_if_exception_type(TooManyRequests),
-        ),
-        stop=stop_after_attempt(3),
-        wait=wait_random_exponential(multiplier=0.8, max=8),
-    )
+    @single_flight()
     async def training_search_all(
         self,
         lang: str,
@@ -103,8 +97,7 @@ class AiSearchSearch(ISearch):
             return None
 
         # Try cache
-        cache_key = f"{self.__class__.__name__}-training_asearch_all-v2-{text}"  # Cache sort method has been updated in v6, thus the v2
-        cached = await self._cache.get(cache_key)
+        cached = await self._cache.get(self._cache_key_training(text))
         if cached:
             try:
                 return TypeAdapter(list[TrainingModel]).validate_json(cached)
@@ -114,6 +107,63 @@ class AiSearchSearch(ISearch):
         if cache_only:
             return None
 
+        # Try live
+        return await self._training_search_live(lang=lang, text=text)
+
+    async def training_search_many(
+        self,
+        lang: str,
+        texts: list[str],
+        cache_only: bool = False,
+    ) -> list[list[TrainingModel] | None]:
+        res: list[list[TrainingModel] | None] = [None] * len(texts)
+        indexes = [i for i, text in enumerate(texts) if text]
+
+        # Try cache, in a single request
+        cached_values = await self._cache.get_many(
+            [self._cache_key_training(texts[i]) for i in indexes]
+        )
+        for i, cached in zip(indexes, cached_values, strict=True):
+            if not cached:
+                continue
+            try:
+                res[i] = TypeAdapter(list[TrainingModel]).validate_json(cached)
+            except ValidationError as e:
+                logger.debug("Parsing error: %s", e.errors())
+
+        if cache_only:
+            return res
+
+        # Try live, concurrently
+        missing = [i for i in indexes if res[i] is None]
+        lives = await asyncio.gather(
+            *[self._training_search_live(lang=lang, text=texts[i]) for i in missing]
+        )
+        for i, trainings in zip(missing, lives, strict=True):
+            res[i] = trainings
+
+        return res
+
+    @single_flight()
+    @retry(
+        reraise=True,
+        retry=retry_any(
+            retry_if_exception_type(ServiceResponseError),
+            retry_if_exception_type(TooManyRequests),
+        ),
+        stop=stop_after_attempt(3),
+        wait=wait_random_exponential(multiplier=0.8, max=8),
+    )
+    async def _training_search_live(
+        self,
+        lang: str,
+        text: str,
+    ) -> list[TrainingModel] | None:
+        """
+        Search training data in AI Search, then update the cache.
+
+        Concurrent searches of the same text are coalesced, from `training_search_all` and `training_search_many`.
+        """
         # Try live
         trainings: list[TrainingModel] = []
         try:
@@ -174,13 +224,16 @@ class AiSearchSearch(ISearch):
         # Update cache
         if trainings:
             await self._cache.set(
-                key=cache_key,
+                key=self._cache_key_training(text),
                 ttl_sec=60 * 60 * 24,  # 1 day
                 value=TypeAdapter(list[TrainingModel]).dump_json(trainings),
             )
 
         return trainings or None
 
+    def _cache_key_training(self, text: str) -> str:
+        return f"{self.__class__.__name__}-training_asearch_all-v2-{text}"  # Cache sort method has been updated in v6, thus the v2
+
     @lru_acache()
     async def _use_client(self) -> SearchClient:
         """
@@ -1,14 +1,25 @@
 import asyncio
+import time
+import zlib
+from base64 import b64decode, b64encode
 from collections.abc import AsyncGenerator
 from contextlib import asynccontextmanager
+from datetime import datetime
 from typing import Any
 from uuid import UUID, uuid4
+from weakref import WeakValueDictionary
 
+import orjson
 from aiojobs import Scheduler
+from azure.core import MatchConditions
 from azure.cosmos import ConsistencyLevel
 from azure.cosmos.aio import ContainerProxy, CosmosClient
-from azure.cosmos.exceptions import CosmosHttpResponseError, CosmosResourceNotFoundError
-from pydantic import ValidationError
+from azure.cosmos.exceptions import (
+    CosmosAccessConditionFailedError,
+    CosmosHttpResponseError,
+    CosmosResourceNotFoundError,
+)
+from pydantic import TypeAdapter, ValidationError
 
 from app.helpers.cache import lru_acache
 from app.helpers.config_models.database import CosmosDbModel
@@ -17,19 +28,51 @@ from app.helpers.http import azure_transport
 from app.helpers.identity import credential
 from app.helpers.logging import logger
 from app.helpers.monitoring import suppress
-from app.models.call import CallStateModel
+from app.models.call import (
+    CallGetModel,
+    CallSnapshot,
+    CallStateModel,
+    CallSummaryModel,
+    rebase_changes,
+)
+from app.models.message import MessageModel
 from app.models.readiness import ReadinessEnum
 from app.persistence.icache import ICache
 from app.persistence.istore import IStore
+from app.persistence.memory import MemoryCache
+
+_PATCH_MAX_OPERATIONS = 10  # See: https://learn.microsoft.com/en-us/azure/cosmos-db/partial-document-update#supported-modes
+_PATCH_MAX_RETRIES = 5  # Concurrent writes of the same call, before giving up
+# Calls older than that are read with a query on all partitions
+_PARTITION_INDEX_TTL_SEC = 7 * 24 * 60 * 60  # 7 days
+_SEARCH_CACHE_TTL_SEC = 60 * 60  # 1 hour, results are invalidated on change anyway
+# Memory cache is not shared, changes from the other workers do not invalidate it
+_SEARCH_CACHE_LOCAL_TTL_SEC = 5
+# Fields filtered or listed by the searches, their change invalidates the results
+_SEARCH_FIELDS = {"claim", "in_progress", "synthesis"}
+_DATETIME_ADAPTER = TypeAdapter(datetime)
+_EXPORT_PAGE_SIZE = 100
+_MESSAGES_ADAPTER = TypeAdapter(list[MessageModel])
+_SEARCH_PAGE_ADAPTER = TypeAdapter(tuple[list[CallSummaryModel], str | None])
 
 
 class CosmosDbStore(IStore):
     _config: CosmosDbModel
+    _flush_locks: WeakValueDictionary[UUID, asyncio.Lock]
+    _pending: dict[UUID, "_PendingChanges"]
+    _search_ttl_sec: int
 
     def __init__(self, cache: ICache, config: CosmosDbModel):
         super().__init__(cache)
         logger.info("Using Cosmos DB %s/%s", config.database, config.container)
         self._config = config
+        self._flush_locks = WeakValueDictionary()
+        self._pending = {}
+        self._search_ttl_sec = (
+            _SEARCH_CACHE_LOCAL_TTL_SEC
+            if isinstance(cache, MemoryCache)
+            else _SEARCH_CACHE_TTL_SEC
+        )
 
     async def readiness(self) -> ReadinessEnum:
         """
@@ -97,16 +140,24 @@ class CosmosDbStore(IStore):
             except ValidationError as e:
                 logger.debug("Parsing error: %s", e.errors())
 
-        # Try live
+        # Try live, with a point read if the partition is known
         call = None
+        partition = await self._cache.get(self._cache_key_call_id_partition(call_id))
         try:
-            with suppress(StopAsyncIteration):
+            with suppress(CosmosResourceNotFoundError, StopAsyncIteration):
                 async with self._use_client() as db:
-                    items = db.query_items(
-                        query="SELECT * FROM c WHERE STRINGEQUALS(c.id, @id)",
-                        parameters=[{"name": "@id", "value": str(call_id)}],
-                    )
-                    raw = await anext(items)
+                    if partition:
+                        raw = await db.read_item(
+                            item=str(call_id),
+                            partition_key=partition.decode(),
+                        )
+                    # Unknown partition, query all of them
+                    else:
+                        items = db.query_items(
+                            query="SELECT * FROM c WHERE STRINGEQUALS(c.id, @id)",
+                            parameters=[{"name": "@id", "value": str(call_id)}],
+                        )
+                        raw = await anext(items)
                     try:
                         call = CallStateModel.model_validate(raw)
                     except ValidationError as e:
@@ -118,11 +169,13 @@ class CosmosDbStore(IStore):
         if call:
             await self._cache.set(
                 key=cache_key,
-                ttl_sec=max(await callback_timeout_hour(), 1)
+                ttl_sec=max(callback_timeout_hour(), 1)
                 * 60
                 * 60,  # Ensure at least 1 hour
                 value=call.model_dump_json(),
             )
+            if not partition:
+                await self._cache_partition(call)
 
         return call
 
@@ -132,73 +185,304 @@ class CosmosDbStore(IStore):
         call: CallStateModel,
         scheduler: Scheduler,
     ) -> AsyncGenerator[None]:
-        # Copy and yield the updated object
-        init_data = call.model_dump(mode="json", exclude_none=True)
+        # Snapshot and yield the updated object
+        snapshot = call.snapshot()
         yield
 
-        async def _exec() -> None:
-            # Compute the diff
-            init_call = call.model_dump(mode="json", exclude_none=True)
-            init_update: dict[str, Any] = {}
-            for field, new_value in init_call.items():
-                init_value = init_data.get(field)
-                if init_value != new_value:
-                    init_update[field] = new_value
-
-            # Skip if no diff
-            if not init_update:
-                logger.debug("No update needed for call %s", call.call_id)
+        # Compute the diff, before another transaction edits the call
+        updated, appended = call.changes(snapshot)
+
+        # Skip if no diff
+        if not updated and not appended:
+            logger.debug("No update needed for call %s", call.call_id)
+            return
+
+        # Another object of the same call, write its changes first, conflicts are rebased on write
+        while (pending := self._pending.get(call.call_id)) and pending.call is not call:
+            await self.call_flush(pending.call)
+
+        # Merge with the pending changes, already scheduled
+        if pending:
+            pending.merge(
+                appended=appended,
+                snapshot=snapshot,
+                updated=updated,
+            )
+            return
+
+        # Defer the update
+        self._pending[call.call_id] = _PendingChanges(
+            appended=appended,
+            call=call,
+            snapshot=snapshot,
+            updated=updated,
+        )
+        await scheduler.spawn(self._flush_later(call))
+
+    async def call_flush(
+        self,
+        call: CallStateModel,
+    ) -> None:
+        # Write one request at a time per call, to keep the order
+        lock = self._flush_locks.get(call.call_id)
+        if not lock:
+            lock = asyncio.Lock()
+            self._flush_locks[call.call_id] = lock
+
+        async with lock:
+            # Skip if already written
+            pending = self._pending.pop(call.call_id, None)
+            if not pending:
                 return
 
-            remote_raw = None
-            try:
-                async with self._use_client() as db:
+            await self._patch(pending)
+
+    async def _flush_later(self, call: CallStateModel) -> None:
+        """
+        Write the pending changes of a call, after the write-behind window.
+        """
+        await asyncio.sleep(self._config.write_behind_ms / 1000)
+        await self.call_flush(call)
+
+    async def _patch(self, pending: "_PendingChanges") -> None:
+        """
+        Write changes of a call, then refresh it with the remote object.
+
+        Lists and dicts replaced as a whole are rebased on the remote document, and written only if it was not modified since, with an ETag condition. If it was, the changes are rebased again and retried, so concurrent writers do not lose their changes.
+        """
+        appended = pending.appended
+        bases = pending.bases
+        call = pending.call
+        updated = pending.updated
+
+        # Too many operations, replace the arrays instead of appending each item
+        if len(updated) + sum(len(items) for items in appended.values()) > (
+            _PATCH_MAX_OPERATIONS
+        ):
+            newer = self._pending.get(call.call_id)
+            for field, value in call.model_dump(
+                exclude_none=True,
+                include=set(appended),
+                mode="json",
+            ).items():
+                # Exclude the items appended since, written by the next patch
+                size = (
+                    len(value) - len(newer.appended.get(field, []))
+                    if newer
+                    else len(value)
+                )
+                bases[field] = value[: size - len(appended[field])]
+                updated[field] = value[:size]
+            appended = {}
+
+        remote_raw = None
+        rebase = any(field in bases for field in updated)
+        try:
+            async with self._use_client() as db:
+                for _ in range(_PATCH_MAX_RETRIES):
+                    # Rebase on the latest remote document
+                    etag = None
+                    operations_updated = updated
+                    if rebase:
+                        remote = await db.read_item(
+                            item=str(call.call_id),
+                            partition_key=call.initiate.phone_number,
+                        )
+                        etag = remote["_etag"]
+                        operations_updated = rebase_changes(
+                            bases=bases,
+                            remote=remote,
+                            updated=updated,
+                        )
+
                     # See: https://learn.microsoft.com/en-us/azure/cosmos-db/partial-document-update#supported-operations
-                    remote_raw = await db.patch_item(
-                        item=str(call.call_id),
-                        partition_key=call.initiate.phone_number,
-                        patch_operations=[
-                            {
-                                "op": "set",
-                                "path": f"/{field}",
-                                "value": value,
-                            }
-                            for field, value in init_update.items()
-                        ],
+                    operations: list[dict[str, Any]] = [
+                        {
+                            "op": "set",
+                            "path": f"/{field}",
+                            "value": value,
+                        }
+                        for field, value in operations_updated.items()
+                    ]
+                    operations += [
+                        {
+                            "op": "add",
+                            "path": f"/{field}/-",  # Append to the array
+                            "value": item,
+                        }
+                        for field, items in appended.items()
+                        for item in items
+                    ]
+
+                    try:
+                        remote_raw = await db.patch_item(
+                            etag=etag,
+                            item=str(call.call_id),
+                            match_condition=(
+                                MatchConditions.IfNotModified if etag else None
+                            ),
+                            partition_key=call.initiate.phone_number,
+                            patch_operations=operations,
+                        )
+                        break
+
+                    # Modified since the rebase, retry
+                    except CosmosAccessConditionFailedError:
+                        logger.debug(
+                            "Call %s modified concurrently, retrying", call.call_id
+                        )
+
+                # Too many concurrent writes
+                else:
+                    logger.error(
+                        "Call %s modified concurrently %i times, changes are lost",
+                        call.call_id,
+                        _PATCH_MAX_RETRIES,
                     )
-            except CosmosHttpResponseError as e:
-                logger.error("Error accessing CosmosDB: %s", e)
-                return
+                    return
+        except CosmosHttpResponseError as e:
+            logger.error("Error accessing CosmosDB: %s", e)
+            return
 
-            # Parse remote object
-            try:
-                remote_call = CallStateModel.model_validate(remote_raw)
-            except ValidationError:
-                logger.debug("Parsing error", exc_info=True)
-                return
+        # Invalidate searches, if a searched or listed field was written
+        if not _SEARCH_FIELDS.isdisjoint(updated):
+            await self._search_invalidate()
 
-            # Refresh call with remote object
-            for field in call.model_fields_set:
-                new_value = getattr(remote_call, field)
-                # Skip set to avoid Pydantic costly validation
-                if getattr(call, field) == new_value:
-                    continue
-                # Try to set the new value
-                with suppress(ValidationError):
-                    setattr(call, field, new_value)
-
-            # Update cache
-            cache_key_id = self._cache_key_call_id(call.call_id)
-            await self._cache.set(
-                key=cache_key_id,
-                ttl_sec=max(await callback_timeout_hour(), 1)
-                * 60
-                * 60,  # Ensure at least 1 hour
-                value=call.model_dump_json(),
+        # Move the older messages to the archive, if the window is exceeded
+        remote_raw = await self._archive(call, remote_raw)
+
+        # Skip the refresh if newer changes are pending, the next write refreshes the call
+        if call.call_id in self._pending:
+            return
+
+        # Parse remote object
+        try:
+            remote_call = CallStateModel.model_validate(remote_raw)
+        except ValidationError:
+            logger.debug("Parsing error", exc_info=True)
+            return
+
+        # Refresh call with remote object
+        for field in call.model_fields_set:
+            new_value = getattr(remote_call, field)
+            # Skip set to avoid Pydantic costly validation
+            if getattr(call, field) == new_value:
+                continue
+            # Try to set the new value
+            with suppress(ValidationError):
+                setattr(call, field, new_value)
+
+        # Update cache
+        cache_key_id = self._cache_key_call_id(call.call_id)
+        await self._cache.set(
+            key=cache_key_id,
+            ttl_sec=max(callback_timeout_hour(), 1) * 60 * 60,  # Ensure at least 1 hour
+            value=call.model_dump_json(),
+        )
+
+    async def _archive(
+        self,
+        call: CallStateModel,
+        remote: dict[str, Any] | None,
+    ) -> dict[str, Any] | None:
+        """
+        Move the older messages of a call to an archive document, if the window is exceeded, keeping the last messages.
+
+        The archive is written first, then the call, only if it was not modified since. If it was, the next write archives again, overwriting the archive as it is identified by its first message.
+
+        Returns the remote object, updated if archived.
+        """
+        window = self._config.messages_window
+        if not window or not remote or len(remote["messages"]) < 2 * window:
+            return remote
+
+        archived: int = remote.get("messages_archived", 0)
+        messages: list[Any] = remote["messages"]
+        count = len(messages) - window
+        partition = remote["initiate"]["phone_number"]
+        try:
+            async with self._use_client() as db:
+                await db.upsert_item(
+                    body={
+                        "archive": {
+                            "call_id": remote["id"],
+                            "data": b64encode(
+                                zlib.compress(orjson.dumps(messages[:count]))
+                            ).decode(),
+                            "start": archived,
+                        },
+                        "id": f"{remote['id']}-archive-{archived}",
+                        "initiate": {
+                            "phone_number": partition,
+                        },
+                    }
+                )
+                remote = await db.patch_item(
+                    etag=remote["_etag"],
+                    item=remote["id"],
+                    match_condition=MatchConditions.IfNotModified,
+                    partition_key=partition,
+                    patch_operations=[
+                        {
+                            "op": "set",
+                            "path": "/messages",
+                            "value": messages[count:],
+                        },
+                        {
+                            "op": "set",
+                            "path": "/messages_archived",
+                            "value": archived + count,
+                        },
+                    ],
+                )
+        except CosmosAccessConditionFailedError:
+            logger.debug(
+                "Call %s modified concurrently, archiving on next write", call.call_id
             )
+            return remote
+        except CosmosHttpResponseError as e:
+            logger.error("Error accessing CosmosDB: %s", e)
+            return remote
 
-        # Defer the update
-        await scheduler.spawn(_exec())
+        # Trim the call, keeping the messages appended since
+        newer = self._pending.get(call.call_id)
+        keep = window + (len(newer.appended.get("messages", [])) if newer else 0)
+        call.messages = call.messages[-keep:]
+        call.messages_archived = archived + count
+
+        return remote
+
+    async def call_load_messages(
+        self,
+        call: CallStateModel,
+    ) -> None:
+        # Skip if nothing is archived
+        if not call.messages_archived:
+            return
+
+        # Read the archives, from the partition of the call
+        try:
+            async with self._use_client() as db:
+                items = db.query_items(
+                    partition_key=call.initiate.phone_number,
+                    query="SELECT VALUE c.archive FROM c WHERE c.archive.call_id = @call_id",
+                    parameters=[
+                        {
+                            "name": "@call_id",
+                            "value": str(call.call_id),
+                        }
+                    ],
+                )
+                archives = [archive async for archive in items]
+        except CosmosHttpResponseError as e:
+            logger.error("Error accessing CosmosDB: %s", e)
+            return
+
+        # Prepend the archived messages
+        _chain_archives(
+            archives=archives,
+            call=call,
+        )
 
     # TODO: Catch errors
     async def call_create(
@@ -212,9 +496,11 @@ class CosmosDbStore(IStore):
         data["id"] = str(call.call_id)
 
         # Persist
+        created = False
         try:
             async with self._use_client() as db:
                 await db.create_item(body=data)
+            created = True
         except CosmosHttpResponseError:
             logger.exception("Error accessing CosmosDB")
         except ValidationError:
@@ -224,12 +510,18 @@ class CosmosDbStore(IStore):
         cache_key = self._cache_key_call_id(call.call_id)
         await self._cache.set(
             key=cache_key,
-            ttl_sec=max(await callback_timeout_hour(), 1)
-            * 60
-            * 60,  # Ensure at least 1 hour
+            ttl_sec=max(callback_timeout_hour(), 1) * 60 * 60,  # Ensure at least 1 hour
             value=call.model_dump_json(),
         )
 
+        # Index the partition, for point reads
+        await self._cache_partition(call)
+
+        # Invalidate searches, and count the call in the total
+        await self._search_invalidate()
+        if created:
+            await self._search_total_increment()
+
         # Invalidate phone number cache
         cache_key_phone_number = self._cache_key_phone_number(
             call.initiate.phone_number
@@ -238,6 +530,18 @@ class CosmosDbStore(IStore):
 
         return call
 
+    async def _cache_partition(self, call: CallStateModel) -> None:
+        """
+        Index the partition key of a call, by its ID.
+
+        The partition key is the phone number, which never changes, so the index is kept longer than the call.
+        """
+        await self._cache.set(
+            key=self._cache_key_call_id_partition(call.call_id),
+            ttl_sec=_PARTITION_INDEX_TTL_SEC,
+            value=call.initiate.phone_number,
+        )
+
     async def call_search_one(
         self,
         phone_number: str,
@@ -245,7 +549,7 @@ class CosmosDbStore(IStore):
     ) -> CallStateModel | None:
         logger.debug("Loading last call for %s", phone_number)
 
-        timeout = await callback_timeout_hour()
+        timeout = callback_timeout_hour()
         if timeout < 1 and callback_timeout:
             logger.debug("Callback timeout if off, skipping search")
             return None
@@ -260,9 +564,12 @@ class CosmosDbStore(IStore):
                 logger.debug("Parsing error", exc_info=True)
 
         # Filter by timeout if needed
-        extra_where = ""
+        where_clause = _where(phone_number)
         if callback_timeout:
-            extra_where = f"AND c.created_at >= DATETIMEADD('hh', -{timeout}, GETCURRENTDATETIME())"
+            where_clause = _where(
+                phone_number,
+                f"c.created_at >= DATETIMEADD('hh', -{timeout}, GETCURRENTDATETIME())",
+            )
 
         # Try live
         call = None
@@ -271,7 +578,7 @@ class CosmosDbStore(IStore):
                 async with self._use_client() as db:
                     items = db.query_items(
                         max_item_count=1,
-                        query=f"SELECT * FROM c WHERE (STRINGEQUALS(c.initiate.phone_number, @phone_number, true) OR STRINGEQUALS(c.claim.policyholder_phone, @phone_number, true)) {extra_where} ORDER BY c.created_at DESC",
+                        query=f"SELECT * FROM c {where_clause} ORDER BY c.created_at DESC",
                         parameters=[
                             {
                                 "name": "@phone_number",
@@ -294,6 +601,7 @@ class CosmosDbStore(IStore):
                 ttl_sec=timeout * 60 * 60,  # Ensure at least 1 hour
                 value=call.model_dump_json(),
             )
+            await self._cache_partition(call)
 
         return call
 
@@ -303,10 +611,11 @@ class CosmosDbStore(IStore):
         phone_number: str | None = None,
     ) -> tuple[list[CallStateModel] | None, int]:
         logger.debug("Searching calls, for %s and count %s", phone_number, count)
-        # TODO: Cache results
+        generation = await self._search_generation()
+        # Calls are not cached, their conversation changes with each message
         calls, total = await asyncio.gather(
             self._call_asearch_all_calls_worker(count, phone_number),
-            self._call_asearch_all_total_worker(phone_number),
+            self._call_asearch_all_total_worker(generation, phone_number),
         )
         return calls, total
 
@@ -318,11 +627,7 @@ class CosmosDbStore(IStore):
         calls: list[CallStateModel] = []
         try:
             async with self._use_client() as db:
-                where_clause = (
-                    "WHERE STRINGEQUALS(c.initiate.phone_number, @phone_number, true) OR STRINGEQUALS(c.claim.policyholder_phone, @phone_number, true)"
-                    if phone_number
-                    else ""
-                )
+                where_clause = _where(phone_number)
                 items = db.query_items(
                     query=f"SELECT * FROM c {where_clause} ORDER BY c.created_at DESC OFFSET 0 LIMIT @count",
                     parameters=[
@@ -347,18 +652,99 @@ class CosmosDbStore(IStore):
             logger.exception("Error accessing CosmosDB")
         return calls
 
+    async def call_search_summaries(
+        self,
+        count: int,
+        continuation: str | None = None,
+        phone_number: str | None = None,
+    ) -> tuple[list[CallSummaryModel] | None, int, str | None]:
+        logger.debug(
+            "Searching call summaries, for %s and count %s", phone_number, count
+        )
+        generation = await self._search_generation()
+        (calls, next_continuation), total = await asyncio.gather(
+            self._call_search_summaries_worker(
+                count, generation, continuation, phone_number
+            ),
+            self._call_asearch_all_total_worker(generation, phone_number),
+        )
+        return calls, total, next_continuation
+
+    async def _call_search_summaries_worker(
+        self,
+        count: int,
+        generation: str,
+        continuation: str | None = None,
+        phone_number: str | None = None,
+    ) -> tuple[list[CallSummaryModel] | None, str | None]:
+        # Try cache
+        cache_key = self._cache_key_search(
+            f"summaries-{count}-{phone_number}-{continuation}", generation
+        )
+        cached = await self._cache.get(cache_key)
+        if cached:
+            try:
+                return _SEARCH_PAGE_ADAPTER.validate_json(cached)
+            except ValidationError:
+                logger.debug("Parsing error", exc_info=True)
+
+        # Try live
+        calls: list[CallSummaryModel] = []
+        next_continuation = None
+        try:
+            async with self._use_client() as db:
+                where_clause = _where(phone_number)
+                # Project the listed fields only, conversations can be long
+                pages = db.query_items(
+                    max_item_count=count,
+                    query=f"SELECT c.id AS call_id, c.created_at, c.in_progress, c.initiate.phone_number, c.synthesis.short AS synthesis_short FROM c {where_clause} ORDER BY c.created_at DESC",
+                    parameters=[
+                        {
+                            "name": "@phone_number",
+                            "value": phone_number,
+                        },
+                    ],
+                ).by_page(continuation)
+                with suppress(StopAsyncIteration):
+                    async for raw in await anext(pages):
+                        try:
+                            calls.append(CallSummaryModel.model_validate(raw))
+                        except ValidationError:
+                            logger.debug("Parsing error", exc_info=True)
+                next_continuation = pages.continuation_token  # pyright: ignore
+        except CosmosHttpResponseError:
+            logger.exception("Error accessing CosmosDB")
+            return calls, next_continuation
+
+        # Update cache
+        await self._cache.set(
+            key=cache_key,
+            ttl_sec=self._search_ttl_sec,
+            value=_SEARCH_PAGE_ADAPTER.dump_json((calls, next_continuation)),
+        )
+
+        return calls, next_continuation
+
     async def _call_asearch_all_total_worker(
         self,
+        generation: str,
         phone_number: str | None = None,
     ) -> int:
+        # Try cache, the total of all the calls is maintained on create, the others are cached by generation
+        cache_key = (
+            self._cache_key_search(f"total-{phone_number}", generation)
+            if phone_number
+            else self._cache_key_search_total()
+        )
+        cached = await self._cache.get(cache_key)
+        if cached:
+            return int(cached.decode().split(":")[0])
+
+        # Try live
         total = 0
         try:
             async with self._use_client() as db:
-                where_clause = (
-                    "WHERE STRINGEQUALS(c.initiate.phone_number, @phone_number, true) OR STRINGEQUALS(c.claim.policyholder_phone, @phone_number, true)"
-                    if phone_number
-                    else ""
-                )
+                where_clause = _where(phone_number)
                 items = db.query_items(
                     query=f"SELECT VALUE COUNT(1) FROM c {where_clause}",
                     parameters=[
@@ -371,9 +757,156 @@ class CosmosDbStore(IStore):
                 total: int = await anext(items)  # pyright: ignore
         except CosmosHttpResponseError:
             logger.exception("Error accessing CosmosDB")
+            return total
+
+        # Update cache, with the count time to recount on schedule
+        await self._cache.set(
+            key=cache_key,
+            ttl_sec=self._search_ttl_sec,
+            value=f"{total}:{time.time()}",
+        )
 
         return total
 
+    async def call_export(
+        self,
+        created_after: datetime | None = None,
+        created_before: datetime | None = None,
+        phone_number: str | None = None,
+    ) -> AsyncGenerator[list[CallGetModel]]:
+        logger.debug(
+            "Exporting calls, for %s from %s to %s",
+            phone_number,
+            created_after,
+            created_before,
+        )
+
+        # Filters, dates are stored in ISO 8601 and UTC, so they are compared as strings
+        where_clauses: list[str] = []
+        parameters: list[dict[str, Any]] = []
+        if phone_number:
+            parameters.append({"name": "@phone_number", "value": phone_number})
+        if created_after:
+            where_clauses.append("c.created_at >= @created_after")
+            parameters.append(
+                {
+                    "name": "@created_after",
+                    "value": _DATETIME_ADAPTER.dump_python(created_after, mode="json"),
+                }
+            )
+        if created_before:
+            where_clauses.append("c.created_at < @created_before")
+            parameters.append(
+                {
+                    "name": "@created_before",
+                    "value": _DATETIME_ADAPTER.dump_python(created_before, mode="json"),
+                }
+            )
+        where_clause = _where(phone_number, *where_clauses)
+
+        # Read page by page, not ordered as sorting all partitions is costly
+        try:
+            async with self._use_client() as db:
+                pages = db.query_items(
+                    max_item_count=_EXPORT_PAGE_SIZE,
+                    query=f"SELECT * FROM c {where_clause}",
+                    parameters=parameters,
+                ).by_page()
+                async for page in pages:
+                    calls: list[CallGetModel] = []
+                    async for raw in page:
+                        try:
+                            calls.append(CallGetModel.model_validate(raw))
+                        except ValidationError:
+                            logger.debug("Parsing error", exc_info=True)
+
+                    # Load the archived messages of the page, in a single query
+                    archived = {
+                        str(call.call_id): call
+                        for call in calls
+                        if call.messages_archived
+                    }
+                    if archived:
+                        archives: dict[str, list[dict[str, Any]]] = {}
+                        async for archive in db.query_items(
+                            query="SELECT VALUE c.archive FROM c WHERE ARRAY_CONTAINS(@call_ids, c.archive.call_id)",
+                            parameters=[
+                                {
+                                    "name": "@call_ids",
+                                    "value": list(archived),
+                                }
+                            ],
+                        ):
+                            archives.setdefault(archive["call_id"], []).append(archive)
+                        for call_id, call in archived.items():
+                            _chain_archives(
+                                archives=archives.get(call_id, []),
+                                call=call,
+                            )
+
+                    yield calls
+        # Raise, so the streamed response is aborted instead of truncated
+        except CosmosHttpResponseError:
+            logger.exception("Error accessing CosmosDB, export is aborted")
+            raise
+
+    async def _search_generation(self) -> str:
+        """
+        Get the generation of the cached search results.
+
+        Results are cached by generation, a new generation invalidates all of them at once, across the replicas sharing the cache. With a memory cache, results are kept a few seconds only, as the changes made by the other workers are not seen.
+        """
+        generation = await self._cache.get(self._cache_key_search_generation())
+        if generation:
+            return generation.decode()
+        return await self._search_invalidate()
+
+    async def _search_invalidate(self) -> str:
+        """
+        Invalidate the cached search results, when a call is created or a searched field is edited.
+
+        Returns the new generation.
+        """
+        generation = str(uuid4())
+        await self._cache.set(
+            key=self._cache_key_search_generation(),
+            ttl_sec=self._search_ttl_sec,
+            value=generation,
+        )
+        return generation
+
+    async def _search_total_increment(self) -> None:
+        """
+        Count a created call in the cached total of all the calls, if any.
+
+        The total is approximate, concurrent creations from several replicas may be missed. It is recounted when it expires, at a fixed time after the count, whatever the increments.
+        """
+        cache_key = self._cache_key_search_total()
+        cached = await self._cache.get(cache_key)
+        if not cached:
+            return
+        total, counted_at = cached.decode().split(":")
+        ttl_sec = int(float(counted_at) + self._search_ttl_sec - time.time())
+        if ttl_sec <= 0:
+            return
+        await self._cache.set(
+            key=cache_key,
+            ttl_sec=ttl_sec,
+            value=f"{int(total) + 1}:{counted_at}",
+        )
+
+    def _cache_key_search(self, search: str, generation: str) -> str:
+        return f"{self.__class__.__name__}-search-{generation}-{search}"
+
+    def _cache_key_search_total(self) -> str:
+        return f"{self.__class__.__name__}-search_total"
+
+    def _cache_key_search_generation(self) -> str:
+        return f"{self.__class__.__name__}-search_generation"
+
+    def _cache_key_call_id_partition(self, call_id: UUID) -> str:
+        return f"{self.__class__.__name__}-call_id_partition-{call_id}"
+
     @lru_acache()
     async def _use_service_client(self) -> CosmosClient:
         """
@@ -405,3 +938,109 @@ class CosmosDbStore(IStore):
         async with await self._use_service_client() as client:
             database = client.get_database_client(self._config.database)
             yield database.get_container_client(self._config.container)
+
+
+class _PendingChanges:
+    """
+    Changes of a call object, not yet written.
+
+    Bases are the values of the lists and dicts replaced as a whole, as they were before the changes, to rebase them on the remote document.
+    """
+
+    __slots__ = ("appended", "bases", "call", "updated")
+
+    appended: dict[str, list[Any]]
+    bases: dict[str, Any]
+    call: CallStateModel
+    updated: dict[str, Any]
+
+    def __init__(
+        self,
+        call: CallStateModel,
+        snapshot: CallSnapshot,
+        updated: dict[str, Any],
+        appended: dict[str, list[Any]],
+    ):
+        self.appended = appended
+        self.bases = {}
+        self.call = call
+        self.updated = {}
+        self._update(snapshot, updated)
+
+    def merge(
+        self,
+        snapshot: CallSnapshot,
+        updated: dict[str, Any],
+        appended: dict[str, list[Any]],
+    ) -> None:
+        """
+        Merge newer changes of the same object, as if they were applied in order.
+        """
+        # Updates replace the previous values, and the items appended before
+        self._update(snapshot, updated)
+
+        # Items appended after an update are added to the updated value
+        for field, items in appended.items():
+            if field in self.updated:
+                self.updated[field] = [*self.updated[field], *items]
+            else:
+                self.appended.setdefault(field, []).extend(items)
+
+    def _update(self, snapshot: CallSnapshot, updated: dict[str, Any]) -> None:
+        """
+        Apply updated fields, keeping the oldest base of each field.
+        """
+        for field, value in updated.items():
+            pending_items = self.appended.pop(field, [])
+            if field not in self.bases and isinstance(value, dict | list):
+                base = snapshot.base(field)
+                # Items appended by the pending changes are not in the remote document yet
+                if isinstance(base, list) and pending_items:
+                    base = [item for item in base if item not in pending_items]
+                self.bases[field] = base
+            self.updated[field] = value
+
+
+def _where(phone_number: str | None, *clauses: str) -> str:
+    """
+    Build the WHERE statement of a calls query, filtered by phone number if any.
+
+    Message archives are stored in the same container, they are always excluded.
+    """
+    where_clauses = ["NOT IS_DEFINED(c.archive)", *clauses]
+    if phone_number:
+        where_clauses.append(
+            "(STRINGEQUALS(c.initiate.phone_number, @phone_number, true) OR STRINGEQUALS(c.claim.policyholder_phone, @phone_number, true))"
+        )
+    return f"WHERE {' AND '.join(where_clauses)}"
+
+
+def _chain_archives(call: CallGetModel, archives: list[dict[str, Any]]) -> None:
+    """
+    Prepend the archived messages to the recent messages of a call.
+
+    An archive written concurrently can overlap the next one, the later archive wins.
+    """
+    messages: list[MessageModel] = []
+    for archive in sorted(archives, key=lambda archive: archive["start"]):
+        if archive["start"] > len(messages):
+            break
+        try:
+            messages = [
+                *messages[: archive["start"]],
+                *_MESSAGES_ADAPTER.validate_json(
+                    zlib.decompress(b64decode(archive["data"]))
+                ),
+            ]
+        except ValidationError:
+            logger.debug("Parsing error", exc_info=True)
+            break
+    if len(messages) < call.messages_archived:
+        logger.warning(
+            "Call %s has %i archived messages, %i found",
+            call.call_id,
+            call.messages_archived,
+            len(messages),
+        )
+
+    call.messages = [*messages[: call.messages_archived], *call.messages]
@@ -1,4 +1,5 @@
 from abc import ABC, abstractmethod
+from collections.abc import Mapping
 
 from app.helpers.monitoring import start_as_current_span
 from app.models.readiness import ReadinessEnum
@@ -25,6 +26,28 @@ class ICache(ABC):
     ) -> bool:
         pass
 
+    @abstractmethod
+    @start_as_current_span("cache_get_many")
+    async def get_many(self, keys: list[str]) -> list[bytes | None]:
+        """
+        Get values from the cache, in a single request.
+
+        Returns the values in the order of the keys, `None` for the keys that do not exist.
+        """
+        pass
+
+    @abstractmethod
+    @start_as_current_span("cache_set_many")
+    async def set_many(
+        self,
+        items: Mapping[str, str | bytes | None],
+        ttl_sec: int,
+    ) -> bool:
+        """
+        Set values in the cache, in a single request.
+        """
+        pass
+
     @abstractmethod
     @start_as_current_span("cache_delete")
     async def delete(self, key: str) -> bool:
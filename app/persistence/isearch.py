@@ -26,3 +26,18 @@ class ISearch(ABC):
         cache_only: bool = False,
     ) -> list[TrainingModel] | None:
         pass
+
+    @abstractmethod
+    @start_as_current_span("search_training_search_many")
+    async def training_search_many(
+        self,
+        lang: str,
+        texts: list[str],
+        cache_only: bool = False,
+    ) -> list[list[TrainingModel] | None]:
+        """
+        Search the training data of multiple texts, reading the cache with a single request.
+
+        Returns the results in the order of the texts.
+        """
+        pass
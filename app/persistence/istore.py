@@ -1,11 +1,13 @@
 from abc import ABC, abstractmethod
+from collections.abc import AsyncGenerator
 from contextlib import AbstractAsyncContextManager
+from datetime import datetime
 from uuid import UUID
 
 from aiojobs import Scheduler
 
 from app.helpers.monitoring import start_as_current_span
-from app.models.call import CallStateModel
+from app.models.call import CallGetModel, CallStateModel, CallSummaryModel
 from app.models.readiness import ReadinessEnum
 from app.persistence.icache import ICache
 
@@ -38,6 +40,27 @@ class IStore(ABC):
     ) -> AbstractAsyncContextManager[None]:
         pass
 
+    @abstractmethod
+    @start_as_current_span("store_call_flush")
+    async def call_flush(
+        self,
+        call: CallStateModel,
+    ) -> None:
+        pass
+
+    @abstractmethod
+    @start_as_current_span("store_call_load_messages")
+    async def call_load_messages(
+        self,
+        call: CallStateModel,
+    ) -> None:
+        """
+        Load the archived messages of a call, before its recent messages.
+
+        Loaded messages are not written back, they stay archived.
+        """
+        pass
+
     @abstractmethod
     @start_as_current_span("store_call_create")
     async def call_create(
@@ -64,6 +87,36 @@ class IStore(ABC):
     ) -> tuple[list[CallStateModel] | None, int]:
         pass
 
+    @abstractmethod
+    @start_as_current_span("store_call_search_summaries")
+    async def call_search_summaries(
+        self,
+        count: int,
+        continuation: str | None = None,
+        phone_number: str | None = None,
+    ) -> tuple[list[CallSummaryModel] | None, int, str | None]:
+        """
+        Search the summaries of the calls, latest first, by pages.
+
+        Returns a tuple with the summaries of the page, the total number of calls, and the continuation token of the next page if any.
+        """
+        pass
+
+    @abstractmethod
+    @start_as_current_span("store_call_export")
+    def call_export(
+        self,
+        created_after: datetime | None = None,
+        created_before: datetime | None = None,
+        phone_number: str | None = None,
+    ) -> AsyncGenerator[list[CallGetModel]]:
+        """
+        Export the calls, by pages, in no particular order.
+
+        Calls are exported with their whole conversation, archived messages included. Pages are read one at a time, so memory usage does not depend on the number of calls. If the database fails, the error is raised, so the export is not silently truncated.
+        """
+        pass
+
     def _cache_key_call_id(self, call_id: UUID) -> str:
         return f"{self.__class__.__name__}-call_id-{call_id}"
 
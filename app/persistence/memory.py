@@ -1,28 +1,83 @@
-import hashlib
+import heapq
+import time
 from collections import OrderedDict
-from datetime import UTC, datetime, timedelta
+from collections.abc import Mapping
 
 from app.helpers.config_models.cache import MemoryModel
-from app.helpers.monitoring import suppress
+from app.helpers.monitoring import (
+    cache_evictions,
+    cache_hits,
+    cache_misses,
+    cache_size,
+    counter_add,
+    gauge_set,
+)
 from app.models.readiness import ReadinessEnum
 from app.persistence.icache import ICache
 
+_HEAP_MIN_SIZE = 1024  # Below, stale expirations are not worth a compaction
+_REPORT_INTERVAL_SEC = 1  # Metrics are reported at most once per second, per cache
+
+
+class _Entry:
+    """
+    Value of the cache, with its expiration and size.
+    """
+
+    __slots__ = ("expires_at", "size", "value")
+
+    expires_at: float
+    size: int
+    value: bytes | None
+
+    def __init__(self, expires_at: float, size: int, value: bytes | None):
+        self.expires_at = expires_at
+        self.size = size
+        self.value = value
+
 
 class MemoryCache(ICache):
     """
     A simple in-memory cache.
 
-    Use the least recently used (LRU) policy to remove the oldest used items when the cache is full.
+    Use the least recently used (LRU) policy to remove the oldest used items when the cache is over its size, in bytes of keys and values. Expirations use the monotonic clock, expired items are removed lazily each time the cache is used, from a heap ordered by expiration.
+
+    Hits, misses, evictions and size are reported as metrics, at most once per second.
 
     See: https://en.wikipedia.org/wiki/Cache_replacement_policies#Least_recently_used_(LRU)
     """
 
-    _cache: OrderedDict[str, bytes | None] = OrderedDict()
+    _attributes: dict[str, str]
     _config: MemoryModel
-    _ttl: OrderedDict[str, datetime] = OrderedDict()
+    _entries: OrderedDict[str, _Entry]
+    _evictions: int
+    _expirations: list[tuple[float, str]]
+    _expired: int
+    _hits: int
+    _misses: int
+    _reported: tuple[int, int, int, int]
+    _reported_at: float
+    _size: int
+
+    def __init__(self, config: MemoryModel, name: str = "memory"):
+        """
+        Initialize the cache.
 
-    def __init__(self, config: MemoryModel):
+        Parameters:
+        - `config`: Cache configuration.
+        - `name`: Name of the cache, reported in the metrics.
+        """
+        self._attributes = {"cache": name}
         self._config = config
+        self._entries = OrderedDict()
+        self._evictions = 0
+        self._expirations = []
+        self._expired = 0
+        self._hits = 0
+        self._misses = 0
+        self._reported = (0, 0, 0, 0)
+        self._reported_at = 0
+        self._size = 0
 
     async def readiness(self) -> ReadinessEnum:
         """
@@ -36,24 +91,22 @@ class MemoryCache(ICache):
 
         If the key does not exist, return `None`.
         """
-        sha_key = self._key_to_hash(key)
-
-        # Check TTL, delete if expired
-        ttl = self._ttl.get(sha_key, None)
-        if ttl and ttl < datetime.now(UTC):
-            await self.delete(key)
-            return None
+        now = time.monotonic()
+        self._expire(now)
 
         # Get from cache
-        res = self._cache.get(sha_key, None)
-        if not res:
+        entry = self._entries.get(key, None)
+        if not entry:
+            self._misses += 1
+            self._report(now)
             return None
 
-        # Move to first
-        self._cache.move_to_end(sha_key, last=False)
-        self._ttl.move_to_end(sha_key, last=False)
+        # Move to last, the most recently used
+        self._entries.move_to_end(key)
+        self._hits += 1
+        self._report(now)
 
-        return res
+        return entry.value
 
     async def set(
         self,
@@ -63,43 +116,170 @@ class MemoryCache(ICache):
     ) -> bool:
         """
         Set a value in the cache.
+
+        If the value is larger than the cache, it is not stored and `False` is returned.
         """
-        sha_key = self._key_to_hash(key)
+        now = time.monotonic()
+        data = value.encode() if isinstance(value, str) else value
+        size = len(key) + len(data or b"")
 
-        # Delete the last if full
-        if len(self._cache) >= self._config.max_size:
-            self._ttl.popitem()
-            self._cache.popitem()
+        # Replace the previous value
+        self._remove(key)
+        if size > self._config.max_bytes:
+            return False
 
-        # Set TTL as first element
-        self._ttl[sha_key] = datetime.now(UTC) + timedelta(seconds=ttl_sec)
-        self._ttl.move_to_end(sha_key, last=False)
+        # Add as last element, the most recently used
+        entry = _Entry(
+            expires_at=now + ttl_sec,
+            size=size,
+            value=data,
+        )
+        self._entries[key] = entry
+        self._size += size
+        heapq.heappush(self._expirations, (entry.expires_at, key))
 
-        # Add cache as first element
-        self._cache[sha_key] = value.encode() if isinstance(value, str) else value
-        self._cache.move_to_end(sha_key, last=False)
+        # Remove the expired, then the least recently used until the cache fits
+        self._expire(now)
+        while self._size > self._config.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._size -= evicted.size
+            self._evictions += 1
 
+        # Compact the heap, if mostly made of replaced or removed items
+        if len(self._expirations) > max(_HEAP_MIN_SIZE, 2 * len(self._entries)):
+            self._expirations = [
+                (entry.expires_at, key) for key, entry in self._entries.items()
+            ]
+            heapq.heapify(self._expirations)
+
+        self._report(now)
         return True
 
+    async def get_many(self, keys: list[str]) -> list[bytes | None]:
+        """
+        Get values from the cache.
+
+        Returns the values in the order of the keys, `None` for the keys that do not exist.
+        """
+        return [await self.get(key) for key in keys]
+
+    async def set_many(
+        self,
+        items: Mapping[str, str | bytes | None],
+        ttl_sec: int,
+    ) -> bool:
+        """
+        Set values in the cache.
+
+        If a value is larger than the cache, it is not stored and `False` is returned.
+        """
+        res = True
+        for key, value in items.items():
+            res = await self.set(key=key, ttl_sec=ttl_sec, value=value) and res
+        return res
+
     async def delete(self, key: str) -> bool:
         """
         Delete a value from the cache.
         """
-        sha_key = self._key_to_hash(key)
+        self._remove(key)
+        return True
 
-        # Delete keys
-        with suppress(KeyError):
-            self._ttl.pop(sha_key)
-        with suppress(KeyError):
-            self._cache.pop(sha_key)
+    def clear(self) -> None:
+        """
+        Delete all the values from the cache.
+        """
+        self._entries.clear()
+        self._expirations.clear()
+        self._size = 0
 
-        return True
+    @property
+    def evictions(self) -> int:
+        """
+        Number of items removed before expiration, because the cache was full.
+        """
+        return self._evictions
 
-    @staticmethod
-    def _key_to_hash(key: str) -> str:
+    @property
+    def hits(self) -> int:
+        """
+        Number of reads that found a value.
         """
-        Transform the key into a hash.
+        return self._hits
 
-        SHA-256 lower the collision probability. Plus, it reduce the key size, which is useful for memory usage.
+    @property
+    def misses(self) -> int:
         """
-        return hashlib.sha256(key.encode(), usedforsecurity=False).hexdigest()
+        Number of reads that found no value, missing or expired.
+        """
+        return self._misses
+
+    @property
+    def size(self) -> int:
+        """
+        Size of the keys and values, in bytes.
+        """
+        return self._size
+
+    def _expire(self, now: float) -> None:
+        """
+        Remove the expired items.
+
+        Heap items of replaced or removed values are skipped, their expiration does not match the stored one.
+        """
+        while self._expirations and self._expirations[0][0] <= now:
+            expires_at, key = heapq.heappop(self._expirations)
+            entry = self._entries.get(key, None)
+            if entry and entry.expires_at == expires_at:
+                self._remove(key)
+                self._expired += 1
+
+    def _remove(self, key: str) -> None:
+        """
+        Remove an item, if it exists.
+
+        Its expiration stays in the heap, it is skipped when popped.
+        """
+        entry = self._entries.pop(key, None)
+        if entry:
+            self._size -= entry.size
+
+    def _report(self, now: float) -> None:
+        """
+        Report the counters since the last report, and the size.
+
+        Throttled, as it is called for each read and write.
+        """
+        if now - self._reported_at < _REPORT_INTERVAL_SEC:
+            return
+        self._reported_at = now
+
+        counts = (self._hits, self._misses, self._evictions, self._expired)
+        for metric, attributes, count, reported in zip(
+            (cache_hits, cache_misses, cache_evictions, cache_evictions),
+            (
+                self._attributes,
+                self._attributes,
+                {**self._attributes, "reason": "full"},
+                {**self._attributes, "reason": "expired"},
+            ),
+            counts,
+            self._reported,
+            strict=True,
+        ):
+            if count == reported:
+                continue
+            # Enrich span
+            counter_add(
+                attributes=attributes,
+                metric=metric,
+                value=count - reported,
+            )
+        self._reported = counts
+
+        # Enrich span
+        gauge_set(
+            attributes=self._attributes,
+            metric=cache_size,
+            value=self._size,
+        )
@@ -1,5 +1,5 @@
 import hashlib
-from collections.abc import AsyncGenerator
+from collections.abc import AsyncGenerator, Mapping
 from contextlib import asynccontextmanager
 from uuid import uuid4
 
@@ -22,6 +22,8 @@ from app.persistence.icache import ICache
 # Instrument redis
 RedisInstrumentor().instrument()
 
+_SUBSCRIBE_TIMEOUT_SEC = 10
+
 
 class RedisCache(ICache):
     _config: RedisModel
@@ -101,6 +103,51 @@ class RedisCache(ICache):
             return False
         return True
 
+    async def get_many(self, keys: list[str]) -> list[bytes | None]:
+        """
+        Get values from the cache, with a single `MGET`.
+
+        Returns the values in the order of the keys, `None` for the keys that do not exist or if the value is empty.
+        """
+        if not keys:
+            return []
+        res: list[bytes | None] = [None] * len(keys)
+        try:
+            async with self._use_client() as client:
+                res = await client.mget([self._key_to_hash(key) for key in keys])
+        except RedisError:
+            logger.exception("Error getting values")
+        return [value or None for value in res]
+
+    async def set_many(
+        self,
+        items: Mapping[str, str | bytes | None],
+        ttl_sec: int,
+    ) -> bool:
+        """
+        Set values in the cache, with the `SET` commands pipelined in a single round-trip.
+
+        If a value is `None`, set an empty string.
+        """
+        if not items:
+            return True
+        try:
+            async with (
+                self._use_client() as client,
+                client.pipeline(transaction=False) as pipe,
+            ):
+                for key, value in items.items():
+                    pipe.set(
+                        ex=ttl_sec,
+                        name=self._key_to_hash(key),
+                        value=value if value else "",
+                    )
+                await pipe.execute()
+        except RedisError:
+            logger.exception("Error setting values")
+            return False
+        return True
+
     async def delete(self, key: str) -> bool:
         """
         Delete a value from the cache.
@@ -116,6 +163,39 @@ class RedisCache(ICache):
             return False
         return True
 
+    async def publish(self, channel: str, message: str) -> bool:
+        """
+        Publish a message on a channel, to all the subscribers.
+
+        Messages are not persisted, subscribers not connected miss them.
+        """
+        try:
+            async with self._use_client() as client:
+                await client.publish(channel, message)
+        except RedisError:
+            logger.exception("Error publishing message")
+            return False
+        return True
+
+    async def subscribe(self, channel: str) -> AsyncGenerator[bytes]:
+        """
+        Subscribe to a channel, yielding the messages until the connection fails.
+
+        Errors are raised, so the caller knows messages may have been missed.
+        """
+        async with (
+            self._use_client() as client,
+            client.pubsub(ignore_subscribe_messages=True) as pubsub,
+        ):
+            await pubsub.subscribe(channel)
+            while True:
+                message = await pubsub.get_message(
+                    ignore_subscribe_messages=True,
+                    timeout=_SUBSCRIBE_TIMEOUT_SEC,  # Override the socket timeout, channels are mostly idle
+                )
+                if message:
+                    yield message["data"]
+
     @lru_acache()
     async def _use_connection_pool(self) -> ConnectionPool:
         """
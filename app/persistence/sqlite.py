@@ -0,0 +1,506 @@
+import asyncio
+import json
+import sqlite3
+from collections.abc import AsyncGenerator, Callable
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from datetime import UTC, datetime, timedelta
+from functools import partial
+from pathlib import Path
+from typing import Any, TypeVar
+from uuid import UUID
+
+from aiojobs import Scheduler
+from pydantic import TypeAdapter, ValidationError
+
+from app.helpers.config_models.database import SqliteModel
+from app.helpers.features import callback_timeout_hour
+from app.helpers.logging import logger
+from app.helpers.monitoring import suppress
+from app.models.call import (
+    CallGetModel,
+    CallStateModel,
+    CallSummaryModel,
+    rebase_changes,
+)
+from app.models.readiness import ReadinessEnum
+from app.persistence.icache import ICache
+from app.persistence.istore import IStore
+
+T = TypeVar("T")
+
+_DATETIME_ADAPTER = TypeAdapter(datetime)
+_EXPORT_PAGE_SIZE = 100
+
+# Calls are stored as JSON documents, searched fields are generated columns, indexed
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS calls (
+    call_id TEXT PRIMARY KEY,
+    data TEXT NOT NULL CHECK (json_valid(data)),
+    created_at TEXT GENERATED ALWAYS AS (json_extract(data, '$.created_at')) VIRTUAL,
+    phone_number TEXT GENERATED ALWAYS AS (json_extract(data, '$.initiate.phone_number')) VIRTUAL,
+    policyholder_phone TEXT GENERATED ALWAYS AS (json_extract(data, '$.claim.policyholder_phone')) VIRTUAL
+);
+CREATE INDEX IF NOT EXISTS calls_created_at ON calls (created_at);
+CREATE INDEX IF NOT EXISTS calls_phone_number ON calls (phone_number COLLATE NOCASE, created_at);
+CREATE INDEX IF NOT EXISTS calls_policyholder_phone ON calls (policyholder_phone COLLATE NOCASE, created_at);
+"""
+_WHERE_PHONE_NUMBER = "(phone_number = :phone_number COLLATE NOCASE OR policyholder_phone = :phone_number COLLATE NOCASE)"
+
+
+class SqliteStore(IStore):
+    """
+    Store calls in an embedded SQLite database.
+
+    Requests are run in a dedicated thread, owning the connection, as SQLite allows a single writer at a time. The database is in WAL mode, so readers of other processes are not blocked by the writer.
+
+    Changes of a call are patched in place, appended items are inserted at the end of the arrays. Lists and dicts replaced as a whole are rebased on the stored document, in the same transaction.
+    """
+
+    _config: SqliteModel
+    _connection: sqlite3.Connection | None
+    _executor: ThreadPoolExecutor
+
+    def __init__(self, cache: ICache, config: SqliteModel):
+        super().__init__(cache)
+        logger.info("Using SQLite %s", config.path)
+        self._config = config
+        self._connection = None
+        self._executor = ThreadPoolExecutor(
+            max_workers=1,
+            thread_name_prefix="sqlite",
+        )
+
+    async def readiness(self) -> ReadinessEnum:
+        """
+        Check the readiness of the SQLite database.
+        """
+        try:
+            await self._run(lambda db: db.execute("SELECT COUNT(1) FROM calls"))
+            return ReadinessEnum.OK
+        except sqlite3.Error:
+            logger.exception("Error requesting SQLite")
+        return ReadinessEnum.FAIL
+
+    async def call_get(
+        self,
+        call_id: UUID,
+    ) -> CallStateModel | None:
+        logger.debug("Loading call %s", call_id)
+
+        try:
+            row = await self._run(
+                lambda db: db.execute(
+                    "SELECT data FROM calls WHERE call_id = ?",
+                    (str(call_id),),
+                ).fetchone()
+            )
+        except sqlite3.Error:
+            logger.exception("Error requesting SQLite")
+            return None
+
+        return _parse(row)
+
+    @asynccontextmanager
+    async def call_transac(
+        self,
+        call: CallStateModel,
+        scheduler: Scheduler,  # noqa: ARG002
+    ) -> AsyncGenerator[None]:
+        # Snapshot and yield the updated object
+        snapshot = call.snapshot()
+        yield
+
+        # Compute the diff
+        updated, appended = call.changes(snapshot)
+
+        # Skip if no diff
+        if not updated and not appended:
+            logger.debug("No update needed for call %s", call.call_id)
+            return
+
+        # Bases of the lists and dicts replaced as a whole, to rebase them
+        bases = {
+            field: snapshot.base(field)
+            for field, value in updated.items()
+            if isinstance(value, dict | list)
+        }
+
+        # Write the diff
+        try:
+            row = await self._run(
+                partial(
+                    _patch,
+                    appended=appended,
+                    bases=bases,
+                    call_id=call.call_id,
+                    updated=updated,
+                ),
+                write=True,
+            )
+        except sqlite3.Error:
+            logger.exception("Error requesting SQLite")
+            return
+
+        # Parse remote object
+        remote_call = _parse(row)
+        if not remote_call:
+            return
+
+        # Refresh call with remote object
+        for field in call.model_fields_set:
+            new_value = getattr(remote_call, field)
+            # Skip set to avoid Pydantic costly validation
+            if getattr(call, field) == new_value:
+                continue
+            # Try to set the new value
+            with suppress(ValidationError):
+                setattr(call, field, new_value)
+
+    async def call_flush(
+        self,
+        call: CallStateModel,
+    ) -> None:
+        pass  # Changes are written by the transaction
+
+    async def call_load_messages(
+        self,
+        call: CallStateModel,
+    ) -> None:
+        pass  # Messages are not archived
+
+    async def call_create(
+        self,
+        call: CallStateModel,
+    ) -> CallStateModel:
+        logger.debug("Creating new call %s", call.call_id)
+
+        # Persist
+        try:
+            await self._run(
+                lambda db: db.execute(
+                    "INSERT INTO calls (call_id, data) VALUES (?, ?)",
+                    (
+                        str(call.call_id),
+                        call.model_dump_json(exclude_none=True),
+                    ),
+                ),
+                write=True,
+            )
+        except sqlite3.Error:
+            logger.exception("Error requesting SQLite")
+
+        return call
+
+    async def call_search_one(
+        self,
+        phone_number: str,
+        callback_timeout: bool = True,
+    ) -> CallStateModel | None:
+        logger.debug("Loading last call for %s", phone_number)
+
+        timeout = callback_timeout_hour()
+        if timeout < 1 and callback_timeout:
+            logger.debug("Callback timeout if off, skipping search")
+            return None
+
+        # Filter by timeout if needed, dates are stored in ISO 8601 and UTC, so they are sorted as strings
+        extra_where = ""
+        parameters: dict[str, Any] = {"phone_number": phone_number}
+        if callback_timeout:
+            extra_where = "AND created_at >= :created_at"
+            parameters["created_at"] = (
+                datetime.now(UTC) - timedelta(hours=timeout)
+            ).strftime("%Y-%m-%dT%H:%M:%S")
+
+        try:
+            row = await self._run(
+                lambda db: db.execute(
+                    f"SELECT data FROM calls WHERE {_WHERE_PHONE_NUMBER} {extra_where} ORDER BY created_at DESC LIMIT 1",
+                    parameters,
+                ).fetchone()
+            )
+        except sqlite3.Error:
+            logger.exception("Error requesting SQLite")
+            return None
+
+        return _parse(row)
+
+    async def call_search_all(
+        self,
+        count: int,
+        phone_number: str | None = None,
+    ) -> tuple[list[CallStateModel] | None, int]:
+        logger.debug("Searching calls, for %s and count %s", phone_number, count)
+
+        where_clause = f"WHERE {_WHERE_PHONE_NUMBER}" if phone_number else ""
+        parameters = {
+            "count": count,
+            "phone_number": phone_number,
+        }
+
+        def _search(db: sqlite3.Connection) -> tuple[list[tuple[str]], int]:
+            rows = db.execute(
+                f"SELECT data FROM calls {where_clause} ORDER BY created_at DESC LIMIT :count",
+                parameters,
+            ).fetchall()
+            (total,) = db.execute(
+                f"SELECT COUNT(1) FROM calls {where_clause}",
+                parameters,
+            ).fetchone()
+            return rows, total
+
+        try:
+            rows, total = await self._run(_search)
+        except sqlite3.Error:
+            logger.exception("Error requesting SQLite")
+            return [], 0
+
+        calls = [call for row in rows if (call := _parse(row))]
+        return calls, total
+
+    async def call_search_summaries(
+        self,
+        count: int,
+        continuation: str | None = None,
+        phone_number: str | None = None,
+    ) -> tuple[list[CallSummaryModel] | None, int, str | None]:
+        logger.debug(
+            "Searching call summaries, for %s and count %s", phone_number, count
+        )
+
+        where_clauses = [_WHERE_PHONE_NUMBER] if phone_number else []
+        parameters: dict[str, Any] = {
+            "count": count,
+            "phone_number": phone_number,
+        }
+        # Continue after the last call of the previous page, by creation date then ID
+        page_clauses = list(where_clauses)
+        if continuation:
+            created_at, call_id = continuation.split(" ", 1)
+            page_clauses.append("(created_at, call_id) < (:created_at, :call_id)")
+            parameters["call_id"] = call_id
+            parameters["created_at"] = created_at
+
+        def _search(
+            db: sqlite3.Connection,
+        ) -> tuple[list[tuple[Any, ...]], int]:
+            # Project the listed fields only, conversations can be long
+            rows = db.execute(
+                f"SELECT call_id, created_at, json_extract(data, '$.in_progress'), phone_number, json_extract(data, '$.synthesis.short') FROM calls {_where(page_clauses)} ORDER BY created_at DESC, call_id DESC LIMIT :count",
+                parameters,
+            ).fetchall()
+            (total,) = db.execute(
+                f"SELECT COUNT(1) FROM calls {_where(where_clauses)}",
+                parameters,
+            ).fetchone()
+            return rows, total
+
+        try:
+            rows, total = await self._run(_search)
+        except sqlite3.Error:
+            logger.exception("Error requesting SQLite")
+            return [], 0, None
+
+        calls: list[CallSummaryModel] = []
+        for call_id, created_at, in_progress, row_phone_number, synthesis_short in rows:
+            try:
+                calls.append(
+                    CallSummaryModel(
+                        call_id=call_id,
+                        created_at=created_at,
+                        in_progress=bool(in_progress),
+                        phone_number=row_phone_number,
+                        synthesis_short=synthesis_short,
+                    )
+                )
+            except ValidationError:
+                logger.debug("Parsing error", exc_info=True)
+
+        # Next page, if this one is full
+        next_continuation = None
+        if len(rows) == count:
+            next_continuation = f"{rows[-1][1]} {rows[-1][0]}"
+
+        return calls, total, next_continuation
+
+    async def call_export(
+        self,
+        created_after: datetime | None = None,
+        created_before: datetime | None = None,
+        phone_number: str | None = None,
+    ) -> AsyncGenerator[list[CallGetModel]]:
+        logger.debug(
+            "Exporting calls, for %s from %s to %s",
+            phone_number,
+            created_after,
+            created_before,
+        )
+
+        # Filters, dates are stored in ISO 8601 and UTC, so they are compared as strings
+        where_clauses = ["rowid > :rowid"]
+        parameters: dict[str, Any] = {
+            "count": _EXPORT_PAGE_SIZE,
+            "phone_number": phone_number,
+            "rowid": 0,
+        }
+        if phone_number:
+            where_clauses.append(_WHERE_PHONE_NUMBER)
+        if created_after:
+            where_clauses.append("created_at >= :created_after")
+            parameters["created_after"] = _DATETIME_ADAPTER.dump_python(
+                created_after, mode="json"
+            )
+        if created_before:
+            where_clauses.append("created_at < :created_before")
+            parameters["created_before"] = _DATETIME_ADAPTER.dump_python(
+                created_before, mode="json"
+            )
+        query = f"SELECT rowid, data FROM calls {_where(where_clauses)} ORDER BY rowid LIMIT :count"
+
+        # Read page by page, continuing after the last row, so the thread is not held by the export
+        while True:
+            try:
+                rows = await self._run(
+                    lambda db: db.execute(query, parameters).fetchall()
+                )
+            # Raise, so the streamed response is aborted instead of truncated
+            except sqlite3.Error:
+                logger.exception("Error requesting SQLite, export is aborted")
+                raise
+            if not rows:
+                return
+
+            calls: list[CallGetModel] = []
+            for _, data in rows:
+                try:
+                    calls.append(CallGetModel.model_validate_json(data))
+                except ValidationError:
+                    logger.debug("Parsing error", exc_info=True)
+            yield calls
+
+            parameters["rowid"] = rows[-1][0]
+
+    async def _run(
+        self,
+        func: Callable[[sqlite3.Connection], T],
+        write: bool = False,
+    ) -> T:
+        """
+        Run a function with the connection, in the database thread.
+
+        If `write` is set, the function is run in a transaction holding the write lock, so the data read is not modified until the commit, even by other processes.
+        """
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor,
+            self._use_connection,
+            func,
+            write,
+        )
+
+    def _use_connection(
+        self,
+        func: Callable[[sqlite3.Connection], T],
+        write: bool,
+    ) -> T:
+        """
+        Run a function with the connection, opening the database if needed.
+
+        Must be called from the database thread.
+        """
+        if not self._connection:
+            path = Path(self._config.path)
+            path.parent.mkdir(exist_ok=True, parents=True)
+            self._connection = sqlite3.connect(
+                check_same_thread=False,  # Created and used by the database thread only
+                database=path,
+                isolation_level=None,  # Transactions are explicit
+            )
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "PRAGMA synchronous=NORMAL"
+            )  # Durable on commit with WAL, except on power loss
+            self._connection.executescript(_SCHEMA)
+
+        # Read, each statement is atomic
+        if not write:
+            return func(self._connection)
+
+        # Write, in a transaction
+        self._connection.execute("BEGIN IMMEDIATE")
+        try:
+            res = func(self._connection)
+        except BaseException:
+            self._connection.rollback()
+            raise
+        self._connection.commit()
+        return res
+
+
+def _where(clauses: list[str]) -> str:
+    """
+    Join the clauses in a WHERE statement, empty if there are none.
+    """
+    return f"WHERE {' AND '.join(clauses)}" if clauses else ""
+
+
+def _parse(row: tuple[str] | None) -> CallStateModel | None:
+    """
+    Parse a call from a row with its data.
+    """
+    if not row:
+        return None
+    try:
+        return CallStateModel.model_validate_json(row[0])
+    except ValidationError:
+        logger.debug("Parsing error", exc_info=True)
+    return None
+
+
+def _patch(
+    db: sqlite3.Connection,
+    call_id: UUID,
+    updated: dict[str, Any],
+    appended: dict[str, list[Any]],
+    bases: dict[str, Any],
+) -> tuple[str] | None:
+    """
+    Patch a call in place, in a transaction.
+
+    Returns the row with the patched data, or `None` if the call does not exist.
+    """
+    # Rebase on the stored document, no other writer until the commit
+    if bases:
+        row = db.execute(
+            "SELECT data FROM calls WHERE call_id = ?",
+            (str(call_id),),
+        ).fetchone()
+        if not row:
+            return None
+        updated = rebase_changes(
+            bases=bases,
+            remote=json.loads(row[0]),
+            updated=updated,
+        )
+
+    # Build the patch, fields are from the model so safe to use as paths
+    expression = "data"
+    parameters: list[str] = []
+    if updated:
+        expression = (
+            f"json_set({expression}, {', '.join(['?, json(?)'] * len(updated))})"
+        )
+        for field, value in updated.items():
+            parameters += [f'$."{field}"', json.dumps(value)]
+    items = [(field, item) for field, values in appended.items() for item in values]
+    if items:
+        expression = (
+            f"json_insert({expression}, {', '.join(['?, json(?)'] * len(items))})"
+        )
+        for field, item in items:
+            parameters += [f'$."{field}"[#]', json.dumps(item)]  # Append to the array
+
+    return db.execute(
+        f"UPDATE calls SET data = {expression} WHERE call_id = ? RETURNING data",
+        (*parameters, str(call_id)),
+    ).fetchone()
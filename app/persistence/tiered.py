@@ -0,0 +1,217 @@
+import asyncio
+import json
+from collections.abc import Mapping
+from uuid import uuid4
+
+from redis.exceptions import RedisError
+
+from app.helpers.cache import lru_acache
+from app.helpers.config_models.cache import MemoryModel, RedisModel, TieredModel
+from app.helpers.logging import logger
+from app.helpers.monitoring import cache_hits, cache_misses, counter_add
+from app.models.readiness import ReadinessEnum
+from app.persistence.icache import ICache
+from app.persistence.memory import MemoryCache
+from app.persistence.redis import RedisCache
+
+_RESUBSCRIBE_DELAY_SEC = 1
+
+
+class TieredCache(ICache):
+    """
+    Memory cache (L1) in front of Redis cache (L2).
+
+    Values are read from memory first, then from Redis, and kept in memory for a short time. Changes are written to Redis, then published to the other workers, which drop their copy from memory.
+
+    If the subscription is lost, invalidations may have been missed, so the memory is cleared before subscribing again.
+    """
+
+    _attributes: dict[str, str]
+    _config: TieredModel
+    _id: str
+    _l1: MemoryCache
+    _l2: RedisCache
+
+    def __init__(self, config: TieredModel, redis: RedisModel):
+        self._attributes = {"cache": "l2"}
+        self._config = config
+        self._id = str(uuid4())  # Skip the invalidations published by this worker
+        self._l1 = MemoryCache(
+            config=MemoryModel(max_bytes=config.memory_max_bytes),
+            name="l1",
+        )
+        self._l2 = RedisCache(redis)
+
+    async def readiness(self) -> ReadinessEnum:
+        """
+        Check the readiness of the Redis cache, the memory is always ready.
+        """
+        return await self._l2.readiness()
+
+    async def get(self, key: str) -> bytes | None:
+        """
+        Get a value from memory, or from Redis.
+
+        If the key does not exist, return `None`.
+        """
+        await self._use_subscriber()
+
+        # Try memory
+        res = await self._l1.get(key)
+        if res:
+            return res
+
+        # Try Redis
+        res = await self._l2.get(key)
+        # Enrich span
+        counter_add(
+            attributes=self._attributes,
+            metric=cache_hits if res else cache_misses,
+            value=1,
+        )
+        if not res:
+            return None
+
+        # Keep in memory
+        await self._l1.set(
+            key=key,
+            ttl_sec=self._config.memory_ttl_sec,
+            value=res,
+        )
+        return res
+
+    async def set(
+        self,
+        key: str,
+        ttl_sec: int,
+        value: str | bytes | None,
+    ) -> bool:
+        """
+        Set a value in Redis and memory, then invalidate the other workers.
+        """
+        await self._use_subscriber()
+
+        # Drop our copy first, so a failed write does not leave it diverged
+        await self._l1.delete(key)
+        if not await self._l2.set(
+            key=key,
+            ttl_sec=ttl_sec,
+            value=value,
+        ):
+            return False
+
+        await self._l1.set(
+            key=key,
+            ttl_sec=min(ttl_sec, self._config.memory_ttl_sec),
+            value=value,
+        )
+        await self._publish(key)
+        return True
+
+    async def get_many(self, keys: list[str]) -> list[bytes | None]:
+        """
+        Get values from memory, and the missing ones from Redis in a single request.
+
+        Returns the values in the order of the keys, `None` for the keys that do not exist.
+        """
+        await self._use_subscriber()
+
+        # Try memory
+        res = await self._l1.get_many(keys)
+        missing = [key for key, value in zip(keys, res, strict=True) if not value]
+        if not missing:
+            return res
+
+        # Try Redis
+        found = dict(zip(missing, await self._l2.get_many(missing), strict=True))
+        hits = sum(1 for value in found.values() if value)
+        # Enrich span
+        for metric, value in ((cache_hits, hits), (cache_misses, len(missing) - hits)):
+            if value:
+                counter_add(
+                    attributes=self._attributes,
+                    metric=metric,
+                    value=value,
+                )
+
+        # Keep in memory
+        await self._l1.set_many(
+            items={key: value for key, value in found.items() if value},
+            ttl_sec=self._config.memory_ttl_sec,
+        )
+        return [value or found.get(key) for key, value in zip(keys, res, strict=True)]
+
+    async def set_many(
+        self,
+        items: Mapping[str, str | bytes | None],
+        ttl_sec: int,
+    ) -> bool:
+        """
+        Set values in Redis and memory, then invalidate the other workers, in a single message.
+        """
+        await self._use_subscriber()
+
+        # Drop our copies first, so a failed write does not leave them diverged
+        for key in items:
+            await self._l1.delete(key)
+        if not await self._l2.set_many(
+            items=items,
+            ttl_sec=ttl_sec,
+        ):
+            return False
+
+        await self._l1.set_many(
+            items=items,
+            ttl_sec=min(ttl_sec, self._config.memory_ttl_sec),
+        )
+        await self._publish(*items)
+        return True
+
+    async def delete(self, key: str) -> bool:
+        """
+        Delete a value from memory and Redis, then invalidate the other workers.
+        """
+        await self._use_subscriber()
+
+        await self._l1.delete(key)
+        res = await self._l2.delete(key)
+        await self._publish(key)
+        return res
+
+    async def _publish(self, *keys: str) -> None:
+        """
+        Publish the invalidation of keys.
+        """
+        await self._l2.publish(
+            channel=self._config.channel,
+            message=json.dumps({"keys": keys, "sender": self._id}),
+        )
+
+    async def _subscribe(self) -> None:
+        """
+        Drop from memory the keys changed by the other workers, until cancelled.
+        """
+        while True:
+            try:
+                async for message in self._l2.subscribe(self._config.channel):
+                    invalidation = json.loads(message)
+                    if invalidation["sender"] == self._id:
+                        continue
+                    for key in invalidation["keys"]:
+                        await self._l1.delete(key)
+            except RedisError:
+                logger.warning(
+                    "Cache invalidations subscription lost, retrying", exc_info=True
+                )
+
+            # Invalidations may have been missed
+            self._l1.clear()
+            await asyncio.sleep(_RESUBSCRIBE_DELAY_SEC)
+
+    @lru_acache()
+    async def _use_subscriber(self) -> asyncio.Task:
+        """
+        Start the invalidations subscriber, once per event loop.
+        """
+        logger.info("Using cache invalidations channel %s", self._config.channel)
+        return asyncio.create_task(self._subscribe())
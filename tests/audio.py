@@ -0,0 +1,508 @@
+import asyncio
+from base64 import b64decode, b64encode
+from multiprocessing.shared_memory import SharedMemory
+from types import SimpleNamespace
+
+import numpy as np
+import orjson
+import pytest
+from aiojobs import Scheduler
+from pytest_assume.plugin import assume
+
+from app.helpers import audio_pool
+from app.helpers.audio_aec import EchoCanceller
+from app.helpers.audio_codec import AudioEncoder, decode_audio
+from app.helpers.audio_pool import PooledEchoCanceller, shutdown_pool
+from app.helpers.audio_queue import AudioQueue
+from app.helpers.audio_vad import VoiceActivityDetector
+from app.helpers.call_utils import AECStream, SttClient, TtsCallback
+from app.helpers.config import CONFIG
+from app.helpers.config_models.audio import AecModel, VadModeEnum, VadModel
+from app.models.call import CallInitiateModel, CallStateModel
+
+_CALLS = 32
+_PACKET_SIZE = 320  # 20 ms at 16 kHz
+_SAMPLE_RATE = 16000
+_THRESHOLD = 0.05  # Default of the feature, divided by 10
+
+
+def _voice(
+    duration_ms: int,
+    amplitude: float = 0.3,
+    pitch_hz: int = 140,
+) -> np.ndarray:
+    """
+    Generate a voiced signal, harmonics of a pitch.
+    """
+    t = np.arange(int(_SAMPLE_RATE * duration_ms / 1000)) / _SAMPLE_RATE
+    voice = sum(np.sin(2 * np.pi * pitch_hz * k * t) / k for k in range(1, 6))
+    voice = voice / np.abs(voice).max() * amplitude * 32767
+    return voice.astype(np.int16)
+
+
+def _cancel(input_pcm: np.ndarray, reference_pcm: np.ndarray) -> np.ndarray:
+    """
+    Run the echo cancellation on a signal, packet by packet.
+    """
+    engine = EchoCanceller(sample_rate=_SAMPLE_RATE)
+    return np.concatenate(
+        [
+            np.frombuffer(
+                engine.process(
+                    input_pcm=input_pcm[i : i + _PACKET_SIZE].tobytes(),
+                    reference_pcm=reference_pcm[i : i + _PACKET_SIZE].tobytes(),
+                )[0],
+                dtype=np.int16,
+            )
+            for i in range(0, len(input_pcm), _PACKET_SIZE)
+        ]
+    )
+
+
+def _rms(signal: np.ndarray) -> float:
+    """
+    Get the RMS of a signal, in PCM 16-bit units.
+    """
+    return float(np.sqrt(np.mean(signal.astype(np.float64) ** 2)))
+
+
+def _detect(detector: VoiceActivityDetector, signal: np.ndarray) -> list[bool]:
+    """
+    Run the detector on a signal, packet by packet.
+    """
+    return [
+        detector.process(signal[i : i + _PACKET_SIZE].tobytes())
+        for i in range(0, len(signal), _PACKET_SIZE)
+    ]
+
+
+def test_echo_cancellation() -> None:
+    """
+    Test the spectral gate attenuates the bot voice and keeps the user voice.
+
+    Steps:
+    1. Generate the bot voice, as reference, and its echo in the microphone
+    2. Cancel the echo alone, check it is attenuated
+    3. Cancel the echo mixed with the user voice, at another pitch, check the user voice is kept
+    4. Cancel without reference, check the input is returned as is
+
+    The first second is skipped, the noise reference is filled meanwhile.
+    """
+    bot = _voice(2000)
+    echo = (bot // 2).astype(np.int16)
+    user = _voice(2000, pitch_hz=1500)
+    skip = _SAMPLE_RATE  # 1 sec
+
+    # Echo alone
+    output = _cancel(echo, bot)
+    assume(_rms(output[skip:]) < _rms(echo[skip:]) / 2)
+
+    # Echo and user voice
+    mix = (echo.astype(np.int32) + user).clip(-32768, 32767).astype(np.int16)
+    output = _cancel(mix, bot)
+    assume(_rms(output[skip:]) > _rms(user[skip:]) * 0.75)
+    assume(_rms(output[skip:].astype(np.int32) - user[skip:]) < _rms(user[skip:]) * 0.3)
+
+    # No reference
+    output = _cancel(user, np.zeros_like(user))
+    assume(np.array_equal(output, user))
+
+
+@pytest.mark.parametrize(
+    "vad_mode",
+    [
+        pytest.param(
+            VadModeEnum.ENERGY,
+            id="energy",
+        ),
+        pytest.param(
+            VadModeEnum.WEBRTC,
+            id="webrtc",
+        ),
+    ],
+)
+def test_vad_detection(vad_mode: VadModeEnum) -> None:
+    """
+    Test the voice activity detection on silence, noise and voice.
+
+    Steps:
+    1. Create a detector
+    2. Check silence is not speech
+    3. Check quiet voice is not speech
+    4. Check loud white noise is not speech
+    5. Check voice is speech
+    """
+    # WebRTC is an optional extra
+    if vad_mode == VadModeEnum.WEBRTC:
+        pytest.importorskip("webrtcvad")
+
+    config = VadModel(mode=vad_mode)
+    rng = np.random.default_rng(0)
+
+    def _detector() -> VoiceActivityDetector:
+        return VoiceActivityDetector(
+            attack_ms=config.attack_ms,
+            engine=config.engine(_SAMPLE_RATE),
+            hangover_ms=config.hangover_ms,
+            sample_rate=_SAMPLE_RATE,
+            threshold=_THRESHOLD,
+        )
+
+    # Silence
+    assume(not any(_detect(_detector(), np.zeros(_SAMPLE_RATE, np.int16))))
+
+    # Quiet voice
+    assume(not any(_detect(_detector(), _voice(1000, amplitude=0.02))))
+
+    # Loud white noise
+    if vad_mode == VadModeEnum.ENERGY:
+        noise = rng.normal(0, 0.08 * 32767, _SAMPLE_RATE).astype(np.int16)
+        assume(not any(_detect(_detector(), noise)))
+
+    # Voice
+    assume(all(_detect(_detector(), _voice(1000))[5:]))
+
+
+def test_vad_smoothing() -> None:
+    """
+    Test the attack and hangover of the voice activity detection.
+
+    Steps:
+    1. Create a detector with a 40 ms attack and a 100 ms hangover
+    2. Check a 20 ms click is not speech
+    3. Check speech is detected after the attack
+    4. Check a short pause does not end the speech
+    5. Check a long pause ends the speech
+    """
+    detector = VoiceActivityDetector(
+        attack_ms=40,
+        engine=VadModel().engine(_SAMPLE_RATE),
+        hangover_ms=100,
+        sample_rate=_SAMPLE_RATE,
+        threshold=_THRESHOLD,
+    )
+    silence = np.zeros(_PACKET_SIZE * 25, np.int16)  # 500 ms
+
+    # Click
+    assume(not any(_detect(detector, _voice(20))))
+    assume(not any(_detect(detector, silence)))
+
+    # Attack
+    res = _detect(detector, _voice(200))
+    assume(res[:2] == [False, True])
+    assume(all(res[1:]))
+
+    # Short pause
+    assume(all(_detect(detector, silence[: _PACKET_SIZE * 4])))  # 80 ms
+    assume(all(_detect(detector, _voice(100))))
+
+    # Long pause
+    res = _detect(detector, silence)
+    assume(any(res[:5]))
+    assume(not any(res[6:]))
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_queue_drop_oldest() -> None:
+    """
+    Test the audio queue drops the oldest items when full.
+
+    Steps:
+    1. Create a queue of 3 items
+    2. Put 5 items
+    3. Check the 2 oldest are dropped
+    4. Check the 3 latest are returned in order
+    """
+    max_size = 3
+    queue: AudioQueue[int] = AudioQueue(
+        maxsize=max_size,
+        name="test",
+    )
+
+    # Put more items than the size, without waiting
+    for i in range(max_size + 2):
+        await queue.put(i)
+
+    # Check the oldest are dropped
+    assume(queue.dropped == 2)  # noqa: PLR2004
+    assume(queue.qsize() == max_size)
+
+    # Check the latest are kept, in order
+    res = []
+    while not queue.empty():
+        res.append(await queue.get())
+        queue.task_done()
+    assume(res == [2, 3, 4])
+
+
+def test_media_codec() -> None:
+    """
+    Test the media messages of Communication Services.
+
+    Steps:
+    1. Decode an audio message
+    2. Check silent and non-audio messages are skipped
+    3. Encode audio larger than the frame size
+    4. Check the audio is split in valid messages, without loss
+    """
+    pcm = _voice(1000).tobytes()
+
+    # Decode
+    def _message(silent: bool) -> bytes:
+        return orjson.dumps(
+            {
+                "kind": "AudioData",
+                "audioData": {
+                    "data": b64encode(pcm[:_PACKET_SIZE]).decode(),
+                    "silent": silent,
+                },
+            }
+        )
+
+    assume(decode_audio(_message(silent=False)) == pcm[:_PACKET_SIZE])
+    assume(decode_audio(_message(silent=True)) is None)
+    assume(decode_audio('{"kind":"AudioMetadata","audioMetadata":{}}') is None)
+
+    # Encode
+    encoder = AudioEncoder(
+        frame_max_ms=300,
+        sample_rate=_SAMPLE_RATE,
+    )
+    messages = [orjson.loads(message) for message in encoder.encode(pcm)]
+    assume(len(messages) == 4)  # noqa: PLR2004
+    assume(all(message["kind"] == "AudioData" for message in messages))
+    assume(
+        b"".join(b64decode(message["audioData"]["data"]) for message in messages) == pcm
+    )
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_calls_isolation(monkeypatch: pytest.MonkeyPatch) -> None:
+    """
+    Test concurrent calls do not share audio or transcripts.
+
+    Steps:
+    1. Process the echo cancellation in the event loop
+    2. Run dozens of calls concurrently
+    3. Send packets tagged with the call and the sequence number, the bot is silent so the audio is not modified
+    4. Check each call receives only its own packets, once
+    5. Recognize a text from the SDK thread
+    6. Check each call gets only its own text
+    """
+    # Skip the process pool, isolation is the same
+    monkeypatch.setattr(CONFIG.audio, "aec", AecModel(pool_size=0))
+
+    async def _run_call(index: int) -> tuple[list[np.ndarray], str]:
+        audio_in: AudioQueue[bytes] = AudioQueue(
+            maxsize=CONFIG.audio.queue.in_max_size,
+            name="in",
+        )
+        audio_out: asyncio.Queue[bytes | bool] = asyncio.Queue(
+            maxsize=CONFIG.audio.queue.out_max_size,
+        )
+        audio_tts: AudioQueue[bytes] = AudioQueue(name="tts")
+        call = CallStateModel(
+            initiate=CallInitiateModel(
+                **CONFIG.conversation.initiate.model_dump(),
+                phone_number="+33612345678",  # pyright: ignore
+            ),
+            voice_id="dummy",
+        )
+
+        async with (
+            Scheduler() as scheduler,
+            AECStream(
+                in_raw_queue=audio_in,
+                in_reference_queue=audio_tts,
+                out_queue=audio_out,
+                sample_rate=_SAMPLE_RATE,
+                scheduler=scheduler,
+            ) as aec,
+        ):
+            stt_client = SttClient(
+                call=call,
+                sample_rate=_SAMPLE_RATE,
+                scheduler=scheduler,
+            )
+
+            # Send tagged packets, empty packets are all zeros
+            received: list[np.ndarray] = []
+            for seq in range(50):
+                packet = np.full(_PACKET_SIZE, seq + 1, dtype=np.int16)
+                packet[0] = index + 1
+                await audio_in.put(packet.tobytes())
+                pcm, _ = await aec.pull_audio()
+                received.append(np.frombuffer(pcm, dtype=np.int16))
+
+            # Recognize from another thread, like the SDK
+            await asyncio.to_thread(
+                stt_client._complete_callback,
+                SimpleNamespace(result=SimpleNamespace(text=f"call {index}")),
+            )
+            text = await stt_client.pull_recognition()
+
+        return received, text
+
+    results = await asyncio.gather(*[_run_call(index) for index in range(_CALLS)])
+
+    for index, (received, text) in enumerate(results):
+        # Check audio
+        packets = [packet for packet in received if packet.any()]
+        assume(packets)
+        assume(all(packet[0] == index + 1 for packet in packets))
+        # Order is not checked, packets are processed concurrently
+        seqs = [int(packet[1]) for packet in packets]
+        assume(len(seqs) == len(set(seqs)))
+
+        # Check transcript
+        assume(text == f"call {index}")
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_aec_busy(monkeypatch: pytest.MonkeyPatch) -> None:
+    """
+    Test a packet is returned raw when the engine is busy, without losing the reference.
+
+    Steps:
+    1. Create a stream, with a bot voice reference queued
+    2. Mark the engine as busy
+    3. Process a packet, check it is returned raw
+    4. Check the reference is kept for the next packet
+    """
+    monkeypatch.setattr(CONFIG.audio, "aec", AecModel(pool_size=0))
+    async with Scheduler() as scheduler:
+        aec = AECStream(
+            in_raw_queue=asyncio.Queue(),
+            in_reference_queue=asyncio.Queue(),
+            out_queue=asyncio.Queue(),
+            sample_rate=_SAMPLE_RATE,
+            scheduler=scheduler,
+        )
+        try:
+            await aec._aec_reference_queue.put(_voice(20).tobytes())
+            aec._canceller._busy = True
+
+            input_pcm = _voice(20, pitch_hz=1500).tobytes()
+            await aec._ensure_run_slo(input_pcm)
+            pcm, _ = await aec.pull_audio()
+            assume(pcm == input_pcm)
+            assume(aec._aec_reference_queue.qsize() == 1)
+        finally:
+            aec._canceller._busy = False
+            aec._canceller.close()
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_aec_pool(monkeypatch: pytest.MonkeyPatch) -> None:
+    """
+    Test the echo cancellation in a pool of processes.
+
+    Steps:
+    1. Process a signal in a pool of one spawned worker, and in the event loop
+    2. Check the outputs are the same
+    3. Fill the pool, check a packet of another stream is skipped instead of queued
+    4. Close the engines and stop the pool, check no shared memory block is left
+    """
+    monkeypatch.setattr(CONFIG.audio, "aec", AecModel(max_pending=1, pool_size=1))
+    monkeypatch.setattr(audio_pool, "_semaphore", None)
+    bot = _voice(1000)
+    echo = (bot // 2).astype(np.int16)
+    local = EchoCanceller(sample_rate=_SAMPLE_RATE)
+    pooled = [PooledEchoCanceller(sample_rate=_SAMPLE_RATE) for _ in range(2)]
+    names = [engine._block.name for engine in pooled if engine._block]
+    assume(len(names) == 2)  # noqa: PLR2004
+
+    try:
+        # Same output as in the event loop
+        for i in range(0, len(echo), _PACKET_SIZE):
+            input_pcm = echo[i : i + _PACKET_SIZE].tobytes()
+            reference_pcm = bot[i : i + _PACKET_SIZE].tobytes()
+            res = await pooled[0].process(
+                input_pcm=input_pcm,
+                reference_pcm=reference_pcm,
+            )
+            assume(res)
+            if res:
+                assume(res[0] == local.process(input_pcm, reference_pcm)[0])
+
+        # Pool full, the other stream is not queued
+        input_pcm = echo[:_PACKET_SIZE].tobytes()
+        first = asyncio.create_task(
+            pooled[0].process(
+                input_pcm=input_pcm,
+                reference_pcm=None,
+            )
+        )
+        await asyncio.sleep(0)  # Let the first packet take the slot
+        assume(
+            await pooled[1].process(
+                input_pcm=input_pcm,
+                reference_pcm=None,
+            )
+            is None
+        )
+        assume(await first)
+        assume(
+            await pooled[1].process(
+                input_pcm=input_pcm,
+                reference_pcm=None,
+            )
+        )
+
+    # No shared memory left
+    finally:
+        for engine in pooled:
+            engine.close()
+        shutdown_pool()
+    for name in names:
+        with pytest.raises(FileNotFoundError):
+            SharedMemory(name=name, track=False)
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_tts_single_copy() -> None:
+    """
+    Test the bot voice is copied once, from the TTS to the phone and the echo cancellation.
+
+    Steps:
+    1. Write the bot voice from another thread, like the SDK
+    2. Check the output gets the audio
+    3. Check the reference packets are views of the output, not copies
+    """
+    audio_in: AudioQueue[bytes] = AudioQueue(name="in")
+    audio_out: asyncio.Queue[bytes | bool] = asyncio.Queue()
+    audio_tts: AudioQueue[bytes] = AudioQueue(name="tts")
+    pcm = _voice(110).tobytes()  # Not a multiple of the packet duration
+
+    async with (
+        Scheduler() as scheduler,
+        AECStream(
+            in_raw_queue=audio_in,
+            in_reference_queue=audio_tts,
+            out_queue=audio_out,
+            sample_rate=_SAMPLE_RATE,
+            scheduler=scheduler,
+        ) as aec,
+    ):
+        # Write from the SDK thread
+        callback = TtsCallback(audio_tts)
+        written = await asyncio.to_thread(callback.write, memoryview(pcm))
+        assume(written == len(pcm))
+
+        # Check output
+        out = await asyncio.wait_for(audio_out.get(), timeout=1)
+        assume(out == pcm)
+
+        # Check reference, the last packet is padded with silence
+        await asyncio.sleep(0)
+        packets = []
+        while not aec._aec_reference_queue.empty():
+            packets.append(aec._aec_reference_queue.get_nowait())
+        assume(len(packets) == 6)  # noqa: PLR2004
+        assume(
+            all(
+                isinstance(packet, memoryview) and packet.obj is out
+                for packet in packets[:-1]
+            )
+        )
+        assume(b"".join(packets).rstrip(b"\x00") == pcm.rstrip(b"\x00"))
@@ -0,0 +1,391 @@
+import argparse
+import asyncio
+import random
+import sys
+import time
+import wave
+from collections import deque
+from contextlib import suppress
+from pathlib import Path
+from unittest.mock import AsyncMock
+
+import numpy as np
+from aiojobs import Scheduler
+from pydantic import BaseModel
+
+from app.helpers import features
+from app.helpers.audio_pool import PooledEchoCanceller, shutdown_pool
+from app.helpers.audio_queue import AudioQueue
+from app.helpers.call_llm import _process_audio_for_vad
+from app.helpers.call_utils import AECStream, SttClient
+from app.helpers.config import CONFIG
+from app.helpers.logging import logger
+from app.models.call import CallInitiateModel, CallStateModel
+
+_BOT_PAUSE_SEC = 2  # Silence between two bot answers
+_ECHO_GAIN = 0.5  # Attenuation of the bot voice captured by the phone
+_PACKET_DURATION_MS = 20
+_SAMPLE_RATE = 16000
+_PACKET_SIZE = int(_SAMPLE_RATE * _PACKET_DURATION_MS / 1000) * 2
+_TTS_CHUNK_PACKETS = 5  # TTS sends the bot voice by chunks of 100 ms
+_USER_TALK_SEC = 1.5  # Duration of each user sentence, followed by the same silence
+
+
+class LevelResultModel(BaseModel):
+    calls: int
+    dropped: int
+    frames: int
+    missed: int
+    p50_ms: float
+    p99_ms: float
+
+    @property
+    def loss_rate(self) -> float:
+        return (self.dropped + self.missed) / self.frames if self.frames else 0
+
+
+class _CallResultModel(BaseModel):
+    dropped: int = 0
+    frames: int = 0
+    latencies: list[float] = []
+    missed: int = 0
+
+
+def _load_pcm(path: Path) -> np.ndarray:
+    """
+    Load a WAV fixture as PCM 16-bit, 16 kHz, 1 channel.
+    """
+    with wave.open(str(path), "rb") as f:
+        if (
+            f.getframerate() != _SAMPLE_RATE
+            or f.getnchannels() != 1
+            or f.getsampwidth() != 2  # noqa: PLR2004
+        ):
+            raise ValueError(f"Fixture {path} must be PCM 16-bit, 16 kHz, 1 channel")
+        return np.frombuffer(f.readframes(f.getnframes()), dtype=np.int16)
+
+
+def _synthetic_voice(duration_sec: float) -> np.ndarray:
+    """
+    Generate a voice-like signal, sentences of harmonics with a syllable rhythm.
+    """
+    t = np.arange(int(duration_sec * _SAMPLE_RATE)) / _SAMPLE_RATE
+    pitch = 140 + 20 * np.sin(2 * np.pi * 0.7 * t)
+    phase = 2 * np.pi * np.cumsum(pitch) / _SAMPLE_RATE
+    voice = sum(np.sin(k * phase) / k for k in range(1, 8))
+    syllables = 0.5 + 0.5 * np.sin(2 * np.pi * 4 * t)
+    sentences = (t % (2 * _USER_TALK_SEC)) < _USER_TALK_SEC
+    return (voice * syllables * sentences * 3000).astype(np.int16)
+
+
+def _build_tracks(
+    bot: np.ndarray,
+    user: np.ndarray,
+    delay_ms: int,
+    duration_sec: float,
+) -> tuple[bytes, bytes]:
+    """
+    Build the bot voice and the phone input of a call.
+
+    Bot repeats its answer with a pause, phone input is the user voice mixed with a delayed echo of the bot.
+
+    Returns a tuple with the bot and the phone audio, in PCM 16-bit.
+    """
+    length = int(duration_sec * _SAMPLE_RATE)
+    length -= length % (_PACKET_SIZE // 2)
+
+    # Bot answers, separated by a pause
+    answer = np.concatenate([bot, np.zeros(_BOT_PAUSE_SEC * _SAMPLE_RATE, np.int16)])
+    bot_track = np.resize(answer, length)
+
+    # User voice with the echo
+    delay = int(delay_ms / 1000 * _SAMPLE_RATE)
+    echo = np.concatenate([np.zeros(delay), bot_track[: length - delay]])
+    mic_track = np.clip(
+        np.resize(user, length).astype(np.float32) + echo * _ECHO_GAIN,
+        -32768,
+        32767,
+    ).astype(np.int16)
+
+    return bot_track.tobytes(), mic_track.tobytes()
+
+
+async def _run_call(
+    bot_pcm: bytes,
+    mic_pcm: bytes,
+    start_offset_sec: float,
+) -> _CallResultModel:
+    """
+    Replay a call through the same queues and consumers as the Communication Services websocket.
+
+    Audio is sent in real time. Latency of a frame is measured from its push in the input queue to its pull by the VAD.
+    """
+    drained = asyncio.Event()
+    res = _CallResultModel()
+    sent: deque[float] = deque()
+
+    # Same queues as the websocket handler and the LLM chat
+    audio_in: AudioQueue[bytes] = AudioQueue(
+        maxsize=CONFIG.audio.queue.in_max_size,
+        name="in",
+    )
+    audio_out: asyncio.Queue[bytes | bool] = asyncio.Queue(
+        maxsize=CONFIG.audio.queue.out_max_size,
+    )
+    audio_tts: AudioQueue[bytes] = AudioQueue(name="tts")
+
+    call = CallStateModel(
+        initiate=CallInitiateModel(
+            **CONFIG.conversation.initiate.model_dump(),
+            phone_number="+33612345678",  # pyright: ignore
+        ),
+        voice_id="dummy",
+    )
+
+    async def _consume_out() -> None:
+        """
+        Consume the audio sent to the phone, like the websocket sender.
+        """
+        while True:
+            await audio_out.get()
+            audio_out.task_done()
+
+    async with (
+        Scheduler() as scheduler,
+        AECStream(
+            in_raw_queue=audio_in,
+            in_reference_queue=audio_tts,
+            out_queue=audio_out,
+            sample_rate=_SAMPLE_RATE,
+            scheduler=scheduler,
+        ) as aec,
+    ):
+        # STT is not started, audio is only written to its input stream
+        stt_client = SttClient(
+            call=call,
+            sample_rate=_SAMPLE_RATE,
+            scheduler=scheduler,
+        )
+
+        async def _pull_audio() -> tuple[bytes, bool]:
+            """
+            Pull processed audio and measure the frame latency.
+            """
+            dropped = aec.dropped
+            packet = await aec.pull_audio()
+            if aec.dropped == dropped and sent:
+                res.latencies.append(time.monotonic() - sent.popleft())
+                if not sent:
+                    drained.set()
+            return packet
+
+        consumer_tasks = [
+            asyncio.create_task(_consume_out()),
+            asyncio.create_task(
+                _process_audio_for_vad(
+                    call=call,
+                    in_callback=_pull_audio,
+                    out_callback=stt_client.push_audio,
+                    response_callback=AsyncMock(),
+                    stop_callback=AsyncMock(),
+                    timeout_callback=AsyncMock(),
+                )
+            ),
+        ]
+
+        # Spread the calls in the packet duration, like independent phone lines
+        await asyncio.sleep(start_offset_sec)
+
+        # Send packets in real time
+        tts_chunk_size = _PACKET_SIZE * _TTS_CHUNK_PACKETS
+        start = time.monotonic()
+        for i, offset in enumerate(range(0, len(mic_pcm), _PACKET_SIZE)):
+            await asyncio.sleep(
+                max(0, start + i * _PACKET_DURATION_MS / 1000 - time.monotonic())
+            )
+
+            # Bot voice, sent by the TTS ahead of the playback
+            if offset % tts_chunk_size == 0:
+                tts_chunk = bot_pcm[offset : offset + tts_chunk_size]
+                if any(tts_chunk):
+                    await audio_tts.put(tts_chunk)
+
+            # Phone input
+            sent.append(time.monotonic())
+            await audio_in.put(mic_pcm[offset : offset + _PACKET_SIZE])
+            res.frames += 1
+
+        # Let the last frames be processed
+        drained.clear()
+        if sent:
+            with suppress(TimeoutError):
+                await asyncio.wait_for(
+                    drained.wait(),
+                    timeout=_PACKET_DURATION_MS / 1000 * 5,
+                )
+
+        # Count before stopping, the VAD would report the end of the stream as dropped frames
+        res.dropped = aec.dropped + audio_in.dropped
+        res.missed = aec.missed
+        for task in consumer_tasks:
+            task.cancel()
+
+    return res
+
+
+async def _run_level(
+    bot_pcm: bytes,
+    mic_pcm: bytes,
+    calls: int,
+) -> LevelResultModel:
+    """
+    Run concurrent calls and aggregate the results.
+    """
+    results = await asyncio.gather(
+        *[
+            _run_call(
+                bot_pcm=bot_pcm,
+                mic_pcm=mic_pcm,
+                start_offset_sec=random.uniform(0, _PACKET_DURATION_MS / 1000),
+            )
+            for _ in range(calls)
+        ]
+    )
+    latencies = np.array([latency for res in results for latency in res.latencies])
+    return LevelResultModel(
+        calls=calls,
+        dropped=sum(res.dropped for res in results),
+        frames=sum(res.frames for res in results),
+        missed=sum(res.missed for res in results),
+        p50_ms=float(np.percentile(latencies, 50) * 1000) if latencies.size else 0,
+        p99_ms=float(np.percentile(latencies, 99) * 1000) if latencies.size else 0,
+    )
+
+
+async def main() -> int:
+    """
+    Benchmark the real-time audio path, without Communication Services.
+
+    Recorded fixtures are replayed with a synthetic echo through the echo cancellation, the voice activity detection and the speech-to-text input. Concurrent calls are doubled until the SLO is breached: 99th percentile of the frame latency above the packet duration, or more than 1% of the frames dropped or missed.
+
+    Returns the exit code, 1 if the maximum calls is below `--min-calls`.
+    """
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument(
+        "--bot",
+        default=Path(__file__).parent.parent / "public" / "loading.wav",
+        help="Bot voice fixture, WAV PCM 16-bit 16 kHz mono",
+        type=Path,
+    )
+    parser.add_argument(
+        "--user",
+        default=None,
+        help="User voice fixture, WAV PCM 16-bit 16 kHz mono, synthetic if not set",
+        type=Path,
+    )
+    parser.add_argument(
+        "--delay-ms",
+        default=60,
+        help="Echo delay in milliseconds",
+        type=int,
+    )
+    parser.add_argument(
+        "--duration",
+        default=10,
+        help="Duration of each level in seconds",
+        type=float,
+    )
+    parser.add_argument(
+        "--max-calls",
+        default=256,
+        help="Maximum concurrent calls",
+        type=int,
+    )
+    parser.add_argument(
+        "--min-calls",
+        default=0,
+        help="Fail if the SLO is breached below this number of concurrent calls",
+        type=int,
+    )
+    args = parser.parse_args()
+
+    # Use the default features, App Configuration is not queried
+    features._load(
+        {
+            "phone_silence_timeout_sec": "20",
+            "vad_cutoff_timeout_ms": "250",
+            "vad_silence_timeout_ms": "500",
+            "vad_threshold": "0.5",
+        }
+    )
+
+    # Build the fixtures
+    bot = _load_pcm(args.bot)
+    user = _load_pcm(args.user) if args.user else _synthetic_voice(6)
+    bot_pcm, mic_pcm = _build_tracks(
+        bot=bot,
+        delay_ms=args.delay_ms,
+        duration_sec=args.duration,
+        user=user,
+    )
+
+    # Warm up the process pool, spawning the workers takes longer than the SLO
+    canceller = PooledEchoCanceller(sample_rate=_SAMPLE_RATE)
+    await canceller.process(
+        input_pcm=mic_pcm[:_PACKET_SIZE],
+        reference_pcm=None,
+    )
+    canceller.close()
+
+    # Ramp up the calls
+    cores = 1 + CONFIG.audio.aec.pool_size  # Event loop and pool processes
+    results: list[LevelResultModel] = []
+    calls = 1
+    while calls <= args.max_calls:
+        res = await _run_level(
+            bot_pcm=bot_pcm,
+            calls=calls,
+            mic_pcm=mic_pcm,
+        )
+        results.append(res)
+        logger.info(
+            "%i calls: p50 %.2f ms, p99 %.2f ms, %i dropped, %i missed, on %i frames",
+            res.calls,
+            res.p50_ms,
+            res.p99_ms,
+            res.dropped,
+            res.missed,
+            res.frames,
+        )
+        if res.p99_ms > _PACKET_DURATION_MS or res.loss_rate > 0.01:  # noqa: PLR2004
+            break
+        calls *= 2
+
+    shutdown_pool()
+
+    # Report
+    passed = [
+        res
+        for res in results
+        if res.p99_ms <= _PACKET_DURATION_MS and res.loss_rate <= 0.01  # noqa: PLR2004
+    ]
+    max_calls = passed[-1].calls if passed else 0
+    print(  # noqa: T201
+        "\n".join(
+            [
+                "| Calls | p50 (ms) | p99 (ms) | Dropped | Missed | Frames |",
+                "|-|-|-|-|-|-|",
+                *[
+                    f"| {res.calls} | {res.p50_ms:.2f} | {res.p99_ms:.2f} | {res.dropped} | {res.missed} | {res.frames} |"
+                    for res in results
+                ],
+                "",
+                f"Max concurrent calls within SLO: {max_calls} ({max_calls / cores:.1f} per core, with {cores} cores)",
+            ]
+        )
+    )
+    return 1 if max_calls < args.min_calls else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
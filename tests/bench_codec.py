@@ -0,0 +1,197 @@
+import argparse
+import json
+import sys
+import time
+from base64 import b64decode, b64encode
+from collections.abc import Callable
+from typing import Any
+
+import numpy as np
+from pydantic import BaseModel
+
+from app.helpers.audio_codec import AudioEncoder, decode_audio
+from app.helpers.config import CONFIG
+
+_PACKET_DURATION_MS = 20
+_SAMPLE_RATE = 16000
+_PACKET_SIZE = int(_SAMPLE_RATE * _PACKET_DURATION_MS / 1000) * 2
+_TTS_CHUNK_PACKETS = 5  # TTS sends the bot voice by chunks of 100 ms
+
+
+class PathResultModel(BaseModel):
+    frames: int
+    frames_per_sec: float
+    messages: int
+    path: str
+
+
+def _legacy_decode(message: str) -> bytes | None:
+    """
+    Decode an inbound media message, like the previous websocket consumer.
+    """
+    event = json.loads(message)
+    if "kind" not in event or event["kind"] != "AudioData":
+        return None
+    audio_data: dict[str, Any] = event.get("audioData", {})
+    audio_base64: str | None = audio_data.get("data", None)
+    audio_silent: bool | None = audio_data.get("silent", True)
+    if audio_silent or not audio_base64:
+        return None
+    return b64decode(audio_base64)
+
+
+def _legacy_encode(pcm: bytes) -> list[str]:
+    """
+    Encode an outbound media message, like the previous websocket sender with Starlette `send_json`.
+    """
+    return [
+        json.dumps(
+            {
+                "kind": "AudioData",
+                "audioData": {
+                    "data": b64encode(pcm).decode("utf-8"),
+                },
+            },
+            separators=(",", ":"),
+            ensure_ascii=False,
+        )
+    ]
+
+
+def _measure(
+    path: str,
+    func: Callable[[Any], Any],
+    items: list[Any],
+    frames_per_item: int,
+    duration_sec: float,
+) -> PathResultModel:
+    """
+    Run a codec path on the items until the duration is elapsed.
+    """
+    frames = 0
+    messages = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < duration_sec:
+        for item in items:
+            res = func(item)
+            messages += len(res) if isinstance(res, list) else 1
+        frames += len(items) * frames_per_item
+    return PathResultModel(
+        frames=frames,
+        frames_per_sec=frames / (time.perf_counter() - start),
+        messages=messages,
+        path=path,
+    )
+
+
+def main() -> int:
+    """
+    Benchmark the websocket media codec, without Communication Services.
+
+    Inbound messages of 20 ms are decoded, and outbound audio is encoded either by 20 ms packets or by TTS chunks of 100 ms coalesced up to the frame size. The previous path (standard JSON and base64) is compared with the media codec.
+
+    Returns the exit code, always 0.
+    """
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument(
+        "--duration",
+        default=2,
+        help="Duration of each path in seconds",
+        type=float,
+    )
+    args = parser.parse_args()
+
+    # Build the messages, random audio is the worst case for base64
+    rng = np.random.default_rng(0)
+    packets = [
+        rng.integers(-32768, 32767, _PACKET_SIZE // 2, np.int16).tobytes()
+        for _ in range(_TTS_CHUNK_PACKETS * 10)
+    ]
+    inbound = [
+        json.dumps(
+            {
+                "kind": "AudioData",
+                "audioData": {
+                    "data": b64encode(packet).decode("utf-8"),
+                    "participantRawID": "8:acs:00000000-0000-0000-0000-000000000000",
+                    "silent": False,
+                    "timestamp": "2024-11-01T00:00:00.000Z",
+                },
+            }
+        )
+        for packet in packets
+    ]
+    tts_chunks = [
+        b"".join(packets[i : i + _TTS_CHUNK_PACKETS])
+        for i in range(0, len(packets), _TTS_CHUNK_PACKETS)
+    ]
+    encoder = AudioEncoder(
+        frame_max_ms=CONFIG.audio.media.out_frame_max_ms,
+        sample_rate=_SAMPLE_RATE,
+    )
+
+    results = [
+        _measure(
+            duration_sec=args.duration,
+            frames_per_item=1,
+            func=_legacy_decode,
+            items=inbound,
+            path="Inbound, JSON and base64",
+        ),
+        _measure(
+            duration_sec=args.duration,
+            frames_per_item=1,
+            func=decode_audio,
+            items=inbound,
+            path="Inbound, media codec",
+        ),
+        _measure(
+            duration_sec=args.duration,
+            frames_per_item=1,
+            func=_legacy_encode,
+            items=packets,
+            path="Outbound by packet, JSON and base64",
+        ),
+        _measure(
+            duration_sec=args.duration,
+            frames_per_item=1,
+            func=lambda pcm: list(encoder.encode(pcm)),
+            items=packets,
+            path="Outbound by packet, media codec",
+        ),
+        _measure(
+            duration_sec=args.duration,
+            frames_per_item=_TTS_CHUNK_PACKETS,
+            func=_legacy_encode,
+            items=tts_chunks,
+            path="Outbound by TTS chunk, JSON and base64",
+        ),
+        _measure(
+            duration_sec=args.duration,
+            frames_per_item=len(packets),
+            func=lambda chunks: list(encoder.encode(b"".join(chunks))),
+            items=[tts_chunks],
+            path="Outbound coalesced, media codec",
+        ),
+    ]
+
+    # Report
+    print(  # noqa: T201
+        "\n".join(
+            [
+                "| Path | Frames/s | Messages per 1k frames |",
+                "|-|-|-|",
+                *[
+                    f"| {res.path} | {res.frames_per_sec:,.0f} | {res.messages / res.frames * 1000:.0f} |"
+                    for res in results
+                ],
+                "",
+                f"A call needs {1000 / _PACKET_DURATION_MS:.0f} frames/s per direction.",
+            ]
+        )
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,291 @@
+import argparse
+import asyncio
+import sys
+import tempfile
+import time
+from collections.abc import Awaitable, Callable
+from datetime import UTC, datetime
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+from aiojobs import Scheduler
+from pydantic import BaseModel
+
+from app.helpers import features
+from app.helpers.config import CONFIG
+from app.helpers.config_models.cache import MemoryModel
+from app.helpers.config_models.database import SqliteModel
+from app.models.call import CallInitiateModel, CallStateModel
+from app.models.message import MessageModel, PersonaEnum as MessagePersonaEnum
+from app.persistence.istore import IStore
+from app.persistence.sqlite import SqliteStore
+from tests.conftest import CosmosDbStoreMock
+
+_MESSAGE_CONTENT = (
+    "I would like to declare a water damage in my kitchen, it started yesterday"
+    " evening under the sink and the floor is now wet. "
+)  # Around 120 characters, like a spoken sentence
+
+
+class OperationResultModel(BaseModel):
+    count: int
+    latency_p50_ms: float
+    latency_p99_ms: float
+    operation: str
+
+
+class StoreResultModel(BaseModel):
+    bytes_per_turn: float
+    operations: list[OperationResultModel]
+    ops_per_sec: float
+    request_units_per_call: float | None
+    store: str
+
+
+class _Recorder:
+    """
+    Latencies of the store operations, by operation.
+    """
+
+    latencies: dict[str, list[float]]
+
+    def __init__(self):
+        self.latencies = {}
+
+    async def measure(self, operation: str, func: Callable[[], Awaitable[Any]]) -> Any:
+        start = time.perf_counter()
+        res = await func()
+        self.latencies.setdefault(operation, []).append(time.perf_counter() - start)
+        return res
+
+
+async def _lifecycle(
+    db: IStore,
+    phone_number: str,
+    recorder: _Recorder,
+    turns: int,
+) -> None:
+    """
+    Run a call like the application: create, conversation turns, hang up, searches from the UI, and post-call read.
+    """
+    call = CallStateModel(
+        initiate=CallInitiateModel(
+            **CONFIG.conversation.initiate.model_dump(),
+            phone_number=phone_number,  # pyright: ignore
+        ),
+    )
+    await recorder.measure("Create", lambda: db.call_create(call))
+
+    # Conversation, a human and an assistant message per turn
+    async with Scheduler() as scheduler:
+        for _ in range(turns):
+
+            async def _turn() -> None:
+                async with db.call_transac(call=call, scheduler=scheduler):
+                    call.last_interaction_at = datetime.now(UTC)
+                    call.messages += [
+                        MessageModel(
+                            content=_MESSAGE_CONTENT,
+                            persona=MessagePersonaEnum.HUMAN,
+                        ),
+                        MessageModel(
+                            content=_MESSAGE_CONTENT,
+                            persona=MessagePersonaEnum.ASSISTANT,
+                        ),
+                    ]
+
+            await recorder.measure("Turn", _turn)
+
+        # Hang up, pending changes are written
+        await recorder.measure("Flush", lambda: db.call_flush(call))
+
+    # Searches
+    await recorder.measure(
+        "Search one",
+        lambda: db.call_search_one(
+            callback_timeout=False,
+            phone_number=phone_number,
+        ),
+    )
+    await recorder.measure(
+        "Search summaries",
+        lambda: db.call_search_summaries(
+            count=10,
+            phone_number=phone_number,
+        ),
+    )
+
+    # Post-call read, a while after the call so not from the cache
+    await db._cache.delete(db._cache_key_call_id(call.call_id))
+
+    async def _read() -> None:
+        remote = await db.call_get(call.call_id)
+        assert remote
+        await db.call_load_messages(remote)
+
+    await recorder.measure("Post-call read", _read)
+
+
+async def _measure(  # noqa: PLR0913
+    calls: int,
+    db: IStore,
+    sent_bytes: Callable[[], int],
+    store: str,
+    turns: int,
+    request_units: Callable[[], float] | None = None,
+) -> StoreResultModel:
+    """
+    Run the calls concurrently on a store.
+    """
+    recorder = _Recorder()
+    sent_bytes_start = sent_bytes()
+    start = time.perf_counter()
+    await asyncio.gather(
+        *[
+            _lifecycle(
+                db=db,
+                phone_number=f"+336{i:08d}",
+                recorder=recorder,
+                turns=turns,
+            )
+            for i in range(calls)
+        ]
+    )
+    duration_sec = time.perf_counter() - start
+
+    return StoreResultModel(
+        bytes_per_turn=(sent_bytes() - sent_bytes_start) / (calls * turns),
+        operations=[
+            OperationResultModel(
+                count=len(latencies),
+                latency_p50_ms=float(np.percentile(latencies, 50)) * 1000,
+                latency_p99_ms=float(np.percentile(latencies, 99)) * 1000,
+                operation=operation,
+            )
+            for operation, latencies in recorder.latencies.items()
+        ],
+        ops_per_sec=sum(len(latencies) for latencies in recorder.latencies.values())
+        / duration_sec,
+        request_units_per_call=request_units() / calls if request_units else None,
+        store=store,
+    )
+
+
+async def _run(calls: int, latency_ms: float, turns: int) -> list[StoreResultModel]:
+    """
+    Run the lifecycle on each store.
+    """
+    results: list[StoreResultModel] = []
+
+    # Use the default features, App Configuration is not queried
+    features._load({"callback_timeout_hour": "3"})
+
+    # Cosmos DB, local container with the network latency
+    cosmos_db = CosmosDbStoreMock(latency_sec=latency_ms / 1000)
+    results.append(
+        await _measure(
+            calls=calls,
+            db=cosmos_db,
+            request_units=lambda: cosmos_db.container.request_units,
+            sent_bytes=lambda: cosmos_db.container.sent_bytes,
+            store=f"Cosmos DB (local, {latency_ms:g} ms)",
+            turns=turns,
+        )
+    )
+
+    # SQLite, in a temporary file
+    with tempfile.TemporaryDirectory() as folder:
+        sqlite = SqliteStore(
+            cache=MemoryModel().instance,
+            config=SqliteModel(path=str(Path(folder) / "calls.db")),
+        )
+        await sqlite.readiness()  # Open the database
+
+        # Count the statements sent, with their parameters
+        statements_bytes = 0
+
+        def _trace(statement: str) -> None:
+            nonlocal statements_bytes
+            if statement.startswith(("INSERT", "UPDATE")):
+                statements_bytes += len(statement.encode("utf-8"))
+
+        assert sqlite._connection
+        sqlite._connection.set_trace_callback(_trace)
+
+        results.append(
+            await _measure(
+                calls=calls,
+                db=sqlite,
+                sent_bytes=lambda: statements_bytes,
+                store="SQLite",
+                turns=turns,
+            )
+        )
+
+    return results
+
+
+def main() -> int:
+    """
+    Benchmark the stores, without Azure.
+
+    Calls are run concurrently through their lifecycle: creation, conversation turns, hang up, searches, and post-call read. Cosmos DB is a local container with a random latency, its request units are estimated from the document sizes. SQLite is a temporary file.
+
+    Returns the exit code, always 0.
+    """
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument(
+        "--calls",
+        default=20,
+        help="Number of concurrent calls",
+        type=int,
+    )
+    parser.add_argument(
+        "--latency-ms",
+        default=10,
+        help="Maximum latency of a Cosmos DB request in milliseconds",
+        type=float,
+    )
+    parser.add_argument(
+        "--turns",
+        default=30,
+        help="Number of conversation turns per call",
+        type=int,
+    )
+    args = parser.parse_args()
+
+    results = asyncio.run(
+        _run(
+            calls=args.calls,
+            latency_ms=args.latency_ms,
+            turns=args.turns,
+        )
+    )
+
+    # Report
+    print(  # noqa: T201
+        "\n".join(
+            [
+                "| Store | Ops/s | Bytes per turn | RU per call |",
+                "|-|-|-|-|",
+                *[
+                    f"| {res.store} | {res.ops_per_sec:,.0f} | {res.bytes_per_turn:,.0f} | {f'{res.request_units_per_call:,.0f}' if res.request_units_per_call is not None else '-'} |"
+                    for res in results
+                ],
+                "",
+                "| Store | Operation | Count | Latency p50 (ms) | Latency p99 (ms) |",
+                "|-|-|-|-|-|",
+                *[
+                    f"| {res.store} | {operation.operation} | {operation.count} | {operation.latency_p50_ms:.2f} | {operation.latency_p99_ms:.2f} |"
+                    for res in results
+                    for operation in res.operations
+                ],
+            ]
+        )
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,8 +1,13 @@
+import asyncio
+
 import pytest
 from pytest_assume.plugin import assume
 
+from app.helpers.cache import single_flight
 from app.helpers.config import CONFIG
-from app.helpers.config_models.cache import ModeEnum as CacheModeEnum
+from app.helpers.config_models.cache import MemoryModel, ModeEnum as CacheModeEnum
+from app.persistence.memory import MemoryCache
+from tests.conftest import RedisServerMock, TieredCacheMock
 
 
 @pytest.mark.parametrize(
@@ -56,3 +61,186 @@ async def test_acid(
 
     # Check point read
     assume(await cache.get(test_key) == test_value.encode())
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_memory_eviction() -> None:
+    """
+    Test the memory cache evicts by size and expiration.
+
+    Steps:
+    1. Fill a cache up to its size
+    2. Read the first item, set another one, check the least recently used is evicted
+    3. Check a value larger than the cache is not stored
+    4. Set an expired item, check it is removed
+    5. Check the counters
+    """
+    cache = MemoryCache(MemoryModel(max_bytes=1024))
+    value = "x" * 250
+
+    # Fill the cache, 4 items of 256 bytes
+    for i in range(4):
+        assume(await cache.set(key=f"key-{i:02d}", ttl_sec=60, value=value))
+    assume(cache.size == 1024)  # noqa: PLR2004
+
+    # Evict the least recently used
+    assume(await cache.get("key-00"))
+    await cache.set(key="key-04", ttl_sec=60, value=value)
+    assume(await cache.get("key-00"))
+    assume(not await cache.get("key-01"))
+    assume(cache.evictions == 1)
+    assume(cache.size == 1024)  # noqa: PLR2004
+
+    # Too large
+    assume(not await cache.set(key="key-large", ttl_sec=60, value="x" * 2048))
+    assume(not await cache.get("key-large"))
+
+    # Expired, removed on next use
+    await cache.set(key="key-expired", ttl_sec=0, value="lorem ipsum")
+    assume(not await cache.get("key-expired"))
+    assume(cache.evictions == 1)
+    assume(cache.size == 1024)  # noqa: PLR2004
+
+    # Counters
+    assume(cache.hits == 2)  # noqa: PLR2004
+    assume(cache.misses == 3)  # noqa: PLR2004
+
+
+@pytest.mark.parametrize(
+    "cache_mode",
+    [
+        pytest.param(
+            CacheModeEnum.MEMORY,
+            id="memory",
+        ),
+        pytest.param(
+            CacheModeEnum.REDIS,
+            id="redis",
+        ),
+    ],
+)
+@pytest.mark.asyncio(loop_scope="session")
+async def test_many(
+    cache_mode: CacheModeEnum,
+    random_text: str,
+) -> None:
+    """
+    Test the batched reads and writes of the cache backend.
+
+    Steps:
+    1. Create mock data, with a missing key
+    2. Insert test data in a single request
+    3. Check the values are read in order, in a single request
+    """
+    # Set cache mode
+    CONFIG.cache.mode = cache_mode
+    cache = CONFIG.cache.instance
+
+    # Init values
+    test_items = {f"{random_text}-{i}": f"lorem ipsum {i}" for i in range(3)}
+
+    # Insert test values
+    assume(await cache.set_many(items=test_items, ttl_sec=60))
+
+    # Check batched read, with a missing key
+    assume(
+        await cache.get_many([*test_items, f"{random_text}-missing"])
+        == [*[value.encode() for value in test_items.values()], None]
+    )
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_tiered_invalidation(random_text: str) -> None:
+    """
+    Test the tiered cache drops the memory copies changed by the other workers.
+
+    Steps:
+    1. Create two tiered caches, on the same local Redis server
+    2. Read a value from the second cache, it is kept in memory
+    3. Update the value from the first cache, check the second reads the new value
+    4. Update values in a batch from the first cache, check the second reads the new values
+    5. Delete the value from the first cache, check the second does not read it
+    6. Change a value in Redis without invalidation, check the second reads its memory copy
+    7. Lose the subscription, check the second cache memory is cleared
+    """
+    server = RedisServerMock()
+    writer = TieredCacheMock(server)
+    reader = TieredCacheMock(server)
+    keys = [f"{random_text}-{i}" for i in range(3)]
+
+    # Read, kept in memory
+    await writer.set(key=keys[0], ttl_sec=60, value="lorem")
+    assume(await reader.get(keys[0]) == b"lorem")
+    await asyncio.sleep(0.1)  # Let the subscriber start
+
+    # Update
+    await writer.set(key=keys[0], ttl_sec=60, value="ipsum")
+    await asyncio.sleep(0.1)  # Let the subscriber drop the memory copy
+    assume(await reader.get(keys[0]) == b"ipsum")
+
+    # Update in a batch
+    assume(await reader.get_many(keys) == [b"ipsum", None, None])
+    await writer.set_many(
+        items={key: f"dolor {i}" for i, key in enumerate(keys)},
+        ttl_sec=60,
+    )
+    await asyncio.sleep(0.1)
+    assume(await reader.get_many(keys) == [b"dolor 0", b"dolor 1", b"dolor 2"])
+
+    # Delete
+    await writer.delete(keys[0])
+    await asyncio.sleep(0.1)
+    assume(not await reader.get(keys[0]))
+
+    # Change without invalidation, the memory copy is read
+    server.values[keys[1]] = b"sit amet"
+    assume(await reader.get(keys[1]) == b"dolor 1")
+
+    # Lose the subscription, invalidations may have been missed
+    server.disconnect()
+    await asyncio.sleep(0.1)
+    assume(await reader.get(keys[1]) == b"sit amet")
+
+    # Stop the subscribers
+    for cache in (writer, reader):
+        (await cache._use_subscriber()).cancel()
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_single_flight() -> None:
+    """
+    Test concurrent calls with the same arguments run the function once.
+
+    Steps:
+    1. Call a slow function concurrently, with the same arguments
+    2. Check it ran once, and all the callers got its result
+    3. Call it again, check it ran again, as results are not kept
+    4. Check an error is raised to all the callers
+    """
+    runs = 0
+
+    @single_flight()
+    async def _slow(value: str) -> str:
+        nonlocal runs
+        runs += 1
+        await asyncio.sleep(0.1)
+        if not value:
+            raise ValueError("Empty value")
+        return value
+
+    # Concurrent calls
+    res = await asyncio.gather(*[_slow("lorem ipsum") for _ in range(10)])
+    assume(res == ["lorem ipsum"] * 10)
+    assume(runs == 1)
+
+    # Next call
+    await _slow("lorem ipsum")
+    assume(runs == 2)  # noqa: PLR2004
+
+    # Errors
+    res = await asyncio.gather(
+        *[_slow("") for _ in range(10)],
+        return_exceptions=True,
+    )
+    assume(all(isinstance(error, ValueError) for error in res))
+    assume(runs == 3)  # noqa: PLR2004
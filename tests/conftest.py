@@ -1,10 +1,15 @@
+import asyncio
 import hashlib
+import json
 import random
 import string
 import xml.etree.ElementTree as ET
-from collections.abc import Callable
+from collections.abc import AsyncGenerator, Callable, Mapping
+from contextlib import asynccontextmanager
+from copy import deepcopy
 from textwrap import dedent
 from typing import Any
+from uuid import uuid4
 
 import pytest
 import pytest_asyncio
@@ -27,16 +32,24 @@ from azure.communication.callautomation.aio import (
     CallAutomationClient,
     CallConnectionClient,
 )
+from azure.core import MatchConditions
+from azure.cosmos.exceptions import CosmosAccessConditionFailedError
 from azure.identity import DefaultAzureCredential, get_bearer_token_provider
 from deepeval.models.gpt_model import GPTModel
 from langchain_openai import AzureChatOpenAI
 from pydantic import BaseModel, ValidationError
+from redis.exceptions import RedisError
 
 from app.helpers.call_utils import ContextEnum as CallContextEnum
 from app.helpers.config import CONFIG
+from app.helpers.config_models.cache import MemoryModel, RedisModel, TieredModel
+from app.helpers.config_models.database import CosmosDbModel
 from app.helpers.logging import logger
 from app.main import _str_to_contexts
 from app.models.call import CallInitiateModel, CallStateModel
+from app.persistence.cosmos_db import CosmosDbStore
+from app.persistence.redis import RedisCache
+from app.persistence.tiered import TieredCache
 
 
 class CallMediaOperationsMock(CallMediaOperations):
@@ -182,6 +195,355 @@ class SpeechSynthesizerMock(SpeechSynthesizer):
         )
 
 
+_QUERY_RU = 2.5
+_READ_RU_PER_KB = 1
+_WRITE_RU_PER_KB = 5.5
+
+
+def _size(value: Any) -> int:
+    """
+    Get the size of a value, serialized as JSON like by the Cosmos DB SDK.
+    """
+    return len(json.dumps(value, default=str).encode("utf-8"))
+
+
+class CosmosDbQueryMock:
+    """
+    Stand-in of the results of a Cosmos DB query, iterated by item or by page.
+    """
+
+    _items: AsyncGenerator[Any]
+    _page_size: int | None
+
+    def __init__(self, items: AsyncGenerator[Any], page_size: int | None):
+        self._items = items
+        self._page_size = page_size
+
+    def __aiter__(self) -> "CosmosDbQueryMock":
+        return self
+
+    async def __anext__(self) -> Any:
+        return await anext(self._items)
+
+    def by_page(self, continuation_token: str | None = None) -> "CosmosDbPagesMock":
+        return CosmosDbPagesMock(
+            continuation_token=continuation_token,
+            items=self._items,
+            page_size=self._page_size,
+        )
+
+
+class CosmosDbPagesMock:
+    """
+    Stand-in of the pages of a Cosmos DB query.
+
+    Continuation tokens are the number of items already read.
+    """
+
+    continuation_token: str | None
+    _done: bool
+    _items: AsyncGenerator[Any]
+    _page_size: int | None
+    _read: list[Any] | None
+
+    def __init__(
+        self,
+        continuation_token: str | None,
+        items: AsyncGenerator[Any],
+        page_size: int | None,
+    ):
+        self._done = False
+        self._items = items
+        self._page_size = page_size
+        self._read = None
+        self.continuation_token = continuation_token
+
+    def __aiter__(self) -> "CosmosDbPagesMock":
+        return self
+
+    async def __anext__(self) -> AsyncGenerator[Any]:
+        if self._read is None:
+            self._read = [item async for item in self._items]
+        start = int(self.continuation_token or 0)
+        if self._done or start >= len(self._read):
+            raise StopAsyncIteration
+        page = self._read[start : start + (self._page_size or len(self._read))]
+        end = start + len(page)
+        self._done = end >= len(self._read)
+        self.continuation_token = None if self._done else str(end)
+
+        async def _page() -> AsyncGenerator[Any]:
+            for item in page:
+                yield item
+
+        return _page()
+
+
+class CosmosDbContainerMock:
+    """
+    Stand-in of a Cosmos DB container, in memory, with the patch operations and the ETag conditions used by the store.
+
+    Requests are delayed randomly up to `latency_sec`, so concurrent requests interleave. Bytes sent and request units are counted, units are estimated from the document size, like the service: 1 RU per KB read, 5.5 RU per KB written, and 2.5 RU per query plus the KB returned.
+    """
+
+    documents: dict[str, dict[str, Any]]
+    latency_sec: float
+    queries: int
+    request_units: float
+    sent_bytes: int
+
+    def __init__(self, latency_sec: float = 0.005):
+        self.documents = {}
+        self.latency_sec = latency_sec
+        self.queries = 0
+        self.request_units = 0
+        self.sent_bytes = 0
+
+    def query_items(
+        self,
+        query: str,
+        parameters: list[dict[str, Any]],
+        max_item_count: int | None = None,
+        partition_key: str | None = None,  # noqa: ARG002
+    ) -> "CosmosDbQueryMock":
+        """
+        Query the calls, latest first, filtered by ID or phone number, or count them, or query the archives of calls. Other filters are ignored.
+        """
+        self.queries += 1
+        values = {parameter["name"]: parameter["value"] for parameter in parameters}
+
+        async def _items() -> AsyncGenerator[Any]:
+            await self._latency()
+            self.request_units += _QUERY_RU
+            # Archives of one or more calls
+            if "c.archive.call_id" in query:
+                call_ids = values.get("@call_ids") or [values.get("@call_id")]
+                for document in self.documents.values():
+                    if document.get("archive", {}).get("call_id") in call_ids:
+                        self._charge(document, _READ_RU_PER_KB)
+                        yield deepcopy(document["archive"])
+                return
+            calls = [
+                document
+                for document in self.documents.values()
+                if "archive" not in document
+                and ("@id" not in values or document["id"] == values["@id"])
+                and (
+                    not values.get("@phone_number")
+                    or values["@phone_number"]
+                    in (
+                        document["initiate"]["phone_number"],
+                        document["claim"].get("policyholder_phone"),
+                    )
+                )
+            ]
+            # Count calls
+            if "COUNT(1)" in query:
+                yield len(calls)
+                return
+            # Calls
+            for document in sorted(
+                calls,
+                key=lambda document: document["created_at"],
+                reverse=True,
+            )[: values.get("@count")]:
+                self._charge(document, _READ_RU_PER_KB)
+                # Summary projection
+                if "AS synthesis_short" in query:
+                    yield {
+                        "call_id": document["id"],
+                        "created_at": document["created_at"],
+                        "in_progress": document.get("in_progress"),
+                        "phone_number": document["initiate"]["phone_number"],
+                        "synthesis_short": (document.get("synthesis") or {}).get(
+                            "short"
+                        ),
+                    }
+                else:
+                    yield deepcopy(document)
+
+        return CosmosDbQueryMock(items=_items(), page_size=max_item_count)
+
+    async def create_item(self, body: dict[str, Any]) -> dict[str, Any]:
+        await self._latency()
+        self.sent_bytes += _size(body)
+        self.documents[body["id"]] = {**deepcopy(body), "_etag": str(uuid4())}
+        self._charge(body, _WRITE_RU_PER_KB)
+        return deepcopy(self.documents[body["id"]])
+
+    async def upsert_item(self, body: dict[str, Any]) -> dict[str, Any]:
+        await self._latency()
+        self.sent_bytes += _size(body)
+        self.documents[body["id"]] = {**deepcopy(body), "_etag": str(uuid4())}
+        self._charge(body, _WRITE_RU_PER_KB)
+        return deepcopy(self.documents[body["id"]])
+
+    async def read_item(self, item: str, partition_key: str) -> dict[str, Any]:  # noqa: ARG002
+        await self._latency()
+        self._charge(self.documents[item], _READ_RU_PER_KB)
+        return deepcopy(self.documents[item])
+
+    async def patch_item(
+        self,
+        item: str,
+        partition_key: str,  # noqa: ARG002
+        patch_operations: list[dict[str, Any]],
+        etag: str | None = None,
+        match_condition: MatchConditions | None = None,
+    ) -> dict[str, Any]:
+        await self._latency()
+        self.sent_bytes += _size(patch_operations)
+
+        # Check the condition and apply atomically, like the service
+        document = self.documents[item]
+        if (
+            match_condition == MatchConditions.IfNotModified
+            and etag != document["_etag"]
+        ):
+            raise CosmosAccessConditionFailedError(status_code=412)
+        for operation in patch_operations:
+            field = operation["path"].split("/")[1]
+            if operation["op"] == "add":
+                document[field].append(deepcopy(operation["value"]))
+            else:
+                document[field] = deepcopy(operation["value"])
+        document["_etag"] = str(uuid4())
+        self._charge(
+            document, _WRITE_RU_PER_KB
+        )  # Patches are charged on the whole document
+        return deepcopy(document)
+
+    def _charge(self, document: Any, units_per_kb: float) -> None:
+        self.request_units += units_per_kb * max(1, _size(document) / 1024)
+
+    async def _latency(self) -> None:
+        await asyncio.sleep(random.uniform(0, self.latency_sec))
+
+
+class CosmosDbStoreMock(CosmosDbStore):
+    """
+    Cosmos DB store using a local container.
+    """
+
+    container: CosmosDbContainerMock
+
+    def __init__(
+        self,
+        latency_sec: float = 0.005,
+        messages_window: int | None = None,
+    ):
+        super().__init__(
+            cache=MemoryModel().instance,
+            config=CosmosDbModel(
+                container="local",
+                database="local",
+                endpoint="http://localhost",
+                messages_window=messages_window,
+                write_behind_ms=0,
+            ),
+        )
+        self.container = CosmosDbContainerMock(latency_sec=latency_sec)
+
+    @asynccontextmanager
+    async def _use_client(self) -> AsyncGenerator[Any]:  # pyright: ignore
+        yield self.container
+
+
+class RedisServerMock:
+    """
+    Local Redis server, with values and channels, shared by the caches of several workers.
+
+    Expirations are ignored.
+    """
+
+    subscribers: list[tuple[str, asyncio.Queue[bytes | None]]]
+    values: dict[str, bytes]
+
+    def __init__(self):
+        self.subscribers = []
+        self.values = {}
+
+    def disconnect(self) -> None:
+        """
+        Drop the subscriptions, as if the connections were lost.
+        """
+        for _, queue in self.subscribers:
+            queue.put_nowait(None)
+
+
+class RedisCacheMock(RedisCache):
+    """
+    Redis cache using a local server.
+    """
+
+    server: RedisServerMock
+
+    def __init__(self, server: RedisServerMock):
+        super().__init__(RedisModel(host="localhost"))
+        self.server = server
+
+    async def get(self, key: str) -> bytes | None:
+        return self.server.values.get(key)
+
+    async def set(
+        self,
+        key: str,
+        ttl_sec: int,  # noqa: ARG002
+        value: str | bytes | None,
+    ) -> bool:
+        self.server.values[key] = (
+            value.encode() if isinstance(value, str) else value or b""
+        )
+        return True
+
+    async def get_many(self, keys: list[str]) -> list[bytes | None]:
+        return [self.server.values.get(key) or None for key in keys]
+
+    async def set_many(
+        self,
+        items: Mapping[str, str | bytes | None],
+        ttl_sec: int,
+    ) -> bool:
+        for key, value in items.items():
+            await self.set(key=key, ttl_sec=ttl_sec, value=value)
+        return True
+
+    async def delete(self, key: str) -> bool:
+        self.server.values.pop(key, None)
+        return True
+
+    async def publish(self, channel: str, message: str) -> bool:
+        for subscribed, queue in self.server.subscribers:
+            if subscribed == channel:
+                queue.put_nowait(message.encode())
+        return True
+
+    async def subscribe(self, channel: str) -> AsyncGenerator[bytes]:
+        subscriber = (channel, asyncio.Queue())
+        self.server.subscribers.append(subscriber)
+        try:
+            while True:
+                message = await subscriber[1].get()
+                if message is None:
+                    raise RedisError("Connection lost")
+                yield message
+        finally:
+            self.server.subscribers.remove(subscriber)
+
+
+class TieredCacheMock(TieredCache):
+    """
+    Tiered cache using a local Redis server.
+    """
+
+    def __init__(self, server: RedisServerMock):
+        super().__init__(
+            config=TieredModel(),
+            redis=RedisModel(host="localhost"),
+        )
+        self._l2 = RedisCacheMock(server)
+
+
 class DeepEvalAzureOpenAI(GPTModel):
     _cache: pytest.Cache
     _langchain_kwargs: dict[str, Any]
@@ -1,9 +1,23 @@
+import asyncio
+import json
+import sqlite3
+from contextlib import closing
+from pathlib import Path
+from typing import Any
+from uuid import uuid4
+
 import pytest
 from aiojobs import Scheduler
 from pytest_assume.plugin import assume
 
 from app.helpers.config import CONFIG
-from app.models.call import CallStateModel
+from app.helpers.config_models.cache import MemoryModel
+from app.helpers.config_models.database import SqliteModel
+from app.models.call import CallGetModel, CallInitiateModel, CallStateModel
+from app.models.message import MessageModel, PersonaEnum as MessagePersonaEnum
+from app.models.readiness import ReadinessEnum
+from app.persistence.sqlite import SqliteStore
+from tests.conftest import CosmosDbStoreMock
 
 
 @pytest.mark.asyncio(loop_scope="session")
@@ -101,6 +115,538 @@ async def test_transaction(
         # Check first string change
         assume(call.voice_id == random_text)
 
+        # Write the pending changes
+        await db.call_flush(call)
+
         # Check point read
         new_call = await db.call_get(call.call_id)
         assume(new_call and new_call.voice_id == random_text and new_call.in_progress)
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_write_behind(
+    call: CallStateModel,
+    random_text: str,
+) -> None:
+    """
+    Test the transactions of a call are written in order.
+
+    Steps:
+    1. Insert a call
+    2. Append messages and edit a field in consecutive transactions
+    3. Replace the messages, then append a message
+    4. Write the pending changes
+    5. Check the point read has all the changes, in order
+    """
+    db = CONFIG.database.instance
+
+    async with Scheduler() as scheduler:
+        # Insert call
+        await db.call_create(call)
+
+        # Consecutive changes, merged in a single write
+        for i in range(3):
+            async with db.call_transac(
+                call=call,
+                scheduler=scheduler,
+            ):
+                call.messages.append(
+                    MessageModel(
+                        content=f"{random_text} {i}",
+                        persona=(
+                            MessagePersonaEnum.HUMAN
+                            if i % 2
+                            else MessagePersonaEnum.ASSISTANT
+                        ),
+                    )
+                )
+                call.voice_id = f"{random_text} {i}"
+
+        # Replace, then append
+        async with db.call_transac(
+            call=call,
+            scheduler=scheduler,
+        ):
+            call.messages.pop(0)
+        async with db.call_transac(
+            call=call,
+            scheduler=scheduler,
+        ):
+            call.messages.append(
+                MessageModel(
+                    content=random_text,
+                    persona=MessagePersonaEnum.HUMAN,
+                )
+            )
+        expected = [message.content for message in call.messages]
+
+        # Write the pending changes
+        await db.call_flush(call)
+
+        # Check point read
+        new_call = await db.call_get(call.call_id)
+        assume(new_call and new_call.voice_id == f"{random_text} 2")
+        assume(
+            new_call and [message.content for message in new_call.messages] == expected
+        )
+
+
+@pytest.mark.parametrize(
+    "store",
+    [
+        "cosmos_db",
+        "sqlite",
+    ],
+)
+@pytest.mark.asyncio(loop_scope="session")
+@pytest.mark.repeat(10)  # Catch multi-threading and concurrency issues
+async def test_concurrent_transactions(store: str, tmp_path: Path) -> None:
+    """
+    Test concurrent transactions on the same call do not lose changes.
+
+    Steps:
+    1. Create a call with two messages, in a local store
+    2. Run dozens of workers concurrently, each with its own copy of the call, like parallel events
+    3. Most workers append a message, some remove the first message, which is rebased on conflict
+    4. Check all the appended messages are stored, and the first message is removed
+    """
+    db = (
+        CosmosDbStoreMock()
+        if store == "cosmos_db"
+        else SqliteStore(
+            cache=MemoryModel().instance,
+            config=SqliteModel(path=str(tmp_path / "calls.db")),
+        )
+    )
+    workers = 32
+
+    # Create the call
+    call = CallStateModel(
+        initiate=CallInitiateModel(
+            **CONFIG.conversation.initiate.model_dump(),
+            phone_number="+33612345678",  # pyright: ignore
+        ),
+        messages=[
+            MessageModel(
+                content="first",
+                persona=MessagePersonaEnum.ASSISTANT,
+            ),
+            MessageModel(
+                content="second",
+                persona=MessagePersonaEnum.HUMAN,
+            ),
+        ],
+    )
+    await db.call_create(call)
+
+    async def _worker(index: int, scheduler: Scheduler) -> None:
+        worker_call = call.model_copy(deep=True)
+        async with db.call_transac(
+            call=worker_call,
+            scheduler=scheduler,
+        ):
+            # Remove the first message
+            if index % 8 == 0:
+                worker_call.messages.pop(0)
+            # Append a message
+            else:
+                worker_call.messages.append(
+                    MessageModel(
+                        content=f"worker {index}",
+                        persona=MessagePersonaEnum.HUMAN,
+                    )
+                )
+        await db.call_flush(worker_call)
+
+    async with Scheduler() as scheduler:
+        await asyncio.gather(*[_worker(index, scheduler) for index in range(workers)])
+
+    # Check messages, from the stored document as consecutive messages are merged when parsed
+    if isinstance(db, CosmosDbStoreMock):
+        document = db.container.documents[str(call.call_id)]
+    else:
+        with closing(sqlite3.connect(tmp_path / "calls.db")) as connection:
+            (data,) = connection.execute(
+                "SELECT data FROM calls WHERE call_id = ?",
+                (str(call.call_id),),
+            ).fetchone()
+        document = json.loads(data)
+    contents = [message["content"] for message in document["messages"]]
+    assume("first" not in contents)
+    assume("second" in contents)
+    assume(
+        sorted(content for content in contents if content.startswith("worker "))
+        == sorted(f"worker {index}" for index in range(workers) if index % 8)
+    )
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_sqlite(random_text: str, tmp_path: Path) -> None:
+    """
+    Test the SQLite store, without network.
+
+    Steps:
+    1. Create calls for two phone numbers
+    2. Check point read and searches, by phone number and policyholder phone
+    3. Check the summaries, by pages
+    4. Patch a call, appending a message and editing fields
+    5. Check the point read has the changes
+    """
+    db = SqliteStore(
+        cache=MemoryModel().instance,
+        config=SqliteModel(path=str(tmp_path / "calls.db")),
+    )
+    assume(await db.readiness() == ReadinessEnum.OK)
+
+    # Create calls
+    calls = [
+        CallStateModel(
+            initiate=CallInitiateModel(
+                **CONFIG.conversation.initiate.model_dump(),
+                phone_number=phone_number,  # pyright: ignore
+            ),
+        )
+        for phone_number in ("+33612345678", "+33612345678", "+33687654321")
+    ]
+    for call in calls:
+        await db.call_create(call)
+    call = calls[1]
+
+    # Check point read
+    assume(await db.call_get(call.call_id) == call)
+    assume(not await db.call_get(uuid4()))
+    # Check search one, the last call
+    assume(await db.call_search_one(call.initiate.phone_number) == call)
+    assume(not await db.call_search_one("+33600000000"))
+    # Check search all
+    found, total = await db.call_search_all(
+        count=1,
+        phone_number=call.initiate.phone_number,
+    )
+    assume(found == [call])
+    assume(total == 2)  # noqa: PLR2004
+    _, total = await db.call_search_all(count=10)
+    assume(total == 3)  # noqa: PLR2004
+    # Check summaries, by pages
+    first_page, total, continuation = await db.call_search_summaries(count=2)
+    assume(total == 3)  # noqa: PLR2004
+    assume(first_page and len(first_page) == 2)  # noqa: PLR2004
+    assume(continuation)
+    last_page, _, continuation = await db.call_search_summaries(
+        continuation=continuation,
+        count=2,
+    )
+    assume(last_page and len(last_page) == 1)
+    assume(not continuation)
+    assume(
+        {summary.call_id for summary in [*(first_page or []), *(last_page or [])]}
+        == {call.call_id for call in calls}
+    )
+
+    # Patch
+    async with Scheduler() as scheduler:
+        async with db.call_transac(
+            call=call,
+            scheduler=scheduler,
+        ):
+            call.messages.append(
+                MessageModel(
+                    content=random_text,
+                    persona=MessagePersonaEnum.HUMAN,
+                )
+            )
+            call.voice_id = random_text
+            call.in_progress = True
+        await db.call_flush(call)
+
+    # Check point read
+    new_call = await db.call_get(call.call_id)
+    assume(new_call == call)
+    assume(new_call and new_call.voice_id == random_text and new_call.in_progress)
+    assume(new_call and new_call.messages[-1].content == random_text)
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_point_read() -> None:
+    """
+    Test a call is read by ID from its partition, without a query.
+
+    Steps:
+    1. Create a call, in a local store which does not support queries
+    2. Evict the call from the cache
+    3. Check the call is read, from the partition index
+    """
+    db = CosmosDbStoreMock()
+
+    # Create the call
+    call = CallStateModel(
+        initiate=CallInitiateModel(
+            **CONFIG.conversation.initiate.model_dump(),
+            phone_number="+33612345678",  # pyright: ignore
+        ),
+    )
+    await db.call_create(call)
+
+    # Evict the call, not the partition index
+    await db._cache.delete(db._cache_key_call_id(call.call_id))
+
+    # Check point read
+    assume(await db.call_get(call.call_id) == call)
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_export(tmp_path: Path) -> None:
+    """
+    Test the export of the calls, by pages, with filters.
+
+    Steps:
+    1. Create more calls than a page, in a local store, for two phone numbers
+    2. Export all the calls, check each call is exported once
+    3. Export with a phone number, check only its calls are exported
+    4. Export with dates, check only the calls in the range are exported
+    """
+    db = SqliteStore(
+        cache=MemoryModel().instance,
+        config=SqliteModel(path=str(tmp_path / "calls.db")),
+    )
+    calls = [
+        CallStateModel(
+            initiate=CallInitiateModel(
+                **CONFIG.conversation.initiate.model_dump(),
+                phone_number="+33612345678" if i % 3 else "+33687654321",  # pyright: ignore
+            ),
+        )
+        for i in range(250)
+    ]
+    for call in calls:
+        await db.call_create(call)
+
+    async def _export(**kwargs: Any) -> list[CallGetModel]:
+        return [call async for page in db.call_export(**kwargs) for call in page]
+
+    # All
+    exported = await _export()
+    assume(
+        sorted(call.call_id for call in exported)
+        == sorted(call.call_id for call in calls)
+    )
+
+    # By phone number
+    exported = await _export(phone_number="+33687654321")
+    assume(
+        sorted(call.call_id for call in exported)
+        == sorted(call.call_id for i, call in enumerate(calls) if not i % 3)
+    )
+
+    # By dates
+    exported = await _export(
+        created_after=calls[10].created_at,
+        created_before=calls[20].created_at,
+    )
+    assume(
+        sorted(call.call_id for call in exported)
+        == sorted(call.call_id for call in calls[10:20])
+    )
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_export_error(tmp_path: Path) -> None:
+    """
+    Test the export raises on a database error, instead of ending as if complete.
+
+    Steps:
+    1. Create more calls than a page, in a local store
+    2. Export the first page
+    3. Drop the calls table
+    4. Check the export raises on the next page
+    """
+    db = SqliteStore(
+        cache=MemoryModel().instance,
+        config=SqliteModel(path=str(tmp_path / "calls.db")),
+    )
+    for _ in range(150):
+        await db.call_create(
+            CallStateModel(
+                initiate=CallInitiateModel(
+                    **CONFIG.conversation.initiate.model_dump(),
+                    phone_number="+33612345678",  # pyright: ignore
+                ),
+            )
+        )
+
+    pages = db.call_export()
+    assume(await anext(pages))
+    with closing(sqlite3.connect(tmp_path / "calls.db")) as connection:
+        connection.execute("DROP TABLE calls")
+    with pytest.raises(sqlite3.Error):
+        await anext(pages)
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_search_cache() -> None:
+    """
+    Test the search total is cached, and invalidated on change.
+
+    Steps:
+    1. Create two calls, in a local store
+    2. Search twice, check the total is counted once
+    3. Create a call, check the total is incremented without counting
+    4. Edit a searched field of a call, check the total by phone number is counted again
+    """
+    db = CosmosDbStoreMock()
+    calls = [
+        CallStateModel(
+            initiate=CallInitiateModel(
+                **CONFIG.conversation.initiate.model_dump(),
+                phone_number="+33612345678",  # pyright: ignore
+            ),
+        )
+        for _ in range(3)
+    ]
+    for call in calls[:2]:
+        await db.call_create(call)
+
+    # Search twice, calls are queried each time, the total once
+    _, total = await db.call_search_all(count=10)
+    assume(total == 2)  # noqa: PLR2004
+    queries = db.container.queries
+    _, total = await db.call_search_all(count=10)
+    assume(total == 2)  # noqa: PLR2004
+    assume(db.container.queries == queries + 1)
+
+    # Create a call
+    await db.call_create(calls[2])
+    queries = db.container.queries
+    _, total = await db.call_search_all(count=10)
+    assume(total == 3)  # noqa: PLR2004
+    assume(db.container.queries == queries + 1)
+
+    # Edit a searched field
+    phone_number = calls[0].initiate.phone_number
+    await db.call_search_all(count=10, phone_number=phone_number)
+    async with Scheduler() as scheduler:
+        async with db.call_transac(
+            call=calls[0],
+            scheduler=scheduler,
+        ):
+            calls[0].in_progress = True
+        await db.call_flush(calls[0])
+    queries = db.container.queries
+    _, total = await db.call_search_all(count=10, phone_number=phone_number)
+    assume(total == 3)  # noqa: PLR2004
+    assume(db.container.queries == queries + 2)
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_archive(random_text: str) -> None:
+    """
+    Test the older messages are archived, and loaded back.
+
+    Steps:
+    1. Create a call, in a local store with a window of 10 messages
+    2. Append dozens of messages, in consecutive transactions
+    3. Check the call document and the call keep only the last messages
+    4. Export the call, check the whole conversation is exported, in order
+    5. Load the messages of the call, check the whole conversation is back, in order
+    """
+    db = CosmosDbStoreMock(messages_window=10)
+    call = CallStateModel(
+        initiate=CallInitiateModel(
+            **CONFIG.conversation.initiate.model_dump(),
+            phone_number="+33612345678",  # pyright: ignore
+        ),
+    )
+    await db.call_create(call)
+
+    # Append messages
+    expected: list[str] = []
+    async with Scheduler() as scheduler:
+        for i in range(45):
+            async with db.call_transac(
+                call=call,
+                scheduler=scheduler,
+            ):
+                call.messages.append(
+                    MessageModel(
+                        content=f"{random_text} {i}",
+                        persona=(
+                            MessagePersonaEnum.HUMAN
+                            if i % 2
+                            else MessagePersonaEnum.ASSISTANT
+                        ),
+                    )
+                )
+            expected.append(f"{random_text} {i}")
+            await db.call_flush(call)
+
+    # Check the window
+    document = db.container.documents[str(call.call_id)]
+    assume(len(document["messages"]) < 20)  # noqa: PLR2004
+    assume(document["messages_archived"] + len(document["messages"]) == len(expected))
+    assume(call.messages_archived == document["messages_archived"])
+    assume(
+        [message.content for message in call.messages]
+        == expected[call.messages_archived :]
+    )
+
+    # Export the call, with the whole conversation
+    exported = [call async for page in db.call_export() for call in page]
+    assume(len(exported) == 1)
+    assume([message.content for message in exported[0].messages] == expected)
+
+    # Load the conversation
+    await db.call_load_messages(call)
+    assume([message.content for message in call.messages] == expected)
+
+
+def test_changes(random_text: str) -> None:
+    """
+    Test the changes of a call since a snapshot.
+
+    Steps:
+    1. Create a call with messages
+    2. Check no changes are reported without edit
+    3. Append messages and edit a field
+    4. Check only the new messages are reported as appended, and the field as updated
+    5. Remove a message
+    6. Check the messages are reported as updated
+    """
+    call = CallStateModel(
+        initiate=CallInitiateModel(
+            **CONFIG.conversation.initiate.model_dump(),
+            phone_number="+33612345678",  # pyright: ignore
+        ),
+        messages=[
+            MessageModel(
+                content=f"Message {i}",
+                persona=(
+                    MessagePersonaEnum.HUMAN if i % 2 else MessagePersonaEnum.ASSISTANT
+                ),
+            )
+            for i in range(10)
+        ],
+    )
+
+    # No edit
+    snapshot = call.snapshot()
+    assume(call.changes(snapshot) == ({}, {}))
+
+    # Append and edit
+    call.messages.append(
+        MessageModel(
+            content=random_text,
+            persona=MessagePersonaEnum.HUMAN,
+        )
+    )
+    call.voice_id = random_text
+    updated, appended = call.changes(snapshot)
+    assume(updated == {"voice_id": random_text})
+    assume(list(appended) == ["messages"])
+    assume([message["content"] for message in appended["messages"]] == [random_text])
+
+    # Remove
+    snapshot = call.snapshot()
+    call.messages.pop(0)
+    updated, appended = call.changes(snapshot)
+    assume(not appended)
+    assume(len(updated["messages"]) == 10)  # noqa: PLR2004